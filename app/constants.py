@@ -1,6 +1,7 @@
 from datetime import date
 from enum import Enum
 import json
+import os.path
 
 
 # sqlite3 не поддерживает тип даты и времени - поэтому даты будут сохранены, как кол-во дней от основания
@@ -9,6 +10,28 @@ DATE_BASEMENT = date(2000, 1, 1)
 DB_SERVER_HOST = 'localhost'
 DB_SERVER_PORT = 8866
 DB_META_COMMAND = ["meta"]
+# статистика сервера БД: кэш ответов, время этапов обработки запросов, соединения
+DB_STATS_COMMAND = ["stats"]
+# запрос нескольких периодов за одно обращение: [DB_BATCH_COMMAND, [[дата начала, дата конца], ...]]
+DB_BATCH_COMMAND = "batch"
+# ряд данных по интервалам внутри периода: [DB_SERIES_COMMAND, дата начала, дата конца, SeriesBucket.value]
+DB_SERIES_COMMAND = "series"
+# таймаут ожидания ответа сервера БД, секунд
+DB_SERVER_TIMEOUT = 30
+# файл общего для процессов кэша ответов, см. app.shared_cache
+SHARED_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "shared_cache.bin")
+# максимальное количество простаивающих соединений с сервером БД в пуле одного процесса django
+DB_POOL_SIZE = 8
+# максимальное количество одновременно открытых соединений асинхронных представлений в одном цикле событий,
+# остальные запросы ожидают освобождения соединения, не занимая поток
+DB_ASYNC_CONNECTIONS = 64
+
+
+# интервал разбиения периода для ряда данных
+class SeriesBucket(Enum):
+    day = "day"
+    week = "week"    # неделя ISO 8601, начинается с понедельника
+    month = "month"
 
 
 # типы заявок для html таблицы - данные имена должны быть определены и на клиентской стороне
@@ -0,0 +1,164 @@
+"""
+Протокол обмена с сервером БД
+Сообщение (кадр) - 4 байта длины (little endian) и данные указанной длины, не больше MAX_FRAME_SIZE
+Соединение постоянное: по одному соединению последовательно передается любое количество запросов и ответов,
+сервер закрывает соединение, когда клиент закрыл свою сторону
+
+Версии протокола:
+PROTOCOL_JSON - запросы и ответы в формате json
+PROTOCOL_BINARY - дополнительно запрос за период и ответ на него в двоичном виде, см. encode_period_request
+Версия согласуется для каждого соединения: клиент первым кадром отправляет [HELLO_COMMAND, версия клиента],
+сервер отвечает [принятая версия, null]. Без согласования соединение работает по PROTOCOL_JSON
+Двоичные кадры начинаются с кода операции, который не может быть первым байтом json - поэтому сервер
+различает форматы по первому байту и не хранит состояние соединения
+"""
+
+
+import asyncio
+import json
+import socket
+import struct
+from typing import List, Optional, Tuple, Union
+
+
+# заголовок кадра - длина данных
+_HEADER = struct.Struct("<I")
+# наибольшая длина данных кадра: буфер под кадр выделяется по объявленной длине до чтения данных
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+PROTOCOL_JSON = 1
+PROTOCOL_BINARY = 2
+PROTOCOL_VERSION = PROTOCOL_BINARY
+HELLO_COMMAND = "hello"
+
+# код операции двоичного запроса за период
+_PERIOD_OPCODE = 1
+# запрос: код операции, день начала и день конца периода (дни от DATE_BASEMENT)
+_PERIOD_REQUEST = struct.Struct("<Bii")
+# ответ: статус, маска значений null, 9 счетчиков (8 сумм и количество пользователей)
+_PERIOD_ANSWER = struct.Struct("<BH9q")
+_STATUS_OK = 0
+_STATUS_ERROR = 1
+
+
+class ConnectionClosedError(ConnectionError):
+    """Соединение закрыто другой стороной посреди кадра"""
+
+
+class FrameTooLargeError(ConnectionError):
+    """Объявленная длина кадра больше MAX_FRAME_SIZE - соединение не может продолжаться"""
+
+
+def _frame_size(header: bytes) -> int:
+    size, = _HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise FrameTooLargeError(f"длина кадра {size} больше {MAX_FRAME_SIZE}")
+    return size
+
+
+def _recv_into(sock: socket.socket, view: memoryview):
+    read, size = 0, len(view)
+    while read < size:
+        received = sock.recv_into(view[read:])
+        if not received:
+            raise ConnectionClosedError(f"получено {read} байт из {size}")
+        read += received
+
+
+def pack_frame(data: bytes) -> bytes:
+    return _HEADER.pack(len(data)) + data
+
+
+def send_frame(sock: socket.socket, data: bytes):
+    sock.sendall(pack_frame(data))
+
+
+def recv_frame(sock: socket.socket) -> Optional[bytearray]:
+    """
+    Читает один кадр в заранее выделенный буфер объявленной длины
+    :param sock:
+    :return: данные кадра, None - соединение закрыто другой стороной между кадрами
+    :raise FrameTooLargeError: объявленная длина кадра больше MAX_FRAME_SIZE
+    """
+    header = bytearray(_HEADER.size)
+    received = sock.recv_into(header)
+    if not received:
+        return None
+    if received < _HEADER.size:
+        _recv_into(sock, memoryview(header)[received:])
+    data = bytearray(_frame_size(header))
+    _recv_into(sock, memoryview(data))
+    return data
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[bytes]:
+    """
+    Асинхронный аналог recv_frame
+    :param reader:
+    :return: данные кадра, None - соединение закрыто другой стороной между кадрами
+    :raise FrameTooLargeError: объявленная длина кадра больше MAX_FRAME_SIZE
+    """
+    try:
+        header = await reader.readexactly(_HEADER.size)
+    except asyncio.IncompleteReadError as err:
+        if not err.partial:
+            return None
+        raise ConnectionClosedError(f"получено {len(err.partial)} байт из {_HEADER.size}") from err
+    size = _frame_size(header)
+    try:
+        return await reader.readexactly(size)
+    except asyncio.IncompleteReadError as err:
+        raise ConnectionClosedError(f"получено {len(err.partial)} байт из {size}") from err
+
+
+def hello_request(version: int = PROTOCOL_VERSION) -> bytes:
+    return json.dumps([HELLO_COMMAND, version]).encode(encoding="utf-8")
+
+
+def accepted_version(answer: bytes) -> int:
+    """
+    Разбирает ответ сервера на HELLO_COMMAND
+    :param answer:
+    :return: принятая сервером версия, PROTOCOL_JSON - если сервер не поддерживает согласование
+    """
+    try:
+        version, error = json.loads(answer)
+    except (ValueError, TypeError):
+        return PROTOCOL_JSON
+    if error is not None or not isinstance(version, int):
+        return PROTOCOL_JSON
+    return version
+
+
+def is_period_request(request: bytes) -> bool:
+    return request[:1] == bytes((_PERIOD_OPCODE,))
+
+
+def encode_period_request(min_int: int, max_int: int) -> bytes:
+    return _PERIOD_REQUEST.pack(_PERIOD_OPCODE, min_int, max_int)
+
+
+def decode_period_request(request: bytes) -> Tuple[int, int]:
+    _, min_int, max_int = _PERIOD_REQUEST.unpack(request)
+    return min_int, max_int
+
+
+def encode_period_answer(period_data: Optional[List[Optional[int]]], error: Optional[str]) -> bytes:
+    if error is not None:
+        return bytes((_STATUS_ERROR,)) + error.encode(encoding="utf-8")
+    nulls = 0
+    for i, value in enumerate(period_data):
+        if value is None:
+            nulls |= 1 << i
+    return _PERIOD_ANSWER.pack(_STATUS_OK, nulls, *(value or 0 for value in period_data))
+
+
+def decode_period_answer(answer: bytes) -> Union[Tuple[List[Optional[int]], None], Tuple[None, str]]:
+    """
+    :param answer: двоичный ответ сервера на запрос за период
+    :return: кортеж (данные за период, ошибка) - как в json ответе
+    """
+    if answer[0] == _STATUS_ERROR:
+        return None, bytes(answer[1:]).decode(encoding="utf-8")
+    _, nulls, *values = _PERIOD_ANSWER.unpack(answer)
+    return [None if nulls >> i & 1 else value for i, value in enumerate(values)], None
@@ -0,0 +1,147 @@
+"""
+Общий для процессов кэш готовых ответов сервера БД в файле, отображаемом в память (mmap)
+Сервер БД публикует ответ на DB_META_COMMAND и ответы за частые периоды, процессы django читают их
+напрямую, без обращения к серверу БД
+
+Формат файла (размер фиксирован - SHARED_CACHE_SIZE):
+заголовок - сигнатура, поколение, длина данных, количество записей
+данные - meta, таблица записей (день начала, день конца, смещение, длина), ответы в формате json
+Поколение работает как seqlock: нечетное - идет запись, читатель сверяет поколение до и после чтения
+"""
+
+
+import mmap
+import os
+import struct
+import time
+from typing import Dict, Optional, Tuple
+
+
+SHARED_CACHE_SIZE = 1024 * 1024
+
+_MAGIC = b"RPC1"
+_HEADER = struct.Struct("<4sQII")
+_META_LEN = struct.Struct("<I")
+_ENTRY = struct.Struct("<iiII")
+# интервал повторной попытки открыть отсутствующий файл, секунд
+_REOPEN_INTERVAL = 1.0
+
+
+def _open_for_write(path: str) -> mmap.mmap:
+    with open(path, "a+b") as f:
+        if os.fstat(f.fileno()).st_size != SHARED_CACHE_SIZE:
+            f.truncate(SHARED_CACHE_SIZE)
+        return mmap.mmap(f.fileno(), SHARED_CACHE_SIZE)
+
+
+def _write(path: str, body: bytes, entries_qnt: int):
+    shared = _open_for_write(path)
+    try:
+        magic, generation, _, _ = _HEADER.unpack_from(shared)
+        # четное поколение, от которого отсчитывается новое (нечетное - прерванная запись)
+        generation = generation + generation % 2 if magic == _MAGIC else 0
+        # нечетное поколение на время записи
+        _HEADER.pack_into(shared, 0, _MAGIC, generation + 1, 0, 0)
+        shared[_HEADER.size:_HEADER.size + len(body)] = body
+        _HEADER.pack_into(shared, 0, _MAGIC, generation + 2, len(body), entries_qnt)
+        shared.flush()
+    finally:
+        shared.close()
+
+
+def publish(path: str, meta: bytes, answers: Dict[Tuple[int, int], bytes]) -> int:
+    """
+    Записывает новое поколение кэша, ответы, не поместившиеся в SHARED_CACHE_SIZE, отбрасываются
+    :param path: путь к файлу кэша
+    :param meta: ответ на DB_META_COMMAND
+    :param answers: ответы в формате json по парам (день начала, день конца)
+    :return: количество записанных ответов
+    """
+    capacity = SHARED_CACHE_SIZE - _HEADER.size - _META_LEN.size - len(meta)
+    if capacity < 0:
+        invalidate(path)
+        return 0
+    stored, blobs_size = [], 0
+    for key, answer in answers.items():
+        if (len(stored) + 1) * _ENTRY.size + blobs_size + len(answer) > capacity:
+            break
+        stored.append((key, answer))
+        blobs_size += len(answer)
+
+    offset = _HEADER.size + _META_LEN.size + len(meta) + len(stored) * _ENTRY.size
+    table, blobs = bytearray(), []
+    for (min_int, max_int), answer in stored:
+        table += _ENTRY.pack(min_int, max_int, offset, len(answer))
+        blobs.append(answer)
+        offset += len(answer)
+    _write(path, _META_LEN.pack(len(meta)) + meta + table + b"".join(blobs), entries_qnt=len(stored))
+    return len(stored)
+
+
+def invalidate(path: str):
+    """Записывает пустое поколение кэша - читатели перестают использовать прежние ответы"""
+    _write(path, b"", entries_qnt=0)
+
+
+class SharedCacheReader:
+    """
+    Читатель кэша, один на процесс
+    Таблица записей разбирается один раз на поколение, ответы копируются из файла при каждом чтении
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._map: Optional[mmap.mmap] = None
+        self._next_open = 0.0
+        # (поколение, meta, записи) - заменяется целиком, чтобы потоки видели согласованное состояние
+        self._state: Tuple[int, Optional[bytes], Dict] = (0, None, dict())
+
+    def _mapped(self) -> Optional[mmap.mmap]:
+        if self._map is None and time.monotonic() >= self._next_open:
+            self._next_open = time.monotonic() + _REOPEN_INTERVAL
+            try:
+                with open(self._path, "rb") as f:
+                    if os.fstat(f.fileno()).st_size == SHARED_CACHE_SIZE:
+                        self._map = mmap.mmap(f.fileno(), SHARED_CACHE_SIZE, access=mmap.ACCESS_READ)
+            except OSError:
+                return None
+        return self._map
+
+    def _current(self) -> Optional[Tuple[int, Optional[bytes], Dict]]:
+        shared = self._mapped()
+        if shared is None:
+            return None
+        magic, generation, body_len, entries_qnt = _HEADER.unpack_from(shared)
+        if magic != _MAGIC or generation % 2:
+            return None
+        if generation == self._state[0]:
+            return self._state
+        meta, entries = None, dict()
+        if body_len:
+            meta_len, = _META_LEN.unpack_from(shared, _HEADER.size)
+            meta_start = _HEADER.size + _META_LEN.size
+            meta = shared[meta_start:meta_start + meta_len]
+            for i in range(entries_qnt):
+                min_int, max_int, offset, length = _ENTRY.unpack_from(shared, meta_start + meta_len + i * _ENTRY.size)
+                entries[(min_int, max_int)] = (offset, length)
+        if _HEADER.unpack_from(shared)[1] != generation:
+            return None
+        self._state = (generation, meta, entries)
+        return self._state
+
+    def meta(self) -> Optional[bytes]:
+        state = self._current()
+        return None if state is None else state[1]
+
+    def period(self, min_int: int, max_int: int) -> Optional[bytes]:
+        """
+        :param min_int: день начала периода
+        :param max_int: день конца периода
+        :return: ответ в формате json, None - ответа нет в кэше или кэш в этот момент перезаписывается
+        """
+        state = self._current()
+        if state is None or (min_int, max_int) not in state[2]:
+            return None
+        offset, length = state[2][(min_int, max_int)]
+        answer = self._map[offset:offset + length]
+        return answer if _HEADER.unpack_from(self._map)[1] == state[0] else None
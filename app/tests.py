@@ -2,27 +2,67 @@
 Модуль для тестирования
 Запускать через терминал: python manage.py test
 Для перед запуском тестов происходит запуск сервера ДБ в отдельном потоке
+Реализация сервера задается переменной окружения DB_SERVER_MODE (threading | asyncio), по умолчанию threading
 Не запускать тесты при работающем сервере приложений
 """
 
 
 from threading import Thread
 from queue import Queue
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, ExitStack
+from datetime import date, datetime
+from functools import partial
+from multiprocessing import get_context
+from typing import Optional
+from unittest import mock
+import asyncio
+import csv
 import os.path
+import random
+import socket
+import sqlite3
+import struct
 import sys
 import json
-from django.test import TestCase, Client
+import tempfile
+import threading
+import time
+import openpyxl
+from asgiref.sync import sync_to_async
+from django.test import TestCase, Client, AsyncRequestFactory
 from django.urls import reverse
+from app import shared_cache, views
+from app.constants import DATE_BASEMENT, DB_ASYNC_CONNECTIONS, DB_SERVER_HOST, DB_SERVER_PORT, SeriesBucket
+from app.protocol import send_frame, recv_frame, hello_request, accepted_version, encode_period_request, \
+    encode_period_answer, decode_period_answer, MAX_FRAME_SIZE, FrameTooLargeError, PROTOCOL_JSON, PROTOCOL_BINARY
+import support_db_requests
+import support_file_reader
+import support_initializer as si
+from support_async_server import run_async_server
+from support_db_requests import db_communicate
+from support_file_reader import read_data_from_file, _parse_creation, _CREATION_FORMAT
+from support_initializer import initialize_data, _date_to_int, _first_insertion, _insert_users, _insert_packages, \
+    _request_period_data, _request_batch_data, _request_series_data, _upgrade_schema, _SCHEMA_VERSION, \
+    _ResponseCache, _CACHE_ENTRY_OVERHEAD
+from support_period_index import build_period_index, bucket_bounds, DistinctPackagesIndex, PACKAGES_COUNTER
+from support_profiler import stage, start_profile, finish_profile
+from support_server_stats import ServerStats, Stage, RequestKind
+from support_xlsx_reader import XlsxStreamSheet
+
+
+def parent_dir():
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 
 
 def run_server():
     """Функция запуска сервера ДБ в отдельном потоке для тестирования"""
-    parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-    sys.path.insert(0, parent_dir)
-    from support_initializer import run_socketserver
+    sys.path.insert(0, parent_dir())
+    from support_initializer import run_socketserver, ServerMode
 
     queue = Queue()
-    thread = Thread(target=run_socketserver, args=(queue,))
+    mode = ServerMode(os.environ.get("DB_SERVER_MODE", ServerMode.threading.value))
+    thread = Thread(target=run_socketserver, args=(queue,), kwargs=dict(mode=mode))
     thread.daemon = True
     thread.start()
     error = queue.get()
@@ -35,6 +75,20 @@ def run_server():
 run_server()
 
 
+@contextmanager
+def temp_data(source: Optional[str] = None):
+    """
+    Временная БД и исходный файл вместо рабочих на время теста
+    :param source: имя исходного файла или каталога во временном каталоге, None - исходный файл прежний
+    :return: путь к временному каталогу
+    """
+    with tempfile.TemporaryDirectory() as tmp, ExitStack() as stack:
+        stack.enter_context(mock.patch.object(support_db_requests, "_DB_PATH", os.path.join(tmp, "db.sqlite3")))
+        if source is not None:
+            stack.enter_context(mock.patch.object(support_file_reader, "_SOURCE_FILE", os.path.join(tmp, source)))
+        yield tmp
+
+
 class SomeTests(TestCase):
     def setUp(self):
         self.client = Client()
@@ -54,7 +108,8 @@ class SomeTests(TestCase):
         self.assertEqual(data[2][4], 961)
         self.assertEqual(data[2][5], 8)
         self.assertEqual(data[2][6], 41)
-        self.assertEqual(data[2][7], 125)
+        # пакетов 125 по дням, два пакета встречаются в двух днях
+        self.assertEqual(data[2][7], 123)
         self.assertEqual(data[2][8], 21)
 
     def test_period_data_view(self):
@@ -71,5 +126,949 @@ class SomeTests(TestCase):
         self.assertEqual(answer_data[4], 961)
         self.assertEqual(answer_data[5], 8)
         self.assertEqual(answer_data[6], 41)
-        self.assertEqual(answer_data[7], 125)
+        self.assertEqual(answer_data[7], 123)
         self.assertEqual(answer_data[8], 21)
+
+
+class PeriodIndexTests(TestCase):
+    def test_index_matches_sql(self):
+        period_index, error = db_communicate(build_period_index, commit=False)
+        self.assertIsNone(error)
+        min_int, max_int = period_index.min_date, period_index.max_date
+        ranges = [(min_int, max_int), (min_int - 10, max_int + 10), (min_int + 5, min_int + 40),
+                  (max_int, max_int), (max_int + 1, max_int + 30), (min_int - 30, min_int - 1)]
+        for low, high in ranges:
+            expected, error = db_communicate(_request_period_data, commit=False, min_int=low, max_int=high)
+            self.assertIsNone(error)
+            self.assertEqual(period_index.period_data(low, high), expected, (low, high))
+
+    def test_distinct_users_index(self):
+        period_index, error = db_communicate(build_period_index, commit=False)
+        self.assertIsNone(error)
+        min_int, max_int = period_index.min_date, period_index.max_date
+        # значение из test_period_data_view
+        self.assertEqual(period_index.users.count(min_int, max_int), 21)
+        for low in range(min_int - 1, max_int + 2, 7):
+            for high in range(low, max_int + 2, 11):
+                expected, error = db_communicate(_request_period_data, commit=False, min_int=low, max_int=high)
+                self.assertEqual(period_index.users.count(low, high), expected[-1], (low, high))
+
+    def test_distinct_packages_index(self):
+        period_index, error = db_communicate(build_period_index, commit=False)
+        self.assertIsNone(error)
+        min_int, max_int = period_index.min_date, period_index.max_date
+        # значение из test_period_data_view: пакет нескольких дней учитывается один раз
+        self.assertEqual(period_index.packages.count(min_int, max_int), 123)
+        for low in range(min_int - 1, max_int + 2, 7):
+            for high in range(low, max_int + 2, 11):
+                expected, error = db_communicate(_request_period_data, commit=False, min_int=low, max_int=high)
+                self.assertEqual(period_index.packages.count(low, high), expected[PACKAGES_COUNTER] or 0, (low, high))
+
+    def test_packages_sketch_error(self):
+        # пакет активен от 1 до 10 дней подряд, 200 новых пакетов в день
+        rnd, rows = random.Random(3), []
+        for package_id in range(200 * 200):
+            first = package_id // 200
+            rows.extend((dt, package_id) for dt in range(first, min(first + rnd.randint(1, 10), 200)))
+        rows.sort()
+        daily = [set() for _ in range(200)]
+        for dt, package_id in rows:
+            daily[dt].add(package_id)
+        index = DistinctPackagesIndex(min_date=0, max_date=199, rows=rows, exact_limit=20000)
+        for low, high in ((0, 199), (0, 6), (100, 102), (37, 150), (199, 199), (120, 190)):
+            expected = len(set().union(*daily[low:high + 1]))
+            counted = index.count(low, high)
+            if sum(len(day) for day in daily[low:high + 1]) <= 20000:
+                self.assertEqual(counted, expected, (low, high))
+                self.assertEqual(index.exact_size(low, high), sum(len(day) for day in daily[low:high + 1]))
+            else:
+                self.assertEqual(index.exact_size(low, high), 0)
+                # стандартная ошибка оценки ~1.6%, допуск - 5 стандартных ошибок
+                self.assertLess(abs(counted - expected) / expected, 0.08, (low, high))
+
+
+class XlsxStreamReaderTests(TestCase):
+    def test_same_data_as_openpyxl(self):
+        fast_data, fast_error = read_data_from_file(fast=True)
+        openpyxl_data, openpyxl_error = read_data_from_file(fast=False)
+        self.assertIsNone(fast_error)
+        self.assertIsNone(openpyxl_error)
+        self.assertEqual(ParallelCollectTests._normalized(fast_data), ParallelCollectTests._normalized(openpyxl_data))
+
+    def test_cell_types_as_openpyxl(self):
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.title = "Data"
+        ws.append(["текст", 1, 2.5, True, datetime(2023, 5, 17, 10, 30), None, "  пробелы  "])
+        ws.append([])
+        ws.append([None, "=1+1", 10 ** 12, datetime(2023, 8, 22)])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cells.xlsx")
+            wb.save(path)
+            wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+            expected = list(wb["Data"].iter_rows(values_only=True))
+            wb.close()
+            with XlsxStreamSheet(filename=path, sheet_name="Data") as sheet:
+                self.assertEqual(list(sheet.iter_rows(values_only=True)), expected)
+                self.assertEqual(list(sheet.iter_rows(min_row=2, max_row=3, values_only=True)), expected[1:3])
+
+
+class ParallelCollectTests(TestCase):
+    @staticmethod
+    def _normalized(data):
+        min_date, max_date, users, requests_qnt, packages = data
+        return min_date, max_date, sorted(users), list(requests_qnt), sorted(packages)
+
+    def test_same_data_as_serial(self):
+        serial_data, serial_error = support_file_reader.read_data_from_file(workers=1)
+        self.assertIsNone(serial_error)
+        with mock.patch.object(support_file_reader, "_CHUNK_ROWS", 100), \
+                mock.patch.object(support_file_reader, "_BLOCK_BYTES", 1 << 15):
+            for fast in (True, False):
+                data, error = support_file_reader.read_data_from_file(fast=fast, workers=2)
+                self.assertIsNone(error)
+                self.assertEqual(self._normalized(data), self._normalized(serial_data))
+
+    def test_error_row_as_serial(self):
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.title = "Data"
+        ws.append(["Лишняя колонка", "Состояние заявки", "Статус заявки", "Автор заявки",
+                   "Дата создания заявки", "ID пакета"])
+        for i in range(300):
+            creation = "32.05.2023 10:00:00" if i in (170, 250) else "17.05.2023 10:00:00"
+            ws.append([None, "ДОБАВЛЕНИЕ", "Обработка завершена", f"Автор {i % 7}", creation, f"П{i % 11}"])
+        with temp_data(source="broken.xlsx"), mock.patch.object(support_file_reader, "_CHUNK_ROWS", 50), \
+                mock.patch.object(support_file_reader, "_BLOCK_BYTES", 1 << 12):
+            wb.save(support_file_reader._SOURCE_FILE)
+            for fast in (True, False):
+                _, serial_error = support_file_reader.read_data_from_file(fast=fast, workers=1)
+                _, parallel_error = support_file_reader.read_data_from_file(fast=fast, workers=3)
+                self.assertIn("Строка 172, Столбец 5", serial_error)
+                self.assertEqual(parallel_error, serial_error)
+
+
+class CreationDateParsingTests(TestCase):
+    def test_same_as_strptime(self):
+        values = ["17.05.2023 10:00:00", "17.05.2023 23:59:59", "18.05.2023 10:00:00", "17.05.2023 10:00:00",
+                  "1.5.2023 10:00:00", "01.05.2023  1:00:00", "32.05.2023 10:00:00", "17.05.2023 24:00:00",
+                  "17.05.2023 10:00:0x", "17.05.2023T10:00:00", "17.05.2023 10:00", "2023-05-17 10:00:00",
+                  "17.05.2023 10:00:00 ", ""]
+        dates, times = dict(), set()
+        # дважды - второй проход идет по запомненным частям
+        for value in values * 2:
+            try:
+                expected = datetime.strptime(value, _CREATION_FORMAT).date()
+            except ValueError:
+                with self.assertRaises(ValueError):
+                    _parse_creation(value, dates=dates, times=times)
+            else:
+                self.assertEqual(_parse_creation(value, dates=dates, times=times), expected)
+
+
+class SourceFormatsTests(TestCase):
+    @staticmethod
+    def _xlsx_rows():
+        with XlsxStreamSheet(filename=support_file_reader._SOURCE_FILE,
+                             sheet_name=support_file_reader._SHEET_WITH_DATA) as ws:
+            return list(ws.iter_rows())
+
+    def _read(self, path, workers=1, source_format=None):
+        with mock.patch.object(support_file_reader, "_SOURCE_FILE", path), \
+                mock.patch.object(support_file_reader, "_SOURCE_FORMAT", source_format):
+            return support_file_reader.read_data_from_file(workers=workers)
+
+    def test_csv_same_data_as_xlsx(self):
+        xlsx_data, error = support_file_reader.read_data_from_file()
+        self.assertIsNone(error)
+        with tempfile.TemporaryDirectory() as tmp:
+            for delimiter in (",", ";", "\t"):
+                path = os.path.join(tmp, "data.csv")
+                with open(path, "w", newline="", encoding="utf-8-sig") as f:
+                    # лишняя строка перед заголовком, как в xlsx файле может быть шапка
+                    csv.writer(f, delimiter=delimiter).writerows([["Отчет"]] + self._xlsx_rows())
+                for workers in (1, 2):
+                    data, error = self._read(path, workers=workers)
+                    self.assertIsNone(error)
+                    self.assertEqual(ParallelCollectTests._normalized(data),
+                                     ParallelCollectTests._normalized(xlsx_data))
+
+    def test_csv_errors(self):
+        header = ["Состояние заявки", "Статус заявки", "Автор заявки", "Дата создания заявки", "ID пакета"]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "data.txt")
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerows([header, ["ДОБАВЛЕНИЕ", "Черновик", "Автор", "17.05.2023 10:00:00", "П1"],
+                                         ["ДОБАВЛЕНИЕ", "Черновик", "Автор", "32.05.2023 10:00:00", "П1"]])
+            _, error = self._read(path, source_format=support_file_reader.SourceFormat.csv)
+            self.assertIn("Строка 3, Столбец 4", error)
+            # без явного формата неизвестное расширение читается как xlsx
+            _, error = self._read(path)
+            self.assertIn("не является файлом формата xlsx", error)
+
+            with open(path, "wb") as f:
+                f.write(b"\xff\xfe" + "Автор".encode("utf-16-le"))
+            _, error = self._read(path, source_format=support_file_reader.SourceFormat.csv)
+            self.assertIn("не является csv файлом", error)
+            _, error = self._read(os.path.join(tmp, "missing.csv"))
+            self.assertIn("не существует", error)
+
+    def test_parquet_same_data_as_xlsx(self):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            self.skipTest("pyarrow не установлен")
+        xlsx_data, _ = support_file_reader.read_data_from_file()
+        header, *rows = self._xlsx_rows()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "data.parquet")
+            columns = [[row[i] if isinstance(row[i], str) or row[i] is None else str(row[i]) for row in rows]
+                       for i in range(len(header))]
+            pyarrow.parquet.write_table(pyarrow.table(columns, names=header), path)
+            data, error = self._read(path)
+            self.assertIsNone(error)
+            self.assertEqual(ParallelCollectTests._normalized(data), ParallelCollectTests._normalized(xlsx_data))
+
+
+class IncrementalLoadTests(TestCase):
+    _HEADER = ["Состояние заявки", "Статус заявки", "Автор заявки", "Дата создания заявки", "ID пакета"]
+
+    def _save_workbook(self, path, days):
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.title = "Data"
+        ws.append(self._HEADER)
+        for day, rows_qnt in days:
+            for i in range(rows_qnt):
+                ws.append(["ДОБАВЛЕНИЕ" if i % 2 else "РАСШИРЕНИЕ", "Обработка завершена",
+                           f"Автор {i % 3}", f"{day:02}.05.2023 10:00:00", f"П{i % 4}"])
+        wb.save(path)
+
+    @staticmethod
+    def _dump(cursor):
+        users = cursor.execute("SELECT date, fio FROM users JOIN users_dim ON users_dim.id = users.user_id")
+        return [sorted(users.fetchall())] + [sorted(cursor.execute(f"SELECT * FROM {table}").fetchall())
+                                             for table in ("requests", "date_range", "ingest_days")]
+
+    def test_incremental_equals_rebuild(self):
+        with temp_data(source="source.xlsx"), \
+                mock.patch("support_initializer.read_data_from_file", wraps=read_data_from_file) as read_mock:
+            source = support_file_reader._SOURCE_FILE
+            self._save_workbook(source, days=[(17, 5), (18, 3), (19, 4)])
+            self.assertEqual(initialize_data(), (None, None))
+            self.assertEqual(initialize_data(), (None, None))
+            self.assertEqual(read_mock.call_count, 1)
+
+            self._save_workbook(source, days=[(18, 3), (19, 6), (21, 2)])
+            self.assertEqual(initialize_data(), (None, None))
+            self.assertEqual(read_mock.call_count, 2)
+            incremental, error = db_communicate(self._dump, commit=False)
+            self.assertIsNone(error)
+
+            self.assertEqual(initialize_data(rebuild=True), (None, None))
+            rebuilt, error = db_communicate(self._dump, commit=False)
+            self.assertIsNone(error)
+            self.assertEqual(incremental, rebuilt)
+
+
+class IngestProfileTests(TestCase):
+    def test_profile_report(self):
+        # без запуска профилирования этапы не измеряются
+        with stage("collect") as current:
+            current.rows = 1
+        with temp_data() as tmp:
+            report_path = os.path.join(tmp, "profile.json")
+            start_profile(cprofile=True)
+            _, error = initialize_data(rebuild=True)
+            report = finish_profile(report_path=report_path, error=error)
+            self.assertIsNone(error)
+            with open(report_path, encoding="utf-8") as f:
+                self.assertEqual(json.load(f), report)
+            self.assertTrue(os.path.exists(report["cprofile"]["file"]))
+
+        stages = {item["stage"]: item for item in report["stages"]}
+        self.assertEqual(list(stages), ["open", "check_columns", "collect", "transform", "fingerprints", "schema",
+                                        "insert_users_dim", "insert_users", "insert_packages_dim",
+                                        "insert_packages", "insert_requests", "create_indexes", "commit"])
+        self.assertEqual((stages["collect"]["calls"], stages["collect"]["rows"]), (1, 1016))
+        self.assertEqual(stages["insert_users_dim"]["rows"], 21)
+        self.assertEqual((stages["insert_packages_dim"]["rows"], stages["insert_packages"]["rows"]), (123, 125))
+        self.assertGreaterEqual(report["total_wall_s"], sum(item["wall_s"] for item in report["stages"]))
+        self.assertEqual(report["cprofile"]["stage"], max(report["stages"], key=lambda item: item["wall_s"])["stage"])
+
+
+class MultiFileLoadTests(TestCase):
+    _HEADER = IncrementalLoadTests._HEADER
+
+    @classmethod
+    def _save_csv(cls, path, rows):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(cls._HEADER)
+            for day, author, package in rows:
+                writer.writerow(["ДОБАВЛЕНИЕ", "Обработка завершена", author, f"{day:02}.05.2023 10:00:00", package])
+
+    @staticmethod
+    def _dump(cursor):
+        return IncrementalLoadTests._dump(cursor)[:3]
+
+    def test_source_format_in_spawned_workers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [os.path.join(tmp, name) for name in ("w1.txt", "w2.txt")]
+            self._save_csv(paths[0], [(17, "А", "П1")])
+            self._save_csv(paths[1], [(18, "Б", "П2")])
+            # процессы spawn не наследуют _SOURCE_FORMAT, без явной передачи файлы .txt читались бы как xlsx
+            spawn_executor = partial(ProcessPoolExecutor, mp_context=get_context("spawn"))
+            with mock.patch.object(support_file_reader, "_SOURCE_FORMAT", support_file_reader.SourceFormat.csv), \
+                    mock.patch.object(support_file_reader, "ProcessPoolExecutor", spawn_executor):
+                parts, error = support_file_reader.read_files_data(paths=paths, workers=2)
+        self.assertIsNone(error)
+        self.assertEqual([list(part) for part in parts], [[_date_to_int("2023-05-17")], [_date_to_int("2023-05-18")]])
+
+    def test_incremental_equals_rebuild(self):
+        with temp_data(source="exports"):
+            exports = support_file_reader._SOURCE_FILE
+            os.mkdir(exports)
+            first, second, third = (os.path.join(exports, name) for name in ("w1.csv", "w2.csv", "w3.csv"))
+            with mock.patch("support_initializer.read_files_data",
+                            wraps=support_file_reader.read_files_data) as read_mock:
+                # 18 число есть в обоих файлах, пакет П2 и автор Б - тоже
+                self._save_csv(first, [(17, "А", "П1"), (18, "А", "П2"), (18, "Б", "П2")])
+                self._save_csv(second, [(18, "Б", "П2"), (18, "В", "П3"), (19, "В", "П4")])
+                with open(os.path.join(exports, "readme.txt"), "w") as f:
+                    f.write("не исходный файл")
+                self.assertEqual(initialize_data(workers=2), (None, None))
+                self.assertEqual(initialize_data(), (None, None))
+                self.assertEqual(read_mock.call_count, 1)
+                data, error = db_communicate(self._dump, commit=False)
+                self.assertIsNone(error)
+                day_18 = [row for row in data[1] if row[0] == _date_to_int("2023-05-18")][0]
+                self.assertEqual(day_18[1], 4)
+                self.assertEqual(day_18[-1], 2)
+                self.assertEqual(len([row for row in data[0] if row[0] == day_18[0]]), 3)
+
+                # новый файл с днями других файлов, удаленный файл, файл с тем же содержимым
+                self._save_csv(third, [(19, "Г", "П4"), (21, "Г", "П5")])
+                os.remove(first)
+                os.utime(second, ns=(1, 1))
+                self.assertEqual(initialize_data(), (None, None))
+                self.assertEqual(read_mock.call_args_list[-2].kwargs["paths"], [third])
+                # второй файл не изменился, но содержит дни третьего и удаленного первого
+                self.assertEqual(read_mock.call_args_list[-1].kwargs["paths"], [second])
+                incremental, error = db_communicate(self._dump, commit=False)
+                self.assertIsNone(error)
+
+                self.assertEqual(initialize_data(rebuild=True), (None, None))
+                rebuilt, error = db_communicate(self._dump, commit=False)
+                self.assertIsNone(error)
+                self.assertEqual(incremental, rebuilt)
+
+            with mock.patch.object(support_file_reader, "_SOURCE_FILE", os.path.join(exports, "w*.csv")):
+                self.assertEqual(initialize_data(), (None, None))
+                by_glob, error = db_communicate(self._dump, commit=False)
+                self.assertEqual(by_glob, rebuilt)
+
+    def test_errors(self):
+        with temp_data(source="exports"):
+            exports = support_file_reader._SOURCE_FILE
+            os.mkdir(exports)
+            _, error = initialize_data()
+            self.assertIn("нет исходных файлов", error)
+            self._save_csv(os.path.join(exports, "a.csv"), [(17, "А", "П1")])
+            self._save_csv(os.path.join(exports, "b.csv"), [(32, "А", "П1")])
+            _, error = initialize_data(workers=2)
+            self.assertIn("b.csv - Строка 2", error)
+
+
+class HotReloadTests(TestCase):
+    def test_reload_swaps_data(self):
+        users_select = "SELECT COUNT(*) FROM users"
+        with temp_data(source="source.csv") as tmp:
+            source, db_path = support_file_reader._SOURCE_FILE, support_db_requests._DB_PATH
+            with mock.patch.object(si, "_period_index", None), mock.patch.object(si, "_meta_answer", b""), \
+                    mock.patch.object(si, "_response_cache", si._ResponseCache(max_bytes=10 ** 6)), \
+                    mock.patch.object(si, "invalidate_shared_cache") as invalidate_mock:
+                MultiFileLoadTests._save_csv(source, [(17, "А", "П1"), (18, "Б", "П2")])
+                self.assertEqual(si.initialize_data(), (None, None))
+                # кэши сбрасывает только переключение сервера на новые данные
+                self.assertEqual(invalidate_mock.call_count, 0)
+                snapshot, error = si._load_snapshot()
+                self.assertIsNone(error)
+                si._install_snapshot(*snapshot, shared=False)
+                self.assertEqual(invalidate_mock.call_count, 1)
+                watcher = si._SourceWatcher(interval=0, workers=1, shared=False)
+                self.assertFalse(watcher.changed())
+                old_meta = si._meta_answer
+
+                # запрос, начатый до перезагрузки, - открытая транзакция чтения
+                reader = sqlite3.connect(db_path)
+                reader.execute("BEGIN")
+                self.assertEqual(reader.execute(users_select).fetchone(), (2,))
+
+                MultiFileLoadTests._save_csv(source, [(17, "А", "П1"), (18, "Б", "П2"), (21, "В", "П3")])
+                # изменение замечено, перезагрузка - после того как файл не менялся в течение интервала
+                self.assertFalse(watcher.changed())
+                self.assertTrue(watcher.changed())
+                self.assertFalse(watcher.changed())
+                self.assertEqual(si._hot_reload(workers=1, shared=False), (None, None))
+                self.assertEqual(invalidate_mock.call_count, 2)
+
+                self.assertEqual(reader.execute(users_select).fetchone(), (2,))
+                reader.rollback()
+                self.assertEqual(reader.execute(users_select).fetchone(), (3,))
+                reader.close()
+                self.assertEqual(json.loads(old_meta)[1], "2023-05-18")
+                self.assertEqual(json.loads(si._meta_answer)[1], "2023-05-21")
+                max_int = si._date_to_int("2023-05-21")
+                self.assertEqual(json.loads(si._period_answer(max_int, max_int, binary=False))[0][0], 1)
+                self.assertFalse([name for name in os.listdir(tmp) if "shadow" in name])
+
+                # ошибка загрузки - сервер остается на прежних данных
+                meta = si._meta_answer
+                MultiFileLoadTests._save_csv(source, [(32, "А", "П1")])
+                _, error = si._hot_reload(workers=1, shared=False)
+                self.assertIn("Строка 2", error)
+                self.assertEqual(si._meta_answer, meta)
+                self.assertEqual(invalidate_mock.call_count, 2)
+                data, _ = db_communicate(lambda cursor: cursor.execute(users_select).fetchone(), commit=False)
+                self.assertEqual(data, (3,))
+                self.assertFalse([name for name in os.listdir(tmp) if "shadow" in name])
+
+    @staticmethod
+    def _reload_in_daemon(queue):
+        queue.put(si._hot_reload(workers=2, shared=False))
+
+    def test_reload_in_daemon_process(self):
+        users_select = "SELECT COUNT(*) FROM users"
+        with temp_data(source="source.csv"):
+            source = support_file_reader._SOURCE_FILE
+            MultiFileLoadTests._save_csv(source, [(17, "А", "П1")])
+            self.assertEqual(initialize_data(), (None, None))
+            MultiFileLoadTests._save_csv(source, [(17, "А", "П1"), (18, "Б", "П2")])
+            # процесс сервера БД из launch.py - демон
+            context = get_context("fork")
+            queue = context.Queue()
+            process = context.Process(target=self._reload_in_daemon, args=(queue,), daemon=True)
+            process.start()
+            process.join(60)
+            self.assertEqual(process.exitcode, 0)
+            self.assertEqual(queue.get(timeout=5), (None, None))
+            data, _ = db_communicate(lambda cursor: cursor.execute(users_select).fetchone(), commit=False)
+            self.assertEqual(data, (2,))
+
+
+class ConnectionPoolTests(TestCase):
+    def setUp(self):
+        self.pool = views._pool
+        self.pool._clear()
+        self.client = Client()
+
+    def test_connection_reused(self):
+        url = reverse('period_data')
+        data = json.dumps(["2023-05-17", "2023-06-17"])
+        self.client.post(url, data, content_type='application/json')
+        self.assertEqual(len(self.pool._idle), 1)
+        sock = self.pool._idle[0]
+        for _ in range(3):
+            response = self.client.post(url, data, content_type='application/json')
+            self.assertIsNone(response.json()[1])
+        self.assertEqual(self.pool._idle, [sock])
+
+    def test_closed_connection_replaced(self):
+        url = reverse('meta')
+        self.client.get(url)
+        stale = self.pool._idle[0]
+        stale.shutdown(socket.SHUT_RDWR)
+        closed_by_peer, other_end = socket.socketpair()
+        other_end.close()
+        self.pool._idle.append(closed_by_peer)
+
+        response = self.client.get(url)
+        self.assertEqual(response.json()[0], "2023-05-17")
+        self.assertNotIn(stale, self.pool._idle)
+        self.assertNotIn(closed_by_peer, self.pool._idle)
+
+    def test_timeout_not_retried(self):
+        address = (DB_SERVER_HOST, DB_SERVER_PORT + 2)
+        pool = views._ConnectionPool(address=address, max_idle=1, timeout=0.2)
+        # соединение принимается, но ответа нет
+        with socket.create_server(address) as listener:
+            pooled = socket.create_connection(address, timeout=0.2)
+            pool._idle.append(pooled)
+            with self.assertRaises(socket.timeout):
+                pool.request(lambda _: b"[]")
+            self.assertEqual(pool._idle, [])
+            listener.settimeout(0)
+            listener.accept()[0].close()
+            # запрос не повторен через новое соединение
+            with self.assertRaises(BlockingIOError):
+                listener.accept()
+
+
+class AsyncViewsTests(TestCase):
+    async def test_async_views_match_sync(self):
+        factory = AsyncRequestFactory()
+        data = json.dumps(["2023-05-17", "2023-06-17"])
+        response = await views.meta_async(factory.get("/meta/"))
+        self.assertEqual(json.loads(response.content), json.loads(views._local_server_communicate(views._JSON_META)))
+        sync_answer = await sync_to_async(views._period_communicate)(data.encode())
+        for _ in range(3):
+            response = await views.period_data_async(factory.post("/period/", data, content_type="application/json"))
+            self.assertEqual(response.content, sync_answer)
+        # все запросы одного цикла событий прошли через одно соединение
+        self.assertEqual(len(views._async_pool._connections().idle), 1)
+
+    async def test_many_requests_in_flight(self):
+        factory = AsyncRequestFactory()
+        requests = [factory.post("/period/", json.dumps(["2023-05-17", f"2023-06-{day:02}"]),
+                                 content_type="application/json") for day in range(1, 31)] * 10
+        responses = await asyncio.gather(*(views.period_data_async(request) for request in requests))
+        self.assertTrue(all(json.loads(response.content)[1] is None for response in responses))
+        self.assertLessEqual(len(views._async_pool._connections().idle), DB_ASYNC_CONNECTIONS)
+
+    async def test_refused_and_timeout(self):
+        address = (DB_SERVER_HOST, DB_SERVER_PORT + 2)
+        pool = views._AsyncConnectionPool(address=address, max_idle=1, max_connections=1, timeout=0.2)
+        with self.assertRaises(ConnectionRefusedError):
+            await pool.request(lambda _: b"[]")
+        # соединение принимается, но ответа нет
+        with socket.create_server(address) as listener:
+            with self.assertRaises(asyncio.TimeoutError):
+                await pool.request(lambda _: b"[]")
+            listener.accept()[0].close()
+
+
+class StartupTests(TestCase):
+    def test_ready_view(self):
+        response = Client().get(reverse('ready'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["ready"])
+
+    def test_warming_up_until_first_connection(self):
+        # сервер БД еще не запущен: соединения отклоняются, пулы ни разу не соединялись
+        address = (DB_SERVER_HOST, DB_SERVER_PORT + 2)
+        pool = views._ConnectionPool(address=address, max_idle=1, timeout=0.2)
+        async_pool = views._AsyncConnectionPool(address=address, max_idle=1, max_connections=1, timeout=0.2)
+        client = Client()
+        with mock.patch.object(views, "_pool", pool), mock.patch.object(views, "_async_pool", async_pool):
+            self.assertEqual(client.get(reverse('meta')).json(), [None, views._SERVER_WARMING_UP])
+            response = client.get(reverse('ready'))
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json(), {"ready": False, "status": "warming_up"})
+            self.assertEqual(response["Retry-After"], "1")
+            # после первого соединения отказ означает, что сервер БД остановлен
+            pool.connected = True
+            self.assertEqual(client.get(reverse('meta')).json(), [None, views._SERVER_UNAVAILABLE])
+            self.assertEqual(client.get(reverse('ready')).json()["status"], "unavailable")
+
+
+class AsyncServerTests(TestCase):
+    def test_pipelined_answers_in_order(self):
+        def dispatch(request):
+            # первый запрос отвечает последним, порядок ответов должен совпасть с порядком запросов
+            time.sleep(0.2 if request == b"0" else 0)
+            return request
+
+        address = (DB_SERVER_HOST, DB_SERVER_PORT + 1)
+        queue = Queue()
+        thread = Thread(target=run_async_server, kwargs=dict(address=address, queue=queue, dispatch=dispatch,
+                                                             offload=True, max_concurrency=8, db_threads=4))
+        thread.daemon = True
+        thread.start()
+        self.assertIsNone(queue.get())
+
+        with socket.create_connection(address) as sock:
+            for i in range(3):
+                send_frame(sock, str(i).encode())
+            self.assertEqual([recv_frame(sock) for _ in range(3)], [b"0", b"1", b"2"])
+
+    def test_inline_requests_on_event_loop(self):
+        def dispatch(request):
+            # ответ - имя потока, в котором он сформирован
+            return threading.current_thread().name.encode()
+
+        address = (DB_SERVER_HOST, DB_SERVER_PORT + 4)
+        queue = Queue()
+        thread = Thread(target=run_async_server, name="event-loop",
+                        kwargs=dict(address=address, queue=queue, dispatch=dispatch, offload=True, max_concurrency=8,
+                                    db_threads=1, inline=lambda request: request == b"inline"))
+        thread.daemon = True
+        thread.start()
+        self.assertIsNone(queue.get())
+
+        with socket.create_connection(address, timeout=5) as sock:
+            send_frame(sock, b"inline")
+            send_frame(sock, b"long")
+            self.assertEqual(recv_frame(sock), b"event-loop")
+            self.assertTrue(recv_frame(sock).startswith(b"db"))
+
+    def test_long_exact_unions_offloaded(self):
+        index = si._period_index
+        full_period = encode_period_request(index.min_date, index.max_date)
+        self.assertTrue(si._is_inline_request(json.dumps(["meta"]).encode()))
+        self.assertFalse(si._is_inline_request(hello_request()))
+        self.assertTrue(si._is_inline_request(full_period))
+        with mock.patch.object(si, "_ASYNC_INLINE_PACKAGES", 10):
+            self.assertFalse(si._is_inline_request(full_period))
+            self.assertTrue(si._is_inline_request(encode_period_request(index.max_date + 1, index.max_date + 5)))
+
+    def test_oversized_frame_closes_connection(self):
+        address = (DB_SERVER_HOST, DB_SERVER_PORT + 3)
+        queue = Queue()
+        thread = Thread(target=run_async_server, kwargs=dict(address=address, queue=queue, dispatch=lambda r: r,
+                                                             offload=False, max_concurrency=8, db_threads=1))
+        thread.daemon = True
+        thread.start()
+        self.assertIsNone(queue.get())
+
+        header = struct.pack("<I", MAX_FRAME_SIZE + 1)
+        with socket.create_connection(address, timeout=5) as sock:
+            sock.sendall(header)
+            self.assertIsNone(recv_frame(sock))
+        left, right = socket.socketpair()
+        with left, right:
+            left.sendall(header)
+            with self.assertRaises(FrameTooLargeError):
+                recv_frame(right)
+
+
+class BinaryProtocolTests(TestCase):
+    def test_period_answer_roundtrip(self):
+        data = [None] * 8 + [0]
+        self.assertEqual(decode_period_answer(encode_period_answer(data, None)), (data, None))
+        data = [1016, 355, 577, 84, 961, 8, 41, 125, 2 ** 40]
+        self.assertEqual(decode_period_answer(encode_period_answer(data, None)), (data, None))
+        self.assertEqual(decode_period_answer(encode_period_answer(None, "ошибка ")), (None, "ошибка "))
+
+    def test_binary_and_json_answers_match(self):
+        with socket.create_connection((DB_SERVER_HOST, DB_SERVER_PORT)) as sock:
+            send_frame(sock, hello_request(PROTOCOL_JSON))
+            self.assertEqual(accepted_version(recv_frame(sock)), PROTOCOL_JSON)
+            send_frame(sock, hello_request())
+            self.assertEqual(accepted_version(recv_frame(sock)), PROTOCOL_BINARY)
+
+            # 2023-05-17 - 2023-06-17 в днях от DATE_BASEMENT
+            send_frame(sock, encode_period_request(8537, 8568))
+            binary_answer = decode_period_answer(recv_frame(sock))
+            send_frame(sock, json.dumps(["2023-05-17", "2023-06-17"]).encode())
+            self.assertEqual(list(binary_answer), json.loads(recv_frame(sock)))
+
+    def test_view_negotiates_binary(self):
+        views._pool._clear()
+        client = Client()
+        data = json.dumps(["2023-05-17", "2023-06-17"])
+        response = client.post(reverse('period_data'), data, content_type='application/json')
+        self.assertEqual(list(views._pool._versions.values()), [PROTOCOL_BINARY])
+        self.assertEqual(response.json(), json.loads(views._local_server_communicate(data=data.encode())))
+
+
+class BatchPeriodTests(TestCase):
+    def test_batch_matches_single_requests(self):
+        client = Client()
+        ranges = [["2023-05-17", "2023-06-17"], ["2023-05-17", "2023-05-17"], ["2023-06-01", "2023-06-30"],
+                  ["2022-01-01", "2022-12-31"]]
+        response = client.post(reverse('period_batch'), json.dumps(ranges), content_type='application/json')
+        batch, error = response.json()
+        self.assertIsNone(error)
+        singles = [client.post(reverse('period_data'), json.dumps(period), content_type='application/json').json()[0]
+                   for period in ranges]
+        self.assertEqual(batch, singles)
+
+    def test_sql_batch_matches_index(self):
+        index, _ = db_communicate(build_period_index, commit=False)
+        ranges = [(lo, hi) for lo in range(index.min_date - 2, index.max_date + 3, 5)
+                  for hi in range(lo, index.max_date + 3, 7)]
+        with mock.patch("support_initializer._BATCH_SQL_RANGES", 50):
+            batch, error = db_communicate(_request_batch_data, commit=False, ranges=ranges)
+        self.assertIsNone(error)
+        self.assertEqual(batch, [index.period_data(lo, hi) for lo, hi in ranges])
+
+    def test_bad_batch(self):
+        client = Client()
+        response = client.post(reverse('period_batch'), json.dumps({"a": 1}), content_type='application/json')
+        self.assertIsNotNone(response.json()[1])
+        response = client.post(reverse('period_batch'), json.dumps([["2023-05-17"]]), content_type='application/json')
+        self.assertIsNotNone(response.json()[1])
+
+
+class SeriesTests(TestCase):
+    def test_bucket_bounds(self):
+        def day(*args):
+            return (date(*args) - DATE_BASEMENT).days
+
+        # 2023-05-17 - среда
+        weeks = bucket_bounds(day(2023, 5, 17), day(2023, 6, 1), SeriesBucket.week)
+        self.assertEqual(weeks, [(day(2023, 5, 17), day(2023, 5, 21)), (day(2023, 5, 22), day(2023, 5, 28)),
+                                 (day(2023, 5, 29), day(2023, 6, 1))])
+        months = bucket_bounds(day(2023, 12, 31), day(2024, 3, 1), SeriesBucket.month)
+        self.assertEqual(months, [(day(2023, 12, 31), day(2023, 12, 31)), (day(2024, 1, 1), day(2024, 1, 31)),
+                                  (day(2024, 2, 1), day(2024, 2, 29)), (day(2024, 3, 1), day(2024, 3, 1))])
+        self.assertEqual(len(bucket_bounds(day(2023, 1, 1), day(2023, 12, 31), SeriesBucket.day)), 365)
+
+    def test_sql_series_matches_index(self):
+        index, _ = db_communicate(build_period_index, commit=False)
+        for bucket in SeriesBucket:
+            series, error = db_communicate(_request_series_data, commit=False, min_int=index.min_date - 10,
+                                           max_int=index.max_date + 10, bucket=bucket)
+            self.assertIsNone(error)
+            self.assertEqual(series, index.series(index.min_date - 10, index.max_date + 10, bucket))
+
+    def test_series_view(self):
+        client = Client()
+        meta = client.get(reverse('meta')).json()
+        min_date, max_date, totals = meta
+        response = client.post(reverse('period_series'), json.dumps([min_date, max_date, "month"]),
+                               content_type='application/json')
+        series, error = response.json()
+        self.assertIsNone(error)
+        self.assertEqual(series["bucket"][0], min_date)
+        self.assertEqual(sum(series["loaded"]), totals[0])
+        self.assertEqual(len(series), 10)
+        response = client.post(reverse('period_series'), json.dumps([min_date, max_date, "year"]),
+                               content_type='application/json')
+        self.assertIsNotNone(response.json()[1])
+
+
+class ServerStatsTests(TestCase):
+    def test_histogram_summary(self):
+        stats = ServerStats()
+        for us in [3] * 90 + [100] * 9 + [5000]:
+            stats.record_request(RequestKind.meta, us * 1000)
+        stats.record_stage(Stage.send, 500)
+        summary = stats.summary()
+        meta = summary["requests"]["meta"]
+        self.assertEqual(list(summary["requests"]), ["meta"])
+        self.assertEqual((meta["count"], meta["p50_us"], meta["p95_us"], meta["p99_us"]), (100, 4, 128, 128))
+        self.assertEqual(meta["max_us"], 5000)
+        self.assertEqual(meta["histogram"], [[4, 90], [128, 9], [8192, 1]])
+        self.assertEqual(summary["stages"]["send"]["histogram"], [[1, 1]])
+        self.assertEqual(summary["stages"]["data"], {"count": 0})
+
+    def test_dispatch_records_requests_and_stages(self):
+        si._response_cache.clear()
+        si._stats = ServerStats()
+        try:
+            si._dispatch(encode_period_request(8540, 8541))
+            si._dispatch(json.dumps(["meta"]).encode())
+            answer, error = json.loads(si._dispatch(json.dumps(["stats"]).encode()))
+        finally:
+            si._stats = None
+        self.assertIsNone(error)
+        self.assertTrue(answer["enabled"])
+        self.assertEqual({kind: value["count"] for kind, value in answer["requests"].items()},
+                         {"period_binary": 1, "meta": 1})
+        self.assertEqual(answer["stages"]["decode"]["count"], 3)
+        self.assertEqual(answer["stages"]["data"]["count"], 1)
+
+    def test_stats_view(self):
+        response = Client().get(reverse('stats'))
+        self.assertEqual(response.status_code, 200)
+        answer, error = response.json()
+        self.assertIsNone(error)
+        self.assertFalse(answer["enabled"])
+        self.assertIn("hit_ratio", answer["cache"])
+        self.assertNotIn("stages", answer)
+
+
+class ResponseCacheTests(TestCase):
+    def test_byte_budget_eviction(self):
+        cache = _ResponseCache(max_bytes=3 * (100 + _CACHE_ENTRY_OVERHEAD))
+        for i in range(3):
+            cache.put(i, bytes(100), generation=cache.generation)
+        self.assertIsNotNone(cache.get(0))
+        cache.put(3, bytes(100), generation=cache.generation)
+        self.assertIsNone(cache.get(1))
+        self.assertIsNotNone(cache.get(0))
+        cache.put(4, bytes(10 ** 6), generation=cache.generation)
+        self.assertIsNone(cache.get(4))
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["hits"], stats["misses"], stats["evictions"]), (3, 2, 2, 1))
+
+    def test_stale_answer_not_stored(self):
+        cache = _ResponseCache(max_bytes=10 ** 6)
+        generation = cache.generation
+        cache.clear()
+        cache.put("key", b"old data", generation=generation)
+        self.assertIsNone(cache.get("key"))
+
+    def test_warm_up_and_hit(self):
+        cache = si._ResponseCache(max_bytes=10 ** 6)
+        with mock.patch.object(si, "_response_cache", cache):
+            index = si._period_index
+            warmed = si._warm_up_cache(index.min_date, index.max_date)
+            self.assertEqual(cache.stats()["entries"], 2 * len(set(warmed)))
+            self.assertEqual(cache.stats()["hits"], 0)
+            answer = si._period_answer(index.min_date, index.max_date, binary=False)
+            self.assertEqual(cache.stats()["hits"], 1)
+            self.assertEqual(json.loads(answer)[0], index.period_data(index.min_date, index.max_date))
+
+
+class SharedCacheTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "shared_cache.bin")
+
+    def test_publish_and_read(self):
+        reader = shared_cache.SharedCacheReader(self.path)
+        self.assertIsNone(reader.meta())
+        published = shared_cache.publish(self.path, meta=b'["meta"]', answers={(1, 2): b"[1]", (3, 4): b"[3]"})
+        self.assertEqual(published, 2)
+        reader = shared_cache.SharedCacheReader(self.path)
+        self.assertEqual(reader.meta(), b'["meta"]')
+        self.assertEqual(reader.period(3, 4), b"[3]")
+        self.assertIsNone(reader.period(1, 4))
+
+        # новое поколение замечается без переоткрытия файла
+        shared_cache.publish(self.path, meta=b'["new"]', answers={(1, 2): b"[2]"})
+        self.assertEqual(reader.meta(), b'["new"]')
+        self.assertEqual(reader.period(1, 2), b"[2]")
+        self.assertIsNone(reader.period(3, 4))
+        shared_cache.invalidate(self.path)
+        self.assertIsNone(reader.meta())
+        self.assertIsNone(reader.period(1, 2))
+
+    def test_answers_over_capacity_dropped(self):
+        answers = {(i, i): bytes(shared_cache.SHARED_CACHE_SIZE // 4) for i in range(8)}
+        self.assertEqual(shared_cache.publish(self.path, meta=b"[]", answers=answers), 3)
+
+    def test_views_read_shared_cache(self):
+        min_date, max_date, _ = Client().get(reverse('meta')).json()
+        day = views._date_to_int(min_date)
+        shared_cache.publish(self.path, meta=b'["shared"]', answers={(day, day): b'[["shared"], null]'})
+        with mock.patch.object(views, "_shared_cache", shared_cache.SharedCacheReader(self.path)):
+            client = Client()
+            self.assertEqual(client.get(reverse('meta')).json(), ["shared"])
+            response = client.post(reverse('period_data'), json.dumps([min_date, min_date]),
+                                   content_type='application/json')
+            self.assertEqual(response.json(), [["shared"], None])
+            response = client.post(reverse('period_data'), json.dumps([min_date, max_date]),
+                                   content_type='application/json')
+            self.assertIsInstance(response.json()[0][0], int)
+
+
+class BulkLoadTests(TestCase):
+    def test_indexes_and_read_only_connections(self):
+        def index_names(cursor):
+            return {name for name, in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+        with open(os.path.join(parent_dir(), "db_schema.sql"), encoding="utf-8") as f:
+            schema = f.read()
+        with temp_data():
+            users = ((dt, f"Автор {dt % 3}") for dt in range(100))
+            requests_qnt = ((dt, *range(8)) for dt in range(100))
+            packages = ((dt, f"P-{dt // 2}") for dt in range(100))
+            _, error = support_db_requests.db_bulk_load(_first_insertion, schema=schema, min_date=0, max_date=99,
+                                                        users=users, requests_qnt=requests_qnt, packages=packages)
+            self.assertIsNone(error)
+            indexes, error = db_communicate(index_names, commit=False)
+            self.assertIn("users_date", indexes)
+            self.assertIn("packages_date", indexes)
+            counts, error = db_communicate(
+                lambda cursor: [cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                                for table in ("users", "packages")], commit=False)
+            self.assertIsNone(error)
+            self.assertEqual(counts, [100, 100])
+
+            # соединение db_read создается в новом потоке - по временной БД и без влияния на соединения сервера
+            results = []
+            thread = threading.Thread(target=lambda: results.append(support_db_requests.db_read(
+                lambda cursor: cursor.execute("DELETE FROM date_range"))))
+            thread.start()
+            thread.join()
+            self.assertIn("readonly", results[0][1])
+
+    def test_null_author_and_package(self):
+        def dim_nulls(cursor):
+            return [cursor.execute(request).fetchone()[0] for request in (
+                "SELECT COUNT(*) FROM users_dim WHERE fio IS NULL",
+                "SELECT COUNT(*) FROM packages_dim WHERE package IS NULL",
+                "SELECT COUNT(*) FROM users WHERE user_id IS NULL",
+                "SELECT COUNT(*) FROM packages WHERE package_id IS NULL")]
+
+        with open(os.path.join(parent_dir(), "db_schema.sql"), encoding="utf-8") as f:
+            schema = f.read()
+        with temp_data():
+            _, error = support_db_requests.db_bulk_load(
+                _first_insertion, schema=schema, min_date=0, max_date=2,
+                users=[(0, "А"), (0, None), (1, None), (1, "Б")], requests_qnt=[(dt, *range(8)) for dt in range(3)],
+                packages=[(0, "P1"), (0, None), (1, None)])
+            self.assertIsNone(error)
+            # повторная загрузка не добавляет в справочники строк NULL
+            _, error = support_db_requests.db_bulk_load(
+                lambda cursor: (_insert_users(cursor, [(2, None), (2, "А")]), _insert_packages(cursor, [(2, None)])))
+            self.assertIsNone(error)
+            nulls, error = db_communicate(dim_nulls, commit=False)
+            self.assertIsNone(error)
+            self.assertEqual(nulls, [0, 0, 3, 3])
+
+            period_index, _ = db_communicate(build_period_index, commit=False)
+            expected, _ = db_communicate(_request_period_data, commit=False, min_int=0, max_int=2)
+            self.assertEqual(period_index.period_data(0, 2), expected)
+            self.assertEqual(period_index.users.count(0, 2), 2)
+            self.assertEqual(period_index.packages.count(0, 2), 1)
+
+
+class SchemaMigrationTests(TestCase):
+    # схема версии 0 - до появления справочника users_dim
+    _SCHEMA_V0 = """CREATE TABLE requests (date INTEGER, loaded INTEGER, doubles INTEGER, for_creation INTEGER,
+                                           for_expand INTEGER, handle_over INTEGER, returned INTEGER,
+                                           sent_for_handle INTEGER, packages INTEGER);
+                    CREATE TABLE users (date INTEGER, user_fio TEXT);
+                    CREATE TABLE date_range (min_date INTEGER, max_date INTEGER);
+                    CREATE TABLE ingest_manifest (source TEXT, size INTEGER, mtime_ns INTEGER, content_hash TEXT);
+                    CREATE TABLE ingest_days (date INTEGER PRIMARY KEY, fingerprint TEXT);"""
+
+    def test_migrated_equals_fresh(self):
+        users = [(dt, f"Автор {(dt * 7 + i) % 5}") for dt in range(30) for i in range(dt % 4)]
+        requests_qnt = [(dt, *[dt % (k + 2) for k in range(8)]) for dt in range(30)]
+        with temp_data():
+            conn = sqlite3.connect(support_db_requests._DB_PATH)
+            conn.executescript(self._SCHEMA_V0)
+            conn.executemany("INSERT INTO users VALUES(?, ?)", users)
+            conn.executemany("INSERT INTO requests VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)", requests_qnt)
+            conn.commit()
+            expected = [conn.execute("SELECT COUNT(DISTINCT user_fio) FROM users WHERE date >= ? and date <= ?",
+                                     (low, low + 9)).fetchone()[0] for low in range(25)]
+            conn.close()
+
+            self.assertEqual(_upgrade_schema(), (None, None))
+            version, _ = db_communicate(
+                lambda cursor: cursor.execute("PRAGMA user_version").fetchone()[0], commit=False)
+            self.assertEqual(version, _SCHEMA_VERSION)
+            for low in range(25):
+                data, error = db_communicate(_request_period_data, commit=False, min_int=low, max_int=low + 9)
+                self.assertIsNone(error)
+                self.assertEqual(data[-1], expected[low])
+                self.assertEqual(data[0], sum(row[1] for row in requests_qnt[low:low + 10]))
+            # повторный запуск не выполняет миграцию
+            self.assertEqual(_upgrade_schema(), (None, None))
+
+    def test_files_source_reloaded_after_upgrade(self):
+        dates_select = "SELECT date FROM requests ORDER BY date"
+        with temp_data(source="exports"):
+            exports = support_file_reader._SOURCE_FILE
+            os.mkdir(exports)
+            first, second = os.path.join(exports, "w1.csv"), os.path.join(exports, "w2.csv")
+            with mock.patch("support_initializer.read_files_data",
+                            wraps=support_file_reader.read_files_data) as read_mock:
+                MultiFileLoadTests._save_csv(first, [(17, "А", "П1")])
+                MultiFileLoadTests._save_csv(second, [(18, "Б", "П2")])
+                self.assertEqual(initialize_data(), (None, None))
+                # БД версии 2 - без таблиц пакетов
+                db_communicate(
+                    lambda cursor: cursor.executescript("DROP TABLE packages; DROP TABLE packages_dim; "
+                                                        "PRAGMA user_version = 2;"), commit=True)
+                os.remove(second)
+
+                # миграция очищает журнал файлов - загрузка полная, дни удаленного файла не остаются
+                self.assertEqual(initialize_data(), (None, None))
+                dates, error = db_communicate(
+                    lambda cursor: cursor.execute(dates_select).fetchall(), commit=False)
+                self.assertIsNone(error)
+                self.assertEqual(dates, [(_date_to_int("2023-05-17"),)])
+                # после полной загрузки журнал заполнен - файлы повторно не читаются
+                calls = read_mock.call_count
+                self.assertEqual(initialize_data(), (None, None))
+                self.assertEqual(read_mock.call_count, calls)
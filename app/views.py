@@ -1,32 +1,361 @@
+import asyncio
 import socket
+import select
 import json
+from collections import namedtuple
+from datetime import datetime
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
-from .constants import DB_SERVER_HOST, DB_SERVER_PORT, DB_META_COMMAND
+from .constants import DATE_BASEMENT, DB_SERVER_HOST, DB_SERVER_PORT, DB_META_COMMAND, DB_BATCH_COMMAND, \
+    DB_SERIES_COMMAND, DB_STATS_COMMAND, DB_SERVER_TIMEOUT, DB_POOL_SIZE, DB_ASYNC_CONNECTIONS, SHARED_CACHE_PATH, \
+    SeriesBucket
+from .protocol import send_frame, recv_frame, pack_frame, read_frame, hello_request, accepted_version, \
+    encode_period_request, decode_period_answer, PROTOCOL_JSON, PROTOCOL_BINARY
+from .shared_cache import SharedCacheReader
 
 
 _JSON_META = json.dumps(DB_META_COMMAND).encode(encoding='utf-8')
+_JSON_STATS = json.dumps(DB_STATS_COMMAND).encode(encoding='utf-8')
+_HELLO = hello_request()
 
+_SERVER_UNAVAILABLE = "Что-то пошло не так. Сервер базы данных не отвечает. Повторите попытку чуть позже"
+_SERVER_WARMING_UP = "Сервер базы данных загружает данные. Повторите попытку через несколько секунд"
 
-def _local_server_communicate(data: bytes):
+
+class _ConnectionPool:
+    """
+    Потокобезопасный пул постоянных соединений с сервером БД
+    Соединение берется из пула на время одного запроса и возвращается после получения ответа
+    Версия протокола согласуется при создании соединения и хранится до его закрытия
+    """
+
+    def __init__(self, address: Tuple[str, int], max_idle: int, timeout: float):
+        self._address = address
+        self._max_idle = max_idle
+        self._timeout = timeout
+        self._idle: List[socket.socket] = []
+        self._versions: Dict[socket.socket, int] = dict()
+        self._lock = Lock()
+        # true - сервер БД хотя бы раз принял соединение этого пула
+        self.connected = False
+
+    @staticmethod
+    def _is_alive(sock: socket.socket) -> bool:
+        """
+        Проверка простаивающего соединения: между запросами от сервера ничего не приходит,
+        поэтому готовность к чтению означает закрытие соединения сервером
+        """
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def _connect(self) -> socket.socket:
+        sock = socket.create_connection(self._address, timeout=self._timeout)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            send_frame(sock, hello_request())
+            answer = recv_frame(sock)
+            if answer is None:
+                raise ConnectionResetError("сервер БД закрыл соединение")
+        except BaseException:
+            sock.close()
+            raise
+        with self._lock:
+            self._versions[sock] = accepted_version(answer)
+        self.connected = True
+        return sock
+
+    def _close(self, sock: socket.socket):
+        with self._lock:
+            self._versions.pop(sock, None)
+        sock.close()
+
+    def _acquire(self) -> Tuple[socket.socket, bool]:
+        """:return: кортеж (соединение, взято ли оно из пула)"""
+        while True:
+            with self._lock:
+                sock = self._idle.pop() if self._idle else None
+            if sock is None:
+                return self._connect(), False
+            if self._is_alive(sock):
+                return sock, True
+            self._close(sock)
+
+    def _release(self, sock: socket.socket):
+        with self._lock:
+            if len(self._idle) < self._max_idle:
+                self._idle.append(sock)
+                return
+        self._close(sock)
+
+    def _clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for sock in idle:
+            self._close(sock)
+
+    def request(self, encode: Callable[[int], bytes]) -> Tuple[bytearray, int]:
+        """
+        Отправляет запрос и возвращает ответ
+        Если соединение из пула оказалось разорванным (например, сервер БД перезапущен),
+        запрос повторяется один раз через новое соединение
+        :param encode: функция, формирующая запрос для версии протокола соединения
+        :return: кортеж (ответ, версия протокола, в которой сформирован запрос)
+        :raise ConnectionRefusedError: сервер БД не принимает соединения
+        :raise socket.timeout: сервер БД не ответил за время таймаута, запрос не повторяется
+        :raise OSError: прочие ошибки сети
+        """
+        while True:
+            try:
+                sock, reused = self._acquire()
+            except ConnectionRefusedError:
+                self._clear()
+                raise
+            try:
+                version = self._versions.get(sock, PROTOCOL_JSON)
+                send_frame(sock, encode(version))
+                answer = recv_frame(sock)
+                if answer is None:
+                    raise ConnectionResetError("сервер БД закрыл соединение")
+            except ConnectionError:
+                # повтор только для разорванного соединения из пула: после таймаута сервер мог получить запрос
+                # и еще обрабатывать его, повтор удвоил бы нагрузку и время ожидания
+                self._close(sock)
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                self._close(sock)
+                raise
+            self._release(sock)
+            return answer, version
+
+
+_AsyncConnection = namedtuple("_AsyncConnection", ["reader", "writer", "version"])
+
+
+class _LoopConnections:
+    """Соединения асинхронного пула, принадлежащие одному циклу событий"""
+
+    def __init__(self, max_connections: int):
+        self.idle: List[_AsyncConnection] = []
+        self.limit = asyncio.Semaphore(max_connections)
+
+
+class _AsyncConnectionPool:
+    """
+    Пул постоянных соединений с сервером БД для асинхронных представлений (asyncio.open_connection)
+    Пока запрос ждет ответа сервера БД, поток обслуживает другие запросы - один поток ASGI сервера
+    держит сотни запросов в ожидании ответа
+    Соединение принадлежит циклу событий, в котором создано, поэтому соединения хранятся отдельно для каждого цикла.
+    Под ASGI цикл один на процесс; под WSGI каждый вызов асинхронного представления выполняется в новом цикле,
+    и соединения закрытых циклов отбрасываются
+    Одновременно открыто не более max_connections соединений цикла, остальные запросы ждут свободного соединения
+    """
+
+    def __init__(self, address: Tuple[str, int], max_idle: int, max_connections: int, timeout: float):
+        self._address = address
+        self._max_idle = max_idle
+        self._max_connections = max_connections
+        self._timeout = timeout
+        self._loops: Dict[asyncio.AbstractEventLoop, _LoopConnections] = dict()
+        self._lock = Lock()
+        self.connected = False
+
+    def _connections(self) -> _LoopConnections:
+        loop = asyncio.get_running_loop()
+        connections = self._loops.get(loop)
+        if connections is None:
+            with self._lock:
+                for closed in [other for other in self._loops if other.is_closed()]:
+                    del self._loops[closed]
+                connections = self._loops.setdefault(loop, _LoopConnections(self._max_connections))
+        return connections
+
+    async def _connect(self) -> _AsyncConnection:
+        reader, writer = await asyncio.open_connection(*self._address)
+        try:
+            writer.write(pack_frame(hello_request()))
+            answer = await read_frame(reader)
+            if answer is None:
+                raise ConnectionResetError("сервер БД закрыл соединение")
+        except BaseException:
+            writer.close()
+            raise
+        self.connected = True
+        return _AsyncConnection(reader, writer, accepted_version(answer))
+
+    @staticmethod
+    def _is_alive(connection: _AsyncConnection) -> bool:
+        """Закрытие простаивающего соединения сервером цикл событий отмечает концом потока чтения"""
+        return not (connection.reader.at_eof() or connection.writer.is_closing())
+
+    @staticmethod
+    def _acquire(connections: _LoopConnections) -> Optional[_AsyncConnection]:
+        """:return: простаивающее соединение, None - пул цикла пуст"""
+        while connections.idle:
+            connection = connections.idle.pop()
+            if _AsyncConnectionPool._is_alive(connection):
+                return connection
+            connection.writer.close()
+        return None
+
+    def _release(self, connections: _LoopConnections, connection: _AsyncConnection):
+        if len(connections.idle) < self._max_idle:
+            connections.idle.append(connection)
+        else:
+            connection.writer.close()
+
+    @staticmethod
+    async def _exchange(connection: _AsyncConnection, encode: Callable[[int], bytes]) -> bytes:
+        connection.writer.write(pack_frame(encode(connection.version)))
+        await connection.writer.drain()
+        answer = await read_frame(connection.reader)
+        if answer is None:
+            raise ConnectionResetError("сервер БД закрыл соединение")
+        return answer
+
+    async def request(self, encode: Callable[[int], bytes]) -> Tuple[bytes, int]:
+        """
+        Отправляет запрос и возвращает ответ, асинхронный аналог _ConnectionPool.request
+        Таймаут действует на установку соединения и на обмен запросом и ответом по отдельности,
+        соединение, по которому ответ не получен, закрывается
+        :param encode: функция, формирующая запрос для версии протокола соединения
+        :return: кортеж (ответ, версия протокола, в которой сформирован запрос)
+        :raise ConnectionRefusedError: сервер БД не принимает соединения
+        :raise asyncio.TimeoutError: сервер БД не ответил за время таймаута
+        :raise OSError: прочие ошибки сети
+        """
+        connections = self._connections()
+        async with connections.limit:
+            while True:
+                connection = self._acquire(connections)
+                reused = connection is not None
+                try:
+                    if connection is None:
+                        connection = await asyncio.wait_for(self._connect(), self._timeout)
+                    answer = await asyncio.wait_for(self._exchange(connection, encode), self._timeout)
+                except ConnectionRefusedError:
+                    for idle in connections.idle:
+                        idle.writer.close()
+                    connections.idle.clear()
+                    raise
+                except ConnectionError:
+                    if connection is not None:
+                        connection.writer.close()
+                    if reused:
+                        continue
+                    raise
+                except BaseException:
+                    if connection is not None:
+                        connection.writer.close()
+                    raise
+                self._release(connections, connection)
+                return answer, connection.version
+
+
+_pool = _ConnectionPool(address=(DB_SERVER_HOST, DB_SERVER_PORT), max_idle=DB_POOL_SIZE, timeout=DB_SERVER_TIMEOUT)
+# число соединений цикла ограничено max_connections, поэтому простаивать могут все - без повторных подключений
+_async_pool = _AsyncConnectionPool(address=(DB_SERVER_HOST, DB_SERVER_PORT), max_idle=DB_ASYNC_CONNECTIONS,
+                                   max_connections=DB_ASYNC_CONNECTIONS, timeout=DB_SERVER_TIMEOUT)
+# ответы, опубликованные сервером БД в общий кэш, отдаются без обращения к серверу
+_shared_cache = SharedCacheReader(SHARED_CACHE_PATH)
+
+
+def _warming_up(err: BaseException) -> bool:
+    """
+    Отказ в соединении, пока сервер БД ни разу не принял соединение процесса, означает, что сервер еще загружает
+    данные: django запускается, не дожидаясь загрузки (см. launch.py)
+    """
+    return isinstance(err, ConnectionRefusedError) and not (_pool.connected or _async_pool.connected)
+
+
+def _unavailable_answer(err: BaseException) -> bytes:
+    message = _SERVER_WARMING_UP if _warming_up(err) else _SERVER_UNAVAILABLE
+    return json.dumps([None, message]).encode(encoding="utf-8")
+
+
+def _local_server_communicate(data: bytes) -> bytes:
+    try:
+        answer, _ = _pool.request(lambda _: data)
+    except OSError as err:
+        return _unavailable_answer(err)
+    return bytes(answer)
+
+
+def _date_to_int(date_str: str) -> int:
+    return (datetime.strptime(date_str, "%Y-%m-%d").date() - DATE_BASEMENT).days
+
+
+def _parse_period(body: bytes) -> Optional[Tuple[int, int]]:
+    """:return: кортеж (день начала, день конца) от DATE_BASEMENT, None - в теле запроса не период"""
+    try:
+        min_date, max_date = json.loads(body)
+        return _date_to_int(min_date), _date_to_int(max_date)
+    except (ValueError, TypeError):
+        return None
+
+
+def _period_answer(answer: bytes, version: int) -> bytes:
+    """:return: ответ сервера БД на запрос за период в формате json"""
+    if version >= PROTOCOL_BINARY:
+        return json.dumps(decode_period_answer(answer)).encode(encoding="utf-8")
+    return bytes(answer)
+
+
+def _period_communicate(body: bytes) -> bytes:
+    """
+    Запрос за период: при согласованной двоичной версии протокола запрос и ответ передаются в двоичном виде,
+    иначе (и для запросов с некорректными датами) тело запроса передается серверу как есть
+    :param body: json [дата начала, дата конца]
+    :return: ответ в формате json
+    """
+    period = _parse_period(body)
+    if period is None:
+        return _local_server_communicate(data=body)
+    shared_answer = _shared_cache.period(*period)
+    if shared_answer is not None:
+        return shared_answer
+
+    binary_request = encode_period_request(*period)
+
+    try:
+        answer, version = _pool.request(lambda v: binary_request if v >= PROTOCOL_BINARY else body)
+    except OSError as err:
+        return _unavailable_answer(err)
+    return _period_answer(answer, version)
+
+
+async def _async_server_communicate(data: bytes) -> bytes:
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.connect((DB_SERVER_HOST, DB_SERVER_PORT))
-            sock.send(len(data).to_bytes(4, byteorder="little"))
-            sock.sendall(data)
+        answer, _ = await _async_pool.request(lambda _: data)
+    except (OSError, asyncio.TimeoutError) as err:
+        return _unavailable_answer(err)
+    return bytes(answer)
+
+
+async def _async_period_communicate(body: bytes) -> bytes:
+    """Асинхронный аналог _period_communicate"""
+    period = _parse_period(body)
+    if period is None:
+        return await _async_server_communicate(data=body)
+    shared_answer = _shared_cache.period(*period)
+    if shared_answer is not None:
+        return shared_answer
+
+    binary_request = encode_period_request(*period)
 
-            length = sock.recv(4)
-            length, read, chunks = int.from_bytes(length, byteorder="little"), 0, []
-            while read < length:
-                chunk = sock.recv(1024).strip()
-                chunks.append(chunk)
-                read += len(chunk)
-            answer = b"".join(chunks)
-            return answer
-    except ConnectionRefusedError:
-        return [None, "Что-то пошло не так. Сервер базы данных не отвечает. Повторите попытку чуть позже"]
+    try:
+        answer, version = await _async_pool.request(lambda v: binary_request if v >= PROTOCOL_BINARY else body)
+    except (OSError, asyncio.TimeoutError) as err:
+        return _unavailable_answer(err)
+    return _period_answer(answer, version)
 
 
 @require_http_methods(["GET"])
@@ -36,13 +365,92 @@ def home(request):
 
 @require_http_methods(["GET"])
 def meta(_):
-    json_answer = _local_server_communicate(data=_JSON_META)
+    json_answer = _shared_cache.meta() or _local_server_communicate(data=_JSON_META)
     return HttpResponse(json_answer, content_type="application/json")
 
 
 @require_http_methods(["POST"])
 @csrf_exempt
 def period_data(request):
-    data = request.body
-    json_answer = _local_server_communicate(data=data)
+    json_answer = _period_communicate(body=request.body)
+    return HttpResponse(json_answer, content_type="application/json")
+
+
+@require_http_methods(["GET"])
+async def meta_async(_):
+    """Асинхронный вариант meta - для ASGI, см. myreport.urls"""
+    json_answer = _shared_cache.meta() or await _async_server_communicate(data=_JSON_META)
+    return HttpResponse(json_answer, content_type="application/json")
+
+
+@require_http_methods(["POST"])
+@csrf_exempt
+async def period_data_async(request):
+    """Асинхронный вариант period_data - для ASGI, см. myreport.urls"""
+    json_answer = await _async_period_communicate(body=request.body)
     return HttpResponse(json_answer, content_type="application/json")
+
+
+@require_http_methods(["POST"])
+@csrf_exempt
+def period_batch(request):
+    """
+    Данные за несколько периодов за одно обращение к серверу БД
+    Тело запроса: [[дата начала, дата конца], ...], ответ: [[данные за период, ...], ошибка]
+    """
+    try:
+        ranges = json.loads(request.body)
+    except ValueError:
+        ranges = None
+    if not isinstance(ranges, list):
+        json_answer = json.dumps([None, "Тело запроса должно быть списком периодов"]).encode(encoding="utf-8")
+    else:
+        json_answer = _local_server_communicate(data=json.dumps([DB_BATCH_COMMAND, ranges]).encode(encoding="utf-8"))
+    return HttpResponse(json_answer, content_type="application/json")
+
+
+@require_http_methods(["POST"])
+@csrf_exempt
+def period_series(request):
+    """
+    Ряд данных по интервалам (день, неделя ISO, месяц) внутри периода
+    Тело запроса: [дата начала, дата конца, интервал], интервал - значение SeriesBucket
+    Ответ: [{"bucket": [даты начала интервалов], <счетчик>: [значения], ..., "users": [значения]}, ошибка]
+    """
+    try:
+        min_date, max_date, bucket = json.loads(request.body)
+        SeriesBucket(bucket)
+    except (ValueError, TypeError):
+        buckets = ", ".join(bucket.value for bucket in SeriesBucket)
+        error = f"Тело запроса должно быть списком [дата начала, дата конца, интервал], интервал: {buckets}"
+        json_answer = json.dumps([None, error]).encode(encoding="utf-8")
+    else:
+        data = json.dumps([DB_SERIES_COMMAND, min_date, max_date, bucket]).encode(encoding="utf-8")
+        json_answer = _local_server_communicate(data=data)
+    return HttpResponse(json_answer, content_type="application/json")
+
+
+@require_http_methods(["GET"])
+def stats(_):
+    """
+    Статистика сервера БД: кэш ответов, при запуске со сбором статистики - соединения, задержки по видам запросов
+    и время этапов обработки (см. support_server_stats). Ответ: [статистика, ошибка]
+    """
+    json_answer = _local_server_communicate(data=_JSON_STATS)
+    return HttpResponse(json_answer, content_type="application/json")
+
+
+@require_http_methods(["GET"])
+def ready(_):
+    """
+    Готовность к запросам данных - для балансировщика нагрузки
+    200 - сервер БД отвечает; 503 - сервер БД загружает данные (status warming_up) или не отвечает (unavailable)
+    """
+    try:
+        _pool.request(lambda _: _HELLO)
+    except OSError as err:
+        response = JsonResponse({"ready": False, "status": "warming_up" if _warming_up(err) else "unavailable"},
+                                status=503)
+        response["Retry-After"] = "1"
+        return response
+    return JsonResponse({"ready": True, "status": "ready"})
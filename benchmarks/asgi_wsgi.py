@@ -0,0 +1,235 @@
+"""
+Сравнение обслуживания одновременных запросов meta и за период через WSGI и ASGI
+WSGI: синхронные представления (app.views.meta, period_data) в пуле из --threads потоков - как у потокового
+WSGI сервера, каждый запрос занимает поток на время ожидания ответа сервера БД
+ASGI: асинхронные представления (meta_async, period_data_async) в одном цикле событий - ожидание ответа
+сервера БД не занимает поток
+Приложения django (myreport.wsgi, myreport.asgi) вызываются напрямую, без http сервера, каждый путь -
+в своем процессе, в процессе ASGI действует сокращенный список middleware (см. ASYNC_VIEWS в myreport/settings.py)
+Запросы подаются --concurrency одновременными клиентами, задержка считается от подачи
+запроса до ответа и включает ожидание свободного потока
+Сервер БД запускается в отдельном процессе на данных testing_data.xlsx, --db-latency-ms добавляет
+к каждому ответу сервера БД задержку (как у запросов к БД на диске или сервера БД на другой машине)
+Результат - json. Сервер БД занимает порт DB_SERVER_PORT - приложение на время замера должно быть остановлено
+Запуск из корневой директории проекта:
+python benchmarks/asgi_wsgi.py [--threads 8] [--concurrency 8 64 256] [--db-latency-ms 5] [--output result.json]
+"""
+
+
+from argparse import ArgumentParser
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+import io
+import json
+from multiprocessing import Process, Queue
+import os.path
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Awaitable, Callable, Dict, List
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import support_db_requests  # noqa: E402
+from support_file_reader import use_source  # noqa: E402
+import support_initializer  # noqa: E402
+from support_initializer import initialize_data, run_socketserver, ServerMode  # noqa: E402
+
+
+_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+_FIRST_DAY, _DAYS = date(2023, 5, 17), 98
+_ENDPOINTS = {"meta": ("GET", "/meta/"), "period": ("POST", "/period/")}
+
+
+def _ingest(db_path: str, queue: Queue):
+    # сообщения загрузки и сервера БД - в stderr, stdout остается для результата
+    sys.stdout = sys.stderr
+    support_db_requests._DB_PATH = db_path
+    use_source(os.path.join(_ROOT, "testing_data.xlsx"))
+    _, error = initialize_data(rebuild=True)
+    queue.put(error)
+
+
+def _serve(db_path: str, latency_ms: float, queue: Queue):
+    sys.stdout = sys.stderr
+    support_db_requests._DB_PATH = db_path
+    if latency_ms > 0:
+        dispatch = support_initializer._dispatch
+
+        def slow_dispatch(request: bytes) -> bytes:
+            time.sleep(latency_ms / 1000)
+            return dispatch(request)
+        support_initializer._dispatch = slow_dispatch
+    run_socketserver(queue, mode=ServerMode.threading)
+
+
+def _random_period(rnd: random.Random) -> bytes:
+    low = rnd.randrange(_DAYS)
+    high = low + rnd.randrange(_DAYS - low)
+    return json.dumps([(_FIRST_DAY + timedelta(days=day)).isoformat() for day in (low, high)]).encode()
+
+
+def _wsgi_caller(threads: int) -> Callable[[str, bytes], Awaitable[bool]]:
+    from myreport.wsgi import application
+
+    executor = ThreadPoolExecutor(max_workers=threads)
+
+    def call(method: str, path: str, body: bytes) -> bool:
+        environ = {"REQUEST_METHOD": method, "PATH_INFO": path, "SCRIPT_NAME": "", "QUERY_STRING": "",
+                   "SERVER_NAME": "localhost", "SERVER_PORT": "80", "HTTP_HOST": "localhost",
+                   "SERVER_PROTOCOL": "HTTP/1.1", "CONTENT_TYPE": "application/json",
+                   "CONTENT_LENGTH": str(len(body)), "wsgi.input": io.BytesIO(body), "wsgi.url_scheme": "http",
+                   "wsgi.errors": sys.stderr, "wsgi.multithread": True, "wsgi.multiprocess": False,
+                   "wsgi.run_once": False, "wsgi.version": (1, 0)}
+        statuses = []
+        response = application(environ, lambda status, headers: statuses.append(status))
+        try:
+            content = b"".join(response)
+        finally:
+            response.close()
+        return statuses[0].startswith("200") and json.loads(content)[0] is not None
+
+    async def request(endpoint: str, body: bytes) -> bool:
+        method, path = _ENDPOINTS[endpoint]
+        return await asyncio.get_running_loop().run_in_executor(executor, call, method, path, body)
+    return request
+
+
+def _asgi_caller(_) -> Callable[[str, bytes], Awaitable[bool]]:
+    from myreport.asgi import application
+
+    async def request(endpoint: str, body: bytes) -> bool:
+        method, path = _ENDPOINTS[endpoint]
+        scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+                 "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+                 "headers": [(b"host", b"localhost"), (b"content-type", b"application/json"),
+                             (b"content-length", str(len(body)).encode())],
+                 "client": ("127.0.0.1", 50000), "server": ("localhost", 80)}
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        done = asyncio.Event()
+        status, content = [], []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # клиент не отключается, пока не получен ответ
+            await done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+            else:
+                content.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    done.set()
+
+        await application(scope, receive, send)
+        done.set()
+        return status == [200] and json.loads(b"".join(content))[0] is not None
+    return request
+
+
+async def _run_load(request: Callable[[str, bytes], Awaitable[bool]], endpoint: str, bodies: List[bytes],
+                    concurrency: int) -> Dict:
+    """
+    Подает запросы из concurrency одновременных клиентов, каждый клиент отправляет следующий запрос
+    после получения ответа на предыдущий
+    :return: пропускная способность, перцентили задержки, количество ошибок
+    """
+    latencies, errors, position = [], [0], iter(range(len(bodies)))
+
+    async def client():
+        for i in position:
+            started = time.perf_counter()
+            ok = await request(endpoint, bodies[i])
+            latencies.append(time.perf_counter() - started)
+            errors[0] += not ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {"concurrency": concurrency, "requests": len(bodies), "errors": errors[0],
+            "throughput_rps": round(len(bodies) / elapsed, 1),
+            "p50_ms": round(percentiles[49] * 1000, 3), "p95_ms": round(percentiles[94] * 1000, 3),
+            "p99_ms": round(percentiles[98] * 1000, 3)}
+
+
+def _measure(path: str, threads: int, concurrency: List[int], requests: int, queue: Queue):
+    if path == "asgi":
+        os.environ["MYREPORT_ASYNC_VIEWS"] = "1"
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "myreport.settings")
+    caller = _asgi_caller if path == "asgi" else _wsgi_caller
+    rnd = random.Random(2)
+    bodies = {"meta": [b""] * requests, "period": [_random_period(rnd) for _ in range(requests)]}
+
+    async def run() -> List[Dict]:
+        # приложение создается в цикле событий замера - соединения асинхронного пула принадлежат ему
+        request, results = caller(threads), []
+        for endpoint in _ENDPOINTS:
+            # прогрев: соединения с сервером БД и первые обращения django
+            await _run_load(request, endpoint, bodies[endpoint][:max(concurrency)], max(concurrency))
+            for clients in concurrency:
+                load = await _run_load(request, endpoint, bodies[endpoint], clients)
+                results.append({"path": path, "endpoint": endpoint, **load})
+                print(f"{path} {endpoint} x{clients}: {load['throughput_rps']} запросов/с, "
+                      f"p99 {load['p99_ms']} мс", file=sys.stderr)
+        return results
+
+    queue.put(asyncio.run(run()))
+
+
+def main():
+    parser = ArgumentParser(description="Сравнение обслуживания одновременных запросов через WSGI и ASGI")
+    parser.add_argument("--threads", type=int, default=8, help="потоков WSGI сервера")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 64, 256])
+    parser.add_argument("--requests", type=int, default=2000, help="запросов на каждое сочетание пути и запроса")
+    parser.add_argument("--db-latency-ms", type=float, default=5, help="дополнительная задержка ответа сервера БД")
+    parser.add_argument("--output", default=None, help="файл для результата в формате json (по умолчанию - вывод)")
+    args = parser.parse_args()
+
+    result = {"config": vars(args),
+              "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                              "cpu_count": os.cpu_count()},
+              "load": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "db.sqlite3")
+        queue = Queue()
+        process = Process(target=_ingest, args=(db_path, queue))
+        process.start()
+        error = queue.get()
+        process.join()
+        if error is not None:
+            raise RuntimeError(error)
+
+        server = Process(target=_serve, args=(db_path, args.db_latency_ms, queue), daemon=True)
+        server.start()
+        error = queue.get()
+        if error is not None:
+            raise RuntimeError(error)
+        try:
+            for path in ("wsgi", "asgi"):
+                process = Process(target=_measure, args=(path, args.threads, args.concurrency, args.requests, queue))
+                process.start()
+                result["load"].extend(queue.get())
+                process.join()
+        finally:
+            server.terminate()
+            server.join()
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
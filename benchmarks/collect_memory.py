@@ -0,0 +1,66 @@
+"""
+Пиковая память и время сбора данных по дням (support_file_reader._collect_values) на синтетических строках
+Строки формируются по одной во время сбора, как при чтении файла: в замер входят строки, удерживаемые
+данными дней, но не весь файл
+Запуск из корневой директории проекта: python benchmarks/collect_memory.py [--rows N]
+"""
+
+
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+import os.path
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from support_file_reader import _collect_values, _transform, _ColNameIndexMapping  # noqa: E402
+
+
+_STATES = ("ДОБАВЛЕНИЕ", "РАСШИРЕНИЕ", "ЧАСТИЧНЫЙ ДУБЛЬ", "ДУБЛЬ")
+_STATUSES = ("Обработка завершена", "Возвращена на уточнение", "Отправлена в обработку", "Черновик")
+
+
+def _synthetic_rows(rows: int, days: int, authors: int):
+    rnd = random.Random(1)
+    start = datetime(2021, 1, 1, 9, 0, 0)
+    for i in range(rows):
+        creation = start + timedelta(days=rnd.randrange(days), seconds=rnd.randrange(36000))
+        author = rnd.randrange(authors)
+        # строки создаются заново, как при чтении файла - одинаковые значения не являются одним объектом
+        yield (rnd.choice(_STATES), rnd.choice(_STATUSES), f"Фамилия{author} Имя{author % 97} Отчество{author % 89}",
+               creation.strftime("%d.%m.%Y %H:%M:%S"), f"PKG-{i // 3:08}")
+
+
+def main():
+    parser = ArgumentParser(description="Пиковая память сбора данных по дням")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=1095)
+    parser.add_argument("--authors", type=int, default=5000)
+    args = parser.parse_args()
+
+    col_mapping = _ColNameIndexMapping(state=0, status=1, author=2, creation_dt=3, package_id=4)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    values = _synthetic_rows(args.rows, args.days, args.authors)
+    collected, error = _collect_values(values=values, start_row=2, col_mapping=col_mapping)
+    collect_time = time.perf_counter() - started
+    _, collect_peak = tracemalloc.get_traced_memory()
+    retained, _ = tracemalloc.get_traced_memory()
+    min_date, max_date, users, requests_qnt, packages = _transform(collected)
+    users_rows = sum(1 for _ in users)
+    tracemalloc.stop()
+
+    if error is not None:
+        print(error)
+        return
+    print(f"Строк: {args.rows}, дней: {len(collected)}, строк users: {users_rows}")
+    print(f"Сбор: {collect_time:.2f} с, пиковая память {collect_peak / 2 ** 20:.1f} МБ, "
+          f"удерживается после сбора {retained / 2 ** 20:.1f} МБ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Время разбора строк-дат колонки "Дата создания заявки": datetime.strptime на каждую строку
+и support_file_reader._parse_creation (фиксированные позиции и запоминание разобранных частей)
+Запуск из корневой директории проекта: python benchmarks/date_parsing.py [--rows N] [--days N]
+"""
+
+
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+import os.path
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from support_file_reader import _parse_creation, _CREATION_FORMAT  # noqa: E402
+
+
+def _synthetic_dates(rows: int, days: int):
+    rnd = random.Random(1)
+    start = datetime(2021, 1, 1, 9, 0, 0)
+    return [(start + timedelta(days=rnd.randrange(days), seconds=rnd.randrange(36000))).strftime(_CREATION_FORMAT)
+            for _ in range(rows)]
+
+
+def main():
+    parser = ArgumentParser(description="Время разбора строк-дат")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=1095)
+    args = parser.parse_args()
+
+    values = _synthetic_dates(args.rows, args.days)
+
+    started = time.perf_counter()
+    expected = [datetime.strptime(value, _CREATION_FORMAT).date() for value in values]
+    strptime_time = time.perf_counter() - started
+
+    dates, times = dict(), set()
+    started = time.perf_counter()
+    parsed = [_parse_creation(value, dates=dates, times=times) for value in values]
+    parse_time = time.perf_counter() - started
+
+    assert parsed == expected
+    print(f"Строк: {args.rows}, различных дат: {len(dates)}, различных времен: {len(times)}")
+    print(f"strptime: {strptime_time:.2f} с, _parse_creation: {parse_time:.2f} с "
+          f"(x{strptime_time / parse_time:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Количество уникальных пакетов за период: точный режим и оценка HyperLogLog индекса в памяти
+(support_period_index.DistinctPackagesIndex), а также sql запрос COUNT(DISTINCT) к таблице packages
+Эталон - объединение множеств ID пакетов дней периода
+Синтетические данные: каждый день появляется --packages-per-day новых пакетов, пакет встречается
+от 1 до --max-span дней подряд
+По каждой длине периода: среднее время запроса и относительная ошибка (средняя и наибольшая) каждого способа,
+отдельно - период на весь набор данных. Результат - json
+Запуск из корневой директории проекта:
+python benchmarks/distinct_packages.py [--days 365] [--packages-per-day 1000] [--spans 1 7 30 90] [--output result.json]
+"""
+
+
+from argparse import ArgumentParser
+import json
+import os.path
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Set, Tuple
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from support_db_requests import DbRequests  # noqa: E402
+from support_period_index import DistinctPackagesIndex, PACKAGES_EXACT_LIMIT  # noqa: E402
+
+
+def _synthetic_rows(days: int, per_day: int, max_span: int) -> List[Tuple[int, int]]:
+    """:return: пары (день, ID пакета), упорядоченные по дню"""
+    rnd = random.Random(1)
+    rows = []
+    for package_id in range(days * per_day):
+        first = package_id // per_day
+        rows.extend((dt, package_id) for dt in range(first, min(first + rnd.randint(1, max_span), days)))
+    rows.sort()
+    return rows
+
+
+def _build(rows: List[Tuple[int, int]], days: int, exact_limit) -> Tuple[DistinctPackagesIndex, float, float]:
+    """:return: кортеж (индекс, время построения, с; память индекса, МБ)"""
+    started = time.perf_counter()
+    index = DistinctPackagesIndex(min_date=0, max_date=days - 1, rows=rows, exact_limit=exact_limit)
+    seconds = time.perf_counter() - started
+    # память - отдельным построением: tracemalloc замедляет построение в несколько раз
+    del index
+    tracemalloc.start()
+    index = DistinctPackagesIndex(min_date=0, max_date=days - 1, rows=rows, exact_limit=exact_limit)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return index, seconds, retained / 2 ** 20
+
+
+def _create_db(path: str, rows: List[Tuple[int, int]]):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE packages (date INTEGER, package_id INTEGER)")
+    conn.executemany("INSERT INTO packages VALUES(?, ?)", rows)
+    conn.execute(DbRequests.packages_date_index_create.value)
+    conn.commit()
+    conn.close()
+
+
+def _measure(count: Callable[[int, int], int], ranges: List[Tuple[int, int]], expected: List[int]) -> Dict:
+    timings, errors = [], []
+    for (low, high), truth in zip(ranges, expected):
+        started = time.perf_counter()
+        counted = count(low, high)
+        timings.append(time.perf_counter() - started)
+        errors.append(abs(counted - truth) / truth if truth else 0.0)
+    return {"mean_us": round(statistics.mean(timings) * 1e6, 1),
+            "mean_error_pct": round(statistics.mean(errors) * 100, 3),
+            "max_error_pct": round(max(errors) * 100, 3)}
+
+
+def main():
+    parser = ArgumentParser(description="Точное количество уникальных пакетов и оценка HyperLogLog")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--packages-per-day", type=int, default=1000)
+    parser.add_argument("--max-span", type=int, default=10, help="наибольшее количество дней одного пакета")
+    parser.add_argument("--spans", type=int, nargs="+", default=[1, 7, 30, 90, 365], help="длины периодов, дней")
+    parser.add_argument("--ranges", type=int, default=50, help="случайных периодов каждой длины")
+    parser.add_argument("--exact-limit", type=int, default=PACKAGES_EXACT_LIMIT,
+                        help="наибольшая сумма ID по дням периода для точного режима")
+    parser.add_argument("--output", default=None, help="файл для результата в формате json (по умолчанию - вывод)")
+    args = parser.parse_args()
+
+    rows = _synthetic_rows(args.days, args.packages_per_day, args.max_span)
+    daily: List[Set[int]] = [set() for _ in range(args.days)]
+    for dt, package_id in rows:
+        daily[dt].add(package_id)
+    print(f"Строк (день, пакет): {len(rows)}, пакетов: {args.days * args.packages_per_day}", file=sys.stderr)
+
+    exact_index, exact_seconds, exact_mb = _build(rows, args.days, exact_limit=None)
+    hybrid_index, hybrid_seconds, hybrid_mb = _build(rows, args.days, exact_limit=args.exact_limit)
+    result = {"config": vars(args),
+              "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                              "cpu_count": os.cpu_count()},
+              "data": {"rows": len(rows), "packages": args.days * args.packages_per_day},
+              "build": {"exact": {"seconds": round(exact_seconds, 3), "memory_mb": round(exact_mb, 1)},
+                        "exact_and_sketch": {"seconds": round(hybrid_seconds, 3), "memory_mb": round(hybrid_mb, 1)}},
+              "spans": []}
+
+    rnd = random.Random(2)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "packages.sqlite3")
+        _create_db(db_path, rows)
+        conn = sqlite3.connect(db_path)
+
+        def sql_count(low: int, high: int) -> int:
+            return conn.execute(DbRequests.package_select.value, (low, high)).fetchone()[0]
+
+        cases = [(f"{span}", [(low, low + span - 1) for low in
+                              (rnd.randrange(args.days - span + 1) for _ in range(args.ranges))])
+                 for span in args.spans if span <= args.days]
+        cases.append(("all", [(0, args.days - 1)]))
+        for name, ranges in cases:
+            started = time.perf_counter()
+            expected = [len(set().union(*daily[low:high + 1])) for low, high in ranges]
+            union_us = (time.perf_counter() - started) / len(ranges) * 1e6
+            row = {"span": name, "distinct_mean": round(statistics.mean(expected)),
+                   "set_union": {"mean_us": round(union_us, 1)},
+                   "index_exact": _measure(exact_index.count, ranges, expected),
+                   "index_exact_and_sketch": _measure(hybrid_index.count, ranges, expected),
+                   "sql": _measure(sql_count, ranges, expected)}
+            result["spans"].append(row)
+            print(f"период {name}: объединение {row['set_union']['mean_us']} мкс, точно "
+                  f"{row['index_exact']['mean_us']} мкс, с оценкой {row['index_exact_and_sketch']['mean_us']} мкс "
+                  f"(ошибка до {row['index_exact_and_sketch']['max_error_pct']}%), sql {row['sql']['mean_us']} мкс",
+                  file=sys.stderr)
+        conn.close()
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Нагрузочный замер полного пути запроса на синтетических данных
+1. Формируется синтетический xlsx файл заданного размера (дни, строк в день, авторы, пакеты)
+2. Загрузка (support_initializer.initialize_data) в отдельном процессе: время и пиковая память процесса (RSS)
+3. Сервер БД запускается в отдельном процессе, запросы meta и за период подаются с заданным числом
+   одновременных клиентов напрямую серверу БД (app.protocol) и через django (django.test.Client, без http)
+Результат - json: параметры, загрузка, по каждой цели, запросу и числу клиентов - пропускная способность
+и перцентили задержки p50/p95/p99
+БД и файлы создаются во временной директории. Сервер БД занимает порт DB_SERVER_PORT - приложение
+на время замера должно быть остановлено
+Запуск из корневой директории проекта:
+python benchmarks/full_path.py [--days N] [--rows-per-day N] [--concurrency 1 4 16] [--output result.json]
+"""
+
+
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+import json
+from multiprocessing import Process, Queue
+import os.path
+import platform
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import openpyxl
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.constants import DATE_BASEMENT, DB_SERVER_HOST, DB_SERVER_PORT, DB_META_COMMAND  # noqa: E402
+from app.protocol import send_frame, recv_frame, encode_period_request, decode_period_answer  # noqa: E402
+import support_db_requests  # noqa: E402
+from support_file_reader import use_source  # noqa: E402
+from support_initializer import initialize_data, run_socketserver, ServerMode  # noqa: E402
+
+
+_HEADER = ("Состояние заявки", "Статус заявки", "Автор заявки", "Дата создания заявки", "ID пакета")
+_STATES = ("ДОБАВЛЕНИЕ", "РАСШИРЕНИЕ", "Дубликат заявки", "ДОБАВЛЕНИЕ")
+_STATUSES = ("Обработка завершена", "Возвращена на уточнение", "Отправлена в обработку", "Черновик")
+_FIRST_DAY = datetime(2021, 1, 1, 9, 0, 0)
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """:return: пиковая память текущего процесса и завершенных дочерних процессов, МБ; None - нет модуля resource"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss в linux - КБ, в macOS - байты
+    scale = 1 if sys.platform == "darwin" else 1024
+    peak = max(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+    return round(peak * scale / 2 ** 20, 1)
+
+
+def _write_workbook(path: str, days: int, rows_per_day: int, authors: int, packages: int):
+    rnd = random.Random(1)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Data")
+    ws.append(_HEADER)
+    for day in range(days):
+        for _ in range(rows_per_day):
+            creation = _FIRST_DAY + timedelta(days=day, seconds=rnd.randrange(36000))
+            author = rnd.randrange(authors)
+            ws.append((rnd.choice(_STATES), rnd.choice(_STATUSES), f"Фамилия{author} Имя{author % 97}",
+                       creation.strftime("%d.%m.%Y %H:%M:%S"), f"PKG-{rnd.randrange(packages):08}"))
+    wb.save(path)
+
+
+def _ingest(source: str, db_path: str, workers: int, queue: Queue):
+    support_db_requests._DB_PATH = db_path
+    use_source(source)
+    started = time.perf_counter()
+    _, error = initialize_data(workers=workers, rebuild=True)
+    queue.put((time.perf_counter() - started, _peak_rss_mb(), error))
+
+
+def _serve(db_path: str, mode: str, queue: Queue):
+    support_db_requests._DB_PATH = db_path
+    run_socketserver(queue, mode=ServerMode(mode))
+
+
+def _random_period(rnd: random.Random, days: int) -> List[str]:
+    low = rnd.randrange(days)
+    high = min(days - 1, low + rnd.randrange(days))
+    first = (_FIRST_DAY.date() - DATE_BASEMENT).days
+    return [(DATE_BASEMENT + timedelta(days=first + day)).strftime("%Y-%m-%d") for day in (low, high)]
+
+
+def _run_load(make_client: Callable[[], Callable[[int], bool]], concurrency: int, total: int) -> Dict:
+    """
+    Подает total запросов из concurrency потоков, у каждого потока свой клиент (соединение)
+    :param make_client: создает клиента - функцию, выполняющую запрос с заданным номером, true - ответ без ошибки
+    :return: пропускная способность, перцентили задержки, количество ошибок
+    """
+    latencies, errors, lock = [], [0], threading.Lock()
+    per_thread = [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
+    clients = [make_client() for _ in range(concurrency)]
+    barrier = threading.Barrier(concurrency + 1)
+
+    def work(client: Callable[[int], bool], count: int, offset: int):
+        local, failed = [], 0
+        barrier.wait()
+        for i in range(offset, offset + count):
+            started = time.perf_counter()
+            ok = client(i)
+            local.append(time.perf_counter() - started)
+            failed += not ok
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    offsets = [sum(per_thread[:i]) for i in range(concurrency)]
+    threads = [threading.Thread(target=work, args=(client, count, offset))
+               for client, count, offset in zip(clients, per_thread, offsets)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {"concurrency": concurrency, "requests": total, "errors": errors[0],
+            "throughput_rps": round(total / elapsed, 1),
+            "p50_ms": round(percentiles[49] * 1000, 3), "p95_ms": round(percentiles[94] * 1000, 3),
+            "p99_ms": round(percentiles[98] * 1000, 3)}
+
+
+def _direct_client(endpoint: str, periods: List[List[str]]) -> Callable[[], Callable[[int], bool]]:
+    def make_client():
+        sock = socket.create_connection((DB_SERVER_HOST, DB_SERVER_PORT))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        meta = json.dumps(DB_META_COMMAND).encode(encoding="utf-8")
+
+        def request(i: int) -> bool:
+            period = periods[i % len(periods)]
+            if endpoint == "meta":
+                send_frame(sock, meta)
+                return bool(recv_frame(sock))
+            if endpoint == "period":
+                send_frame(sock, json.dumps(period).encode(encoding="utf-8"))
+                return json.loads(recv_frame(sock))[1] is None
+            low, high = ((datetime.strptime(day, "%Y-%m-%d").date() - DATE_BASEMENT).days for day in period)
+            send_frame(sock, encode_period_request(low, high))
+            return decode_period_answer(recv_frame(sock))[1] is None
+        return request
+    return make_client
+
+
+def _django_client(endpoint: str, periods: List[List[str]]) -> Callable[[], Callable[[int], bool]]:
+    from django.test import Client
+    from django.urls import reverse
+
+    url = reverse("meta" if endpoint == "meta" else "period_data")
+
+    def make_client():
+        # без http сервера: запрос проходит middleware, маршрутизацию и представление django
+        client = Client(HTTP_HOST="localhost")
+
+        def request(i: int) -> bool:
+            if endpoint == "meta":
+                return client.get(url).status_code == 200
+            response = client.post(url, json.dumps(periods[i % len(periods)]), content_type="application/json")
+            return response.status_code == 200 and response.json()[1] is None
+        return request
+    return make_client
+
+
+def main():
+    parser = ArgumentParser(description="Нагрузочный замер полного пути запроса")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--rows-per-day", type=int, default=100)
+    parser.add_argument("--authors", type=int, default=500)
+    parser.add_argument("--packages", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=1, help="процессы сбора данных при загрузке")
+    parser.add_argument("--server", choices=[mode.value for mode in ServerMode], default=ServerMode.threading.value)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=2000, help="запросов на каждое сочетание цели и запроса")
+    parser.add_argument("--output", default=None, help="файл для результата в формате json (по умолчанию - вывод)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "myreport.settings")
+    import django
+    django.setup()
+
+    result = {"config": vars(args),
+              "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                              "cpu_count": os.cpu_count()},
+              "load": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        source, db_path = os.path.join(tmp, "source.xlsx"), os.path.join(tmp, "db.sqlite3")
+        started = time.perf_counter()
+        _write_workbook(source, args.days, args.rows_per_day, args.authors, args.packages)
+        print(f"Синтетический файл сформирован за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+
+        queue = Queue()
+        process = Process(target=_ingest, args=(source, db_path, args.workers, queue))
+        process.start()
+        seconds, peak_rss_mb, error = queue.get()
+        process.join()
+        if error is not None:
+            raise RuntimeError(error)
+        result["ingestion"] = {"rows": args.days * args.rows_per_day, "source_bytes": os.path.getsize(source),
+                               "db_bytes": os.path.getsize(db_path), "seconds": round(seconds, 3),
+                               "peak_rss_mb": peak_rss_mb}
+        print(f"Загрузка: {seconds:.2f} с, пиковая память {peak_rss_mb} МБ", file=sys.stderr)
+
+        server = Process(target=_serve, args=(db_path, args.server, queue), daemon=True)
+        server.start()
+        error = queue.get()
+        if error is not None:
+            raise RuntimeError(error)
+        try:
+            rnd = random.Random(2)
+            periods = [_random_period(rnd, args.days) for _ in range(args.requests)]
+            targets = [("db_server", _direct_client, ("meta", "period", "period_binary")),
+                       ("django", _django_client, ("meta", "period"))]
+            for target, make, endpoints in targets:
+                for endpoint in endpoints:
+                    for concurrency in args.concurrency:
+                        load = _run_load(make(endpoint, periods), concurrency, args.requests)
+                        result["load"].append({"target": target, "endpoint": endpoint, **load})
+                        print(f"{target} {endpoint} x{concurrency}: {load['throughput_rps']} запросов/с, "
+                              f"p99 {load['p99_ms']} мс", file=sys.stderr)
+        finally:
+            server.terminate()
+            server.join()
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Время sql запроса за период (requests_select + user_select) в зависимости от длины периода
+Сравниваются схема версии 0 без индексов, схема версии 0 с индексами по дате и текущая схема (users_dim)
+Данные синтетические, БД создаются во временной директории
+Запуск из корневой директории проекта: python benchmarks/query_span.py [--days N] [--users-per-day N]
+"""
+
+
+from argparse import ArgumentParser
+import os.path
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from support_db_requests import DbRequests  # noqa: E402
+
+
+_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+_SCHEMA_V0 = """CREATE TABLE requests (date INTEGER, loaded INTEGER, doubles INTEGER, for_creation INTEGER,
+                                       for_expand INTEGER, handle_over INTEGER, returned INTEGER,
+                                       sent_for_handle INTEGER, packages INTEGER);
+                CREATE TABLE users (date INTEGER, user_fio TEXT);
+                CREATE TABLE date_range (min_date INTEGER, max_date INTEGER);"""
+
+_INDEXES_V0 = """CREATE INDEX requests_date ON requests(date);
+                 CREATE INDEX users_date ON users(date, user_fio);"""
+
+_V0_SELECTS = (DbRequests.requests_select.value,
+               "SELECT COUNT(DISTINCT user_fio) FROM users WHERE date >= ? and date <= ?")
+
+_SPANS = (1, 7, 30, 90, 365, 1825)
+
+
+def _synthetic_data(days: int, users_per_day: int):
+    rnd = random.Random(1)
+    names = [f"Фамилия{i} Имя{i % 97} Отчество{i % 89}" for i in range(users_per_day * 4)]
+    users = [(dt, name) for dt in range(days) for name in rnd.sample(names, users_per_day)]
+    requests_qnt = [(dt, *(rnd.randrange(100) for _ in range(8))) for dt in range(days)]
+    return users, requests_qnt
+
+
+def _create_v0(path: str, users, requests_qnt, indexes: bool):
+    conn = sqlite3.connect(path)
+    conn.executescript(_SCHEMA_V0 + (_INDEXES_V0 if indexes else ""))
+    conn.executemany("INSERT INTO users VALUES(?, ?)", users)
+    conn.executemany("INSERT INTO requests VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)", requests_qnt)
+    conn.commit()
+    conn.close()
+
+
+def _create_current(path: str, users, requests_qnt):
+    _create_v0(path, users, requests_qnt, indexes=False)
+    with open(os.path.join(_ROOT, "db_migration_1.sql"), encoding="utf-8") as f:
+        migration = f.read()
+    conn = sqlite3.connect(path)
+    conn.executescript(migration)
+    conn.close()
+
+
+def _measure(path: str, selects, days: int, span: int, repeats: int) -> float:
+    """:return: медиана времени одного запроса за период, мс"""
+    conn = sqlite3.connect(path)
+    timings = []
+    for i in range(repeats):
+        low = (i * 7919) % max(days - span + 1, 1)
+        started = time.perf_counter()
+        for select in selects:
+            conn.execute(select, (low, low + span - 1)).fetchone()
+        timings.append((time.perf_counter() - started) * 1000)
+    conn.close()
+    return statistics.median(timings)
+
+
+def main():
+    parser = ArgumentParser(description="Время запроса за период в зависимости от длины периода")
+    parser.add_argument("--days", type=int, default=1825)
+    parser.add_argument("--users-per-day", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=15)
+    args = parser.parse_args()
+
+    users, requests_qnt = _synthetic_data(args.days, args.users_per_day)
+    current_selects = (DbRequests.requests_select.value, DbRequests.user_select.value)
+    with tempfile.TemporaryDirectory() as tmp:
+        variants = [("v0 без индексов", os.path.join(tmp, "v0.sqlite3"), _V0_SELECTS),
+                    ("v0 с индексами", os.path.join(tmp, "v0_indexed.sqlite3"), _V0_SELECTS),
+                    ("v1 users_dim", os.path.join(tmp, "v1.sqlite3"), current_selects)]
+        _create_v0(variants[0][1], users, requests_qnt, indexes=False)
+        _create_v0(variants[1][1], users, requests_qnt, indexes=True)
+        _create_current(variants[2][1], users, requests_qnt)
+
+        print(f"Дней: {args.days}, строк users: {len(users)}")
+        print("Размер БД, КБ: " + ", ".join(f"{name} {os.path.getsize(path) // 1024}"
+                                             for name, path, _ in variants))
+        print(f"{'дней в периоде':>15}" + "".join(f"{name:>18}" for name, _, _ in variants) + "   (мс, медиана)")
+        for span in (span for span in _SPANS if span <= args.days):
+            row = [_measure(path, selects, args.days, span, args.repeats) for _, path, selects in variants]
+            print(f"{span:>15}" + "".join(f"{value:>18.3f}" for value in row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Время чтения исходных данных (support_file_reader.read_data_from_file) из xlsx, csv и parquet файлов
+с одинаковым содержимым: строки testing_data.xlsx, повторенные --copies раз
+parquet замеряется только при установленном pyarrow
+Запуск из корневой директории проекта: python benchmarks/source_formats.py [--copies N]
+"""
+
+
+from argparse import ArgumentParser
+import csv
+import os.path
+import sys
+import tempfile
+import time
+
+import openpyxl
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import support_file_reader  # noqa: E402
+from support_xlsx_reader import XlsxStreamSheet  # noqa: E402
+
+
+def _source_rows():
+    with XlsxStreamSheet(filename=support_file_reader._SOURCE_FILE,
+                         sheet_name=support_file_reader._SHEET_WITH_DATA) as ws:
+        return list(ws.iter_rows())
+
+
+def _write_xlsx(path: str, header, rows):
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(support_file_reader._SHEET_WITH_DATA)
+    ws.append(header)
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+
+
+def _write_csv(path: str, header, rows):
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def _write_parquet(path: str, header, rows) -> bool:
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return False
+    columns = [[None if row[i] is None else str(row[i]) for row in rows] for i in range(len(header))]
+    pyarrow.parquet.write_table(pyarrow.table(columns, names=header), path)
+    return True
+
+
+def _measure(path: str, fast: bool = True) -> float:
+    support_file_reader.use_source(path)
+    started = time.perf_counter()
+    _, error = support_file_reader.read_data_from_file(fast=fast)
+    elapsed = time.perf_counter() - started
+    if error is not None:
+        raise RuntimeError(error)
+    return elapsed
+
+
+def main():
+    parser = ArgumentParser(description="Время чтения исходных данных в разных форматах")
+    parser.add_argument("--copies", type=int, default=100)
+    args = parser.parse_args()
+
+    header, *rows = _source_rows()
+    rows = rows * args.copies
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {name: os.path.join(tmp, f"data.{name}") for name in ("xlsx", "csv", "parquet")}
+        _write_xlsx(paths["xlsx"], header, rows)
+        _write_csv(paths["csv"], header, rows)
+        has_parquet = _write_parquet(paths["parquet"], header, rows)
+
+        print(f"Строк: {len(rows)}")
+        print("Размер файла, КБ: " + ", ".join(f"{name} {os.path.getsize(path) // 1024}"
+                                             for name, path in paths.items() if os.path.exists(path)))
+        timings = [("xlsx openpyxl", _measure(paths["xlsx"], fast=False)),
+                   ("xlsx потоковое", _measure(paths["xlsx"])),
+                   ("csv", _measure(paths["csv"]))]
+        if has_parquet:
+            timings.append(("parquet", _measure(paths["parquet"])))
+        else:
+            print("pyarrow не установлен, parquet не замеряется")
+        for name, elapsed in timings:
+            print(f"{name:>15}: {elapsed:.2f} с")
+
+
+if __name__ == "__main__":
+    main()
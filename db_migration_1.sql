@@ -0,0 +1,42 @@
+-- Миграция схемы версии 0 (без версии) на версию 1:
+-- имена пользователей вынесены в справочник users_dim, users хранит идентификаторы (автор NULL - user_id NULL),
+-- requests упорядочена по дате (date - первичный ключ), индекс users_date покрывает запросы по пользователям
+BEGIN;
+
+CREATE TABLE users_dim (
+    id  INTEGER PRIMARY KEY,
+    fio TEXT UNIQUE
+);
+INSERT INTO users_dim(fio) SELECT DISTINCT user_fio FROM users WHERE user_fio IS NOT NULL ORDER BY user_fio;
+
+CREATE TABLE users_v1 (
+    date    INTEGER,
+    user_id INTEGER
+);
+INSERT INTO users_v1(date, user_id)
+SELECT users.date, users_dim.id FROM users LEFT JOIN users_dim ON users_dim.fio = users.user_fio;
+DROP TABLE users;
+ALTER TABLE users_v1 RENAME TO users;
+CREATE INDEX users_date ON users(date, user_id);
+
+CREATE TABLE requests_v1 (
+    date            INTEGER PRIMARY KEY,
+    loaded          INTEGER,
+    doubles         INTEGER,
+    for_creation    INTEGER,
+    for_expand      INTEGER,
+    handle_over     INTEGER,
+    returned        INTEGER,
+    sent_for_handle INTEGER,
+    packages        INTEGER
+);
+INSERT INTO requests_v1
+SELECT date, SUM(loaded), SUM(doubles), SUM(for_creation), SUM(for_expand),
+       SUM(handle_over), SUM(returned), SUM(sent_for_handle), SUM(packages)
+FROM requests GROUP BY date;
+DROP TABLE requests;
+ALTER TABLE requests_v1 RENAME TO requests;
+
+PRAGMA user_version = 1;
+
+COMMIT;
@@ -0,0 +1,20 @@
+-- Миграция схемы версии 1 на версию 2:
+-- журнал загруженных файлов источника-каталога (ingest_files) и дней каждого файла (ingest_file_days)
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS ingest_files (
+    source       TEXT PRIMARY KEY,
+    size         INTEGER,
+    mtime_ns     INTEGER,
+    content_hash TEXT
+);
+
+CREATE TABLE IF NOT EXISTS ingest_file_days (
+    source TEXT,
+    date   INTEGER,
+    PRIMARY KEY (source, date)
+);
+
+PRAGMA user_version = 2;
+
+COMMIT;
@@ -0,0 +1,29 @@
+-- Миграция схемы версии 2 на версию 3:
+-- ID пакетов каждого дня (справочник packages_dim, таблица packages) - для количества уникальных пакетов за период
+-- В БД версии 2 ID пакетов не сохранялись, таблицы заполняются только из исходных файлов: манифест и журнал
+-- файлов очищаются, и следующая загрузка читает источник полностью
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS packages_dim (
+    id      INTEGER PRIMARY KEY,
+    package TEXT UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS packages (
+    date       INTEGER,
+    package_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS packages_date ON packages(date, package_id);
+
+-- автор NULL хранится как user_id NULL, строки справочника с NULL (прежние загрузки добавляли их при каждом
+-- запуске) не используются
+DELETE FROM users_dim WHERE fio IS NULL;
+
+DELETE FROM ingest_manifest;
+DELETE FROM ingest_days;
+DELETE FROM ingest_files;
+DELETE FROM ingest_file_days;
+
+PRAGMA user_version = 3;
+
+COMMIT;
@@ -1,9 +1,16 @@
 DROP TABLE IF EXISTS requests;
 DROP TABLE IF EXISTS users;
+DROP TABLE IF EXISTS users_dim;
+DROP TABLE IF EXISTS packages;
+DROP TABLE IF EXISTS packages_dim;
 DROP TABLE IF EXISTS date_range;
+DROP TABLE IF EXISTS ingest_manifest;
+DROP TABLE IF EXISTS ingest_days;
+DROP TABLE IF EXISTS ingest_files;
+DROP TABLE IF EXISTS ingest_file_days;
 
 CREATE TABLE requests (
-    date            INTEGER,
+    date            INTEGER PRIMARY KEY,
     loaded          INTEGER,
     doubles         INTEGER,
     for_creation    INTEGER,
@@ -14,9 +21,24 @@ CREATE TABLE requests (
     packages        INTEGER
 );
 
+CREATE TABLE users_dim (
+    id  INTEGER PRIMARY KEY,
+    fio TEXT UNIQUE
+);
+
 CREATE TABLE users (
-    date     INTEGER,
-    user_fio TEXT    
+    date    INTEGER,
+    user_id INTEGER
+);
+
+CREATE TABLE packages_dim (
+    id      INTEGER PRIMARY KEY,
+    package TEXT UNIQUE
+);
+
+CREATE TABLE packages (
+    date       INTEGER,
+    package_id INTEGER
 );
 
 CREATE TABLE date_range (
@@ -24,3 +46,30 @@ CREATE TABLE date_range (
     max_date INTEGER    
 );
 
+CREATE TABLE ingest_manifest (
+    source       TEXT,
+    size         INTEGER,
+    mtime_ns     INTEGER,
+    content_hash TEXT
+);
+
+CREATE TABLE ingest_days (
+    date        INTEGER PRIMARY KEY,
+    fingerprint TEXT
+);
+
+CREATE TABLE ingest_files (
+    source       TEXT PRIMARY KEY,
+    size         INTEGER,
+    mtime_ns     INTEGER,
+    content_hash TEXT
+);
+
+CREATE TABLE ingest_file_days (
+    source TEXT,
+    date   INTEGER,
+    PRIMARY KEY (source, date)
+);
+
+-- версия схемы, см. support_initializer._SCHEMA_VERSION и db_migration_<версия>.sql
+PRAGMA user_version = 3;
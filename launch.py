@@ -1,32 +1,136 @@
 """
 Модуль для запуска подготовительных функций и самого django-приложения
 Точка входа для проекта
+django запускается сразу, одновременно с загрузкой данных и запуском сервера БД: до готовности сервера БД
+представления отвечают, что данные загружаются, а /ready/ - кодом 503 (см. app.views.ready)
 """
 
+from argparse import ArgumentParser
 from multiprocessing import Process, Queue
+import os
+import signal
 import subprocess
 import sys
-from support_initializer import initialize_data, run_socketserver
+from typing import Optional, Union
+from support_file_reader import use_source, SourceFormat
+from support_initializer import initialize_data, invalidate_shared_cache, run_socketserver, PeriodSource, ServerMode
+from support_profiler import start_profile, finish_profile, format_report
 
 
-def preparatory_work():
-    _, error = initialize_data()
+def _parse_args():
+    parser = ArgumentParser(description="Подготовка данных и запуск приложения")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="количество процессов для сбора данных из исходного файла (по умолчанию 1)")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="пересоздать базу данных, даже если исходный файл не изменился")
+    parser.add_argument("--server", choices=[mode.value for mode in ServerMode], default=ServerMode.threading.value,
+                        help="реализация сервера базы данных (по умолчанию threading)")
+    parser.add_argument("--period-source", choices=[source.value for source in PeriodSource],
+                        default=PeriodSource.index.value,
+                        help="источник ответов за период: index - индекс в памяти, sql - запросы к БД, "
+                             "compare - оба со сверкой результатов (по умолчанию index)")
+    parser.add_argument("--cache-mb", type=int, default=4,
+                        help="объем памяти кэша ответов сервера базы данных, МБ (по умолчанию 4)")
+    parser.add_argument("--shared-cache", action="store_true",
+                        help="общий для процессов django кэш ответов в файле, отображаемом в память")
+    parser.add_argument("--source", default=None,
+                        help="исходный файл (xlsx, csv или parquet), каталог или шаблон glob вместо testing_data.xlsx")
+    parser.add_argument("--source-format", choices=[source_format.value for source_format in SourceFormat],
+                        default=None, help="формат исходного файла (по умолчанию - по расширению файла)")
+    parser.add_argument("--reload-interval", type=float, default=0,
+                        help="интервал проверки исходных файлов, секунд: при изменении данные перезагружаются "
+                             "без остановки сервера (по умолчанию 0 - без проверки)")
+    parser.add_argument("--stats", action="store_true",
+                        help="собирать статистику сервера базы данных: время этапов, задержки, соединения (/stats/)")
+    parser.add_argument("--profile", default=None, metavar="REPORT",
+                        help="профилировать этапы загрузки данных и записать отчет в формате json в файл REPORT")
+    parser.add_argument("--cprofile", action="store_true",
+                        help="вместе с --profile: профиль cProfile самого долгого этапа в файле REPORT.prof")
+    args = parser.parse_args()
+    if args.cprofile and args.profile is None:
+        parser.error("--cprofile используется только вместе с --profile")
+    return args
+
+
+def _write_profile(report_path: str, error: Optional[str]):
+    try:
+        report = finish_profile(report_path=report_path, error=error)
+    except OSError as err:
+        print(f"!ОШИБКА ОТЧЕТА ПРОФИЛИРОВАНИЯ - {err}")
+        return
+    print(format_report(report))
+    print(f"Отчет профилирования загрузки записан в {report_path}")
+
+
+def _start_django() -> subprocess.Popen:
+    # отдельная группа процессов: при остановке вместе с runserver останавливается и его процесс автоперезагрузки
+    if os.name == "posix":
+        return subprocess.Popen([sys.executable, 'manage.py', 'runserver'], start_new_session=True)
+    return subprocess.Popen([sys.executable, 'manage.py', 'runserver'],
+                            creationflags=subprocess.CREATE_NEW_PROCESS_GROUP)
+
+
+def _stop_django(process: subprocess.Popen):
+    if os.name == "posix":
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    else:
+        process.terminate()
+    process.wait()
+
+
+def preparatory_work(workers: int = 1, rebuild: bool = False, server_mode: ServerMode = ServerMode.threading,
+                     period_source: PeriodSource = PeriodSource.index, cache_mb: int = 4, shared_cache: bool = False,
+                     source: Optional[str] = None, source_format: Optional[SourceFormat] = None,
+                     reload_interval: float = 0, stats: bool = False, profile: Optional[str] = None,
+                     cprofile: bool = False) -> Union[None, str]:
+    """
+    Загрузка данных и запуск сервера БД в отдельном процессе
+    :return: ошибка, None - сервер БД запущен
+    """
+    if source is not None:
+        use_source(path=source, source_format=source_format)
+    if profile is not None:
+        start_profile(cprofile=cprofile)
+    _, error = initialize_data(workers=workers, rebuild=rebuild)
+    if profile is not None:
+        _write_profile(report_path=profile, error=error)
     if error is not None:
-        print(error)
-        input("Приложение закрыто, нажмите любую клавишу для выхода: ")
-        sys.exit()
+        return error
 
     queue = Queue()
-    process = Process(target=run_socketserver, args=(queue,))
+    server_kwargs = dict(period_source=period_source, mode=server_mode, cache_bytes=cache_mb * 1024 * 1024,
+                         shared=shared_cache, reload_interval=reload_interval, workers=workers, source=source,
+                         source_format=source_format, stats=stats)
+    process = Process(target=run_socketserver, args=(queue,), kwargs=server_kwargs)
     process.daemon = True
     process.start()
-    error = queue.get()
-    if error is not None:
-        print(error)
-        input("Приложение закрыто, нажмите любую клавишу для выхода: ")
-        sys.exit()
+    return queue.get()
 
 
 if __name__ == "__main__":
-    preparatory_work()
-    subprocess.run([sys.executable, 'manage.py', 'runserver'])
+    args = _parse_args()
+    # ответы общего кэша от предыдущего запуска не должны отдаваться, пока загружаются новые данные
+    invalidate_shared_cache()
+    django_process = _start_django()
+    # runserver запущен в отдельной группе процессов и не получает Ctrl+C - останавливается здесь при любом выходе
+    try:
+        error = preparatory_work(workers=args.workers, rebuild=args.rebuild, server_mode=ServerMode(args.server),
+                                 period_source=PeriodSource(args.period_source), cache_mb=args.cache_mb,
+                                 shared_cache=args.shared_cache, source=args.source,
+                                 source_format=SourceFormat(args.source_format) if args.source_format else None,
+                                 reload_interval=args.reload_interval, stats=args.stats, profile=args.profile,
+                                 cprofile=args.cprofile)
+        if error is not None:
+            _stop_django(django_process)
+            print(error)
+            input("Приложение закрыто, нажмите любую клавишу для выхода: ")
+            sys.exit()
+        print("Сервер базы данных готов к запросам")
+        django_process.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _stop_django(django_process)
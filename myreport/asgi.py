@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myreport.settings')
+# запросы к серверу БД из meta и period не занимают поток на время ожидания ответа
+os.environ.setdefault('MYREPORT_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
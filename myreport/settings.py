@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -121,3 +122,19 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# meta и period обслуживаются асинхронными представлениями (app.views.meta_async, period_data_async),
+# включается в ASGI процессе - см. myreport/asgi.py
+ASYNC_VIEWS = os.environ.get('MYREPORT_ASYNC_VIEWS') == '1'
+
+if ASYNC_VIEWS:
+    # Под ASGI каждый вызов синхронного middleware выполняется через sync_to_async в одном общем потоке -
+    # полная цепочка в несколько раз снижает пропускную способность (см. benchmarks/asgi_wsgi.py).
+    # ASGI процесс обслуживает только дашборд: сессии, пользователи, сообщения и csrf нужны админке,
+    # которая работает в WSGI процессе (python launch.py или manage.py runserver)
+    INSTALLED_APPS.remove('django.contrib.admin')
+    MIDDLEWARE = [
+        'django.middleware.security.SecurityMiddleware',
+        'django.middleware.common.CommonMiddleware',
+        'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    ]
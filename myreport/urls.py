@@ -14,13 +14,21 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
 from app import views
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('', views.home, name='home'),
-    path('meta/', views.meta, name='meta'),
-    path('period/', views.period_data, name='period_data')
+    path('meta/', views.meta_async if settings.ASYNC_VIEWS else views.meta, name='meta'),
+    path('period/', views.period_data_async if settings.ASYNC_VIEWS else views.period_data, name='period_data'),
+    path('period/batch/', views.period_batch, name='period_batch'),
+    path('period/series/', views.period_series, name='period_series'),
+    path('stats/', views.stats, name='stats'),
+    path('ready/', views.ready, name='ready')
 ]
+
+if not settings.ASYNC_VIEWS:
+    # админка - только в WSGI процессе, см. ASYNC_VIEWS в myreport/settings.py
+    urlpatterns.append(path('admin/', admin.site.urls))
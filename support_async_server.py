@@ -0,0 +1,121 @@
+"""
+Модуль содержит асинхронную (asyncio) реализацию сервера для взаимодействия с базой данных
+Протокол тот же, что у сервера на потоках (см. app.protocol), но все соединения обслуживаются одним потоком,
+а запросы, требующие обращения к БД, выполняются в небольшом пуле потоков со своими соединениями к БД
+По одному соединению клиент может отправлять запросы, не дожидаясь ответов - ответы приходят в порядке запросов
+"""
+
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+from typing import Callable, Optional, Tuple
+
+from app.protocol import pack_frame, read_frame
+from support_server_stats import ServerStats, Stage
+
+
+# максимальное количество запросов одного соединения, ожидающих отправки ответа
+_PIPELINE_DEPTH = 32
+
+
+class _AsyncDataBaseServer:
+    def __init__(self, dispatch: Callable[[bytes], bytes], offload: bool, max_concurrency: int, db_threads: int,
+                 stats: Optional[ServerStats] = None, inline: Optional[Callable[[bytes], bool]] = None):
+        self._dispatch = dispatch
+        self._stats = stats
+        self._offload = offload
+        self._inline = inline
+        self._requests_limit = asyncio.Semaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=db_threads, thread_name_prefix="db")
+
+    async def _answer(self, request: bytes) -> bytes:
+        try:
+            if not self._offload or (self._inline is not None and self._inline(request)):
+                return self._dispatch(request)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._dispatch, request)
+        finally:
+            self._requests_limit.release()
+
+    async def _write_answers(self, writer: asyncio.StreamWriter, answers: asyncio.Queue):
+        try:
+            while (answer := await answers.get()) is not None:
+                data = await answer
+                started = time.perf_counter_ns() if self._stats is not None else 0
+                writer.write(pack_frame(data))
+                await writer.drain()
+                if self._stats is not None:
+                    self._stats.record_stage(Stage.send, time.perf_counter_ns() - started)
+        except BaseException:
+            # закрытие соединения прерывает и ожидание следующего запроса в handle_connection
+            writer.close()
+            raise
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if self._stats is not None:
+            self._stats.connection_opened()
+        answers = asyncio.Queue(maxsize=_PIPELINE_DEPTH)
+        writing = asyncio.create_task(self._write_answers(writer, answers))
+        try:
+            while not writing.done():
+                try:
+                    request = await read_frame(reader)
+                except ConnectionError:
+                    break
+                if request is None:
+                    break
+                await self._requests_limit.acquire()
+                await answers.put(asyncio.create_task(self._answer(request)))
+            if not writing.done():
+                await answers.put(None)
+            await writing
+        except Exception as err:
+            print(f"!_ОШИБКА СЕРВЕРА БД - соединение закрыто: {err!r}")
+        finally:
+            writing.cancel()
+            writer.close()
+            if self._stats is not None:
+                self._stats.connection_closed()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def _serve(address: Tuple[str, int], queue, server: _AsyncDataBaseServer):
+    try:
+        listener = await asyncio.start_server(server.handle_connection, host=address[0], port=address[1],
+                                              reuse_address=True)
+    except OSError as err:
+        queue.put(f"!_ОШИБКА СЕРВЕРА БД - {err}")
+        return
+    queue.put(None)
+    print("Асинхронный сервер для взаимодействия с базой данных запущен")
+    async with listener:
+        await listener.serve_forever()
+
+
+def run_async_server(address: Tuple[str, int], queue, dispatch: Callable[[bytes], bytes], offload: bool,
+                     max_concurrency: int, db_threads: int, stats: Optional[ServerStats] = None,
+                     inline: Optional[Callable[[bytes], bool]] = None):
+    """
+    Запуск асинхронного сервера, блокирует вызывающий поток
+    :param address: адрес и порт
+    :param queue: очередь для сигнализации об ошибке запуска (или None при успешном запуске)
+    :param dispatch: функция, формирующая ответ на запрос
+    :param offload: true - dispatch обращается к БД и выполняется в пуле потоков, false - прямо в цикле событий
+    :param max_concurrency: максимальное количество одновременно обрабатываемых запросов всех соединений
+    :param db_threads: количество потоков для обращений к БД
+    :param stats: счетчики соединений и времени отправки ответов, None - без сбора статистики
+    :param inline: при offload - true для запросов, ответ на которые быстрее выполнить прямо в цикле событий
+    :return:
+    """
+    async def main():
+        server = _AsyncDataBaseServer(dispatch=dispatch, offload=offload, max_concurrency=max_concurrency,
+                                      db_threads=db_threads, stats=stats, inline=inline)
+        try:
+            await _serve(address=address, queue=queue, server=server)
+        finally:
+            server.close()
+
+    asyncio.run(main())
@@ -4,13 +4,18 @@
 """
 
 
+from contextlib import contextmanager
 from enum import Enum
 import os.path
 import sqlite3
+import threading
 from typing import Callable, Union, Any, Tuple
+from support_profiler import stage
 
 
-_DB_PATH = os.path.join(os.path.dirname(__file__), "db.sqlite3")
+# БД отчета - отдельный от БД django (myreport.settings.DATABASES) файл: перезагрузка данных заменяет
+# содержимое БД отчета целиком (см. db_copy), таблицы django при этом не затрагиваются
+_DB_PATH = os.path.join(os.path.dirname(__file__), "report.sqlite3")
 
 
 class RangeCols(Enum):
@@ -20,7 +25,22 @@ class RangeCols(Enum):
 
 class UserCols(Enum):
     dt = "date"
-    fio = "user_fio"
+    user_id = "user_id"
+
+
+class UsersDimCols(Enum):
+    id = "id"
+    fio = "fio"
+
+
+class PackageCols(Enum):
+    dt = "date"
+    package_id = "package_id"
+
+
+class PackagesDimCols(Enum):
+    id = "id"
+    package = "package"
 
 
 class RequestsCols(Enum):
@@ -35,10 +55,68 @@ class RequestsCols(Enum):
     packages = "packages"
 
 
+class ManifestCols(Enum):
+    source = "source"
+    size = "size"
+    mtime = "mtime_ns"
+    content_hash = "content_hash"
+
+
+class IngestDaysCols(Enum):
+    dt = "date"
+    fingerprint = "fingerprint"
+
+
+class IngestFilesCols(Enum):
+    source = "source"
+    size = "size"
+    mtime = "mtime_ns"
+    content_hash = "content_hash"
+
+
+class IngestFileDaysCols(Enum):
+    source = "source"
+    dt = "date"
+
+
 class DbRequests(Enum):
+    # настройки соединения массовой загрузки: журнал WAL, без fsync, 64 МБ кэша страниц
+    bulk_load_pragmas = """PRAGMA journal_mode = WAL;
+                           PRAGMA synchronous = OFF;
+                           PRAGMA cache_size = -65536;
+                           PRAGMA temp_store = MEMORY;"""
+
+    # настройки соединений сервера БД: только чтение, файл БД отображается в память (до 256 МБ)
+    read_pragmas = """PRAGMA query_only = ON;
+                      PRAGMA mmap_size = 268435456;"""
+
+    schema_version_select = "PRAGMA user_version"
+
+    # таблица requests упорядочена по дате (первичный ключ), для users покрывающий индекс по дате
+    # создается после массовой загрузки, см. support_initializer._first_insertion
+    users_date_index_create = f"""CREATE INDEX IF NOT EXISTS users_date
+                                  ON users({UserCols.dt.value}, {UserCols.user_id.value})"""
+
+    packages_date_index_create = f"""CREATE INDEX IF NOT EXISTS packages_date
+                                     ON packages({PackageCols.dt.value}, {PackageCols.package_id.value})"""
+
     date_range_insert = f"INSERT INTO date_range({RangeCols.min_dt.value}, {RangeCols.max_dt.value}) VALUES(?, ?)"
 
-    users_insert = f"INSERT INTO users({UserCols.dt.value}, {UserCols.fio.value}) VALUES(?, ?)"
+    users_dim_insert = f"INSERT OR IGNORE INTO users_dim({UsersDimCols.fio.value}) VALUES(?)"
+
+    # параметры: день, имя пользователя - имя должно быть в users_dim, см. users_dim_insert
+    # Автор не указан (NULL) - user_id NULL: в users_dim NULL не добавляется (UNIQUE допускает повторные NULL,
+    # и каждая загрузка добавляла бы новую строку), COUNT(DISTINCT) и индекс такие строки не учитывают
+    users_insert = f"""INSERT INTO users({UserCols.dt.value}, {UserCols.user_id.value})
+                       VALUES(?, (SELECT {UsersDimCols.id.value} FROM users_dim WHERE {UsersDimCols.fio.value} = ?))"""
+
+    packages_dim_insert = f"INSERT OR IGNORE INTO packages_dim({PackagesDimCols.package.value}) VALUES(?)"
+
+    # параметры: день, ID пакета - ID должен быть в packages_dim, см. packages_dim_insert
+    # ID пакета не указан (NULL) - package_id NULL, как в users_insert
+    packages_insert = f"""INSERT INTO packages({PackageCols.dt.value}, {PackageCols.package_id.value})
+                          VALUES(?, (SELECT {PackagesDimCols.id.value} FROM packages_dim
+                                     WHERE {PackagesDimCols.package.value} = ?))"""
 
     requests_insert = f"""INSERT INTO requests({RequestsCols.dt.value},
                                                {RequestsCols.loaded.value},
@@ -54,10 +132,68 @@ class DbRequests(Enum):
 
     date_range_select = f"""SELECT {RangeCols.min_dt.value}, {RangeCols.max_dt.value} FROM date_range"""
 
-    user_select = f"""SELECT COUNT(DISTINCT {UserCols.fio.value})
+    date_range_delete = "DELETE FROM date_range"
+
+    users_delete_day = f"DELETE FROM users WHERE {UserCols.dt.value} = ?"
+
+    packages_delete_day = f"DELETE FROM packages WHERE {PackageCols.dt.value} = ?"
+
+    requests_delete_day = f"DELETE FROM requests WHERE {RequestsCols.dt.value} = ?"
+
+    manifest_insert = f"""INSERT INTO ingest_manifest({ManifestCols.source.value}, {ManifestCols.size.value},
+                                                      {ManifestCols.mtime.value}, {ManifestCols.content_hash.value})
+                          VALUES(?, ?, ?, ?)"""
+
+    manifest_select = f"""SELECT {ManifestCols.source.value}, {ManifestCols.size.value},
+                                 {ManifestCols.mtime.value}, {ManifestCols.content_hash.value}
+                          FROM ingest_manifest"""
+
+    manifest_delete = "DELETE FROM ingest_manifest"
+
+    ingest_days_insert = f"""INSERT INTO ingest_days({IngestDaysCols.dt.value}, {IngestDaysCols.fingerprint.value})
+                             VALUES(?, ?)"""
+
+    ingest_days_select = f"""SELECT {IngestDaysCols.dt.value}, {IngestDaysCols.fingerprint.value} FROM ingest_days"""
+
+    ingest_days_delete = "DELETE FROM ingest_days"
+
+    # журнал файлов источника-каталога, см. support_initializer._initialize_from_files
+    ingest_files_insert = f"""INSERT OR REPLACE INTO ingest_files({IngestFilesCols.source.value},
+                                                                  {IngestFilesCols.size.value},
+                                                                  {IngestFilesCols.mtime.value},
+                                                                  {IngestFilesCols.content_hash.value})
+                              VALUES(?, ?, ?, ?)"""
+
+    ingest_files_select = f"""SELECT {IngestFilesCols.source.value}, {IngestFilesCols.size.value},
+                                     {IngestFilesCols.mtime.value}, {IngestFilesCols.content_hash.value}
+                              FROM ingest_files"""
+
+    ingest_files_delete = f"DELETE FROM ingest_files WHERE {IngestFilesCols.source.value} = ?"
+
+    ingest_file_days_insert = f"""INSERT INTO ingest_file_days({IngestFileDaysCols.source.value},
+                                                               {IngestFileDaysCols.dt.value})
+                                  VALUES(?, ?)"""
+
+    ingest_file_days_select = f"""SELECT {IngestFileDaysCols.source.value}, {IngestFileDaysCols.dt.value}
+                                  FROM ingest_file_days"""
+
+    ingest_file_days_delete = f"DELETE FROM ingest_file_days WHERE {IngestFileDaysCols.source.value} = ?"
+
+    # диапазон дат по данным requests - после частичной загрузки, когда диапазон не известен заранее
+    date_range_refresh = f"""INSERT INTO date_range({RangeCols.min_dt.value}, {RangeCols.max_dt.value})
+                             SELECT COALESCE(MIN({RequestsCols.dt.value}), 0), COALESCE(MAX({RequestsCols.dt.value}), 0)
+                             FROM requests"""
+
+    user_select = f"""SELECT COUNT(DISTINCT {UserCols.user_id.value})
                       FROM users
                       WHERE {UserCols.dt.value} >= ? and {UserCols.dt.value} <= ?"""
 
+    package_select = f"""SELECT COUNT(DISTINCT {PackageCols.package_id.value})
+                         FROM packages
+                         WHERE {PackageCols.dt.value} >= ? and {PackageCols.dt.value} <= ?"""
+
+    # SUM(packages) - сумма количеств пакетов по дням, пакет нескольких дней учитывается в ней несколько раз
+    # в ответе заменяется количеством уникальных пакетов (package_select), NULL остается признаком пустого периода
     requests_select = f"""SELECT SUM({RequestsCols.loaded.value}),
                                  SUM({RequestsCols.doubles.value}),
                                  SUM({RequestsCols.for_creation.value}),
@@ -70,6 +206,138 @@ class DbRequests(Enum):
                            WHERE {RequestsCols.dt.value} >= ? and {RequestsCols.dt.value} <= ?
                         """
 
+    # запросы за несколько периодов одним проходом, {values} заменяется на (?, ?, ?) по количеству периодов
+    # параметры периода: порядковый номер, день начала, день конца; результат упорядочен по номеру периода
+    requests_batch_select = f"""WITH ranges(idx, lo, hi) AS (VALUES {{values}})
+                                SELECT ranges.idx,
+                                       SUM({RequestsCols.loaded.value}),
+                                       SUM({RequestsCols.doubles.value}),
+                                       SUM({RequestsCols.for_creation.value}),
+                                       SUM({RequestsCols.for_expand.value}),
+                                       SUM({RequestsCols.handle_over.value}),
+                                       SUM({RequestsCols.returned.value}),
+                                       SUM({RequestsCols.sent_for_handle.value}),
+                                       SUM({RequestsCols.packages.value})
+                                FROM ranges LEFT JOIN requests
+                                     ON {RequestsCols.dt.value} >= ranges.lo and {RequestsCols.dt.value} <= ranges.hi
+                                GROUP BY ranges.idx
+                                ORDER BY ranges.idx
+                             """
+
+    user_batch_select = f"""WITH ranges(idx, lo, hi) AS (VALUES {{values}})
+                            SELECT ranges.idx, COUNT(DISTINCT {UserCols.user_id.value})
+                            FROM ranges LEFT JOIN users
+                                 ON {UserCols.dt.value} >= ranges.lo and {UserCols.dt.value} <= ranges.hi
+                            GROUP BY ranges.idx
+                            ORDER BY ranges.idx
+                         """
+
+    package_batch_select = f"""WITH ranges(idx, lo, hi) AS (VALUES {{values}})
+                               SELECT ranges.idx, COUNT(DISTINCT {PackageCols.package_id.value})
+                               FROM ranges LEFT JOIN packages
+                                    ON {PackageCols.dt.value} >= ranges.lo and {PackageCols.dt.value} <= ranges.hi
+                               GROUP BY ranges.idx
+                               ORDER BY ranges.idx
+                            """
+
+    # ряд данных по интервалам: bucket_start(день, интервал) - функция, регистрируемая в соединении перед запросом
+    # параметры: SeriesBucket.value, день начала, день конца
+    requests_series_select = f"""SELECT bucket_start({RequestsCols.dt.value}, ?) AS bucket,
+                                        SUM({RequestsCols.loaded.value}),
+                                        SUM({RequestsCols.doubles.value}),
+                                        SUM({RequestsCols.for_creation.value}),
+                                        SUM({RequestsCols.for_expand.value}),
+                                        SUM({RequestsCols.handle_over.value}),
+                                        SUM({RequestsCols.returned.value}),
+                                        SUM({RequestsCols.sent_for_handle.value}),
+                                        SUM({RequestsCols.packages.value})
+                                 FROM requests
+                                 WHERE {RequestsCols.dt.value} >= ? and {RequestsCols.dt.value} <= ?
+                                 GROUP BY bucket
+                              """
+
+    user_series_select = f"""SELECT bucket_start({UserCols.dt.value}, ?) AS bucket,
+                                    COUNT(DISTINCT {UserCols.user_id.value})
+                             FROM users
+                             WHERE {UserCols.dt.value} >= ? and {UserCols.dt.value} <= ?
+                             GROUP BY bucket
+                          """
+
+    package_series_select = f"""SELECT bucket_start({PackageCols.dt.value}, ?) AS bucket,
+                                       COUNT(DISTINCT {PackageCols.package_id.value})
+                                FROM packages
+                                WHERE {PackageCols.dt.value} >= ? and {PackageCols.dt.value} <= ?
+                                GROUP BY bucket
+                             """
+
+    users_daily_select = f"""SELECT {UserCols.dt.value}, {UserCols.user_id.value}
+                             FROM users
+                             WHERE {UserCols.user_id.value} IS NOT NULL"""
+
+    packages_daily_select = f"""SELECT {PackageCols.dt.value}, {PackageCols.package_id.value}
+                                FROM packages
+                                WHERE {PackageCols.package_id.value} IS NOT NULL
+                                ORDER BY {PackageCols.dt.value}"""
+
+    requests_daily_select = f"""SELECT {RequestsCols.dt.value},
+                                       {RequestsCols.loaded.value},
+                                       {RequestsCols.doubles.value},
+                                       {RequestsCols.for_creation.value},
+                                       {RequestsCols.for_expand.value},
+                                       {RequestsCols.handle_over.value},
+                                       {RequestsCols.returned.value},
+                                       {RequestsCols.sent_for_handle.value},
+                                       {RequestsCols.packages.value}
+                                 FROM requests
+                                 ORDER BY {RequestsCols.dt.value}
+                              """
+
+
+# БД, с которой работают db_communicate и db_bulk_load потока, см. db_redirect
+_redirect = threading.local()
+
+
+def db_path() -> str:
+    """:return: путь к БД текущего потока - основная БД либо БД, заданная db_redirect"""
+    return getattr(_redirect, "path", None) or _DB_PATH
+
+
+@contextmanager
+def db_redirect(path: str):
+    """
+    Направляет db_communicate и db_bulk_load текущего потока в другую БД, например в теневую копию
+    при перезагрузке данных. Соединения db_read всегда работают с основной БД
+    :param path: путь к БД
+    :return:
+    """
+    previous = getattr(_redirect, "path", None)
+    _redirect.path = path
+    try:
+        yield
+    finally:
+        _redirect.path = previous
+
+
+def db_copy(source: str, target: str) -> Union[Tuple[None, None], Tuple[None, str]]:
+    """
+    Копирует БД source в target через sqlite backup API за одну транзакцию записи в target:
+    соединения, читающие target, до ее завершения видят прежние данные, после - новые
+    :param source: путь к копируемой БД
+    :param target: путь к БД, содержимое которой заменяется
+    :return: кортеж (результат = None, ошибка)
+    """
+    source_conn = target_conn = None
+    try:
+        source_conn, target_conn = sqlite3.connect(source), sqlite3.connect(target)
+        source_conn.backup(target_conn)
+        return None, None
+    except (sqlite3.OperationalError, sqlite3.DataError) as err:
+        return None, f"!_ОШИБКА БАЗЫ ДАННЫХ - {err}"
+    finally:
+        for conn in (source_conn, target_conn):
+            if conn is not None:
+                conn.close()
+
 
 def db_communicate(function: Callable, commit: bool, **kwargs) -> Union[Tuple[Any, None], Tuple[None, str]]:
     """
@@ -81,7 +349,7 @@ def db_communicate(function: Callable, commit: bool, **kwargs) -> Union[Tuple[An
     """
     conn = None
     try:
-        conn = sqlite3.connect(_DB_PATH)
+        conn = sqlite3.connect(db_path())
         cursor = conn.cursor()
         result = function(cursor, **kwargs)
         if commit:
@@ -92,3 +360,53 @@ def db_communicate(function: Callable, commit: bool, **kwargs) -> Union[Tuple[An
     finally:
         if conn is not None:
             conn.close()
+
+
+def db_bulk_load(function: Callable, **kwargs) -> Union[Tuple[Any, None], Tuple[None, str]]:
+    """
+    Аналог db_communicate(commit=True) для массовой записи данных
+    Соединение настраивается DbRequests.bulk_load_pragmas: при сбое ОС во время загрузки БД может быть повреждена,
+    такую БД пересоздает повторный запуск с --rebuild
+    :param function: функция, принимающая cursor и **kwargs, осуществляющая запись данных
+    :param kwargs: именованные аргументы, передаваемые в function
+    :return: Union[Tuple[Any, None], Tuple[None, str]] - кортеж (результат, ошибка)
+    """
+    conn = None
+    try:
+        conn = sqlite3.connect(db_path())
+        conn.executescript(DbRequests.bulk_load_pragmas.value)
+        result = function(conn.cursor(), **kwargs)
+        with stage("commit"):
+            conn.commit()
+        return result, None
+    except (sqlite3.OperationalError, sqlite3.DataError) as err:
+        return None, f"!_ОШИБКА БАЗЫ ДАННЫХ - {err}"
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+# соединения для чтения, по одному на поток, см. db_read
+_local = threading.local()
+
+
+def db_read(function: Callable, **kwargs) -> Union[Tuple[Any, None], Tuple[None, str]]:
+    """
+    Аналог db_communicate(commit=False) для долгоживущих потоков сервера БД
+    Каждый поток использует свое постоянное соединение, настроенное DbRequests.read_pragmas,
+    соединение пересоздается после ошибки
+    :param function: функция, принимающая cursor и **kwargs, осуществляющая чтение данных
+    :param kwargs: именованные аргументы, передаваемые в function
+    :return: Union[Tuple[Any, None], Tuple[None, str]] - кортеж (результат, ошибка)
+    """
+    conn = getattr(_local, "conn", None)
+    try:
+        if conn is None:
+            conn = _local.conn = sqlite3.connect(_DB_PATH)
+            conn.executescript(DbRequests.read_pragmas.value)
+        return function(conn.cursor(), **kwargs), None
+    except (sqlite3.OperationalError, sqlite3.DataError) as err:
+        if conn is not None:
+            conn.close()
+        _local.conn = None
+        return None, f"!_ОШИБКА БАЗЫ ДАННЫХ - {err}"
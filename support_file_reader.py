@@ -1,16 +1,24 @@
 """
-Модуль для чтения исходных данных из xlsx файла
-Файл определяется по заданному имени - testing_data, по заданному пути - корневая папка проекта
+Модуль для чтения исходных данных из xlsx, csv или parquet файлов
+Файл по умолчанию - testing_data.xlsx в корневой папке проекта, другой файл, каталог или шаблон glob
+задается через use_source. Формат определяется по расширению файла или задается явно
 """
 
+import glob
 import os.path
+import hashlib
+from array import array
 from enum import Enum
-from collections import namedtuple, defaultdict
+from collections import namedtuple, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, date
+from itertools import islice
 import zipfile
-from typing import Union, Tuple, Dict, List, TypeAlias
-import openpyxl
+from typing import Union, Tuple, Dict, List, Iterable, Iterator, Optional, TypeAlias
 from app.constants import DATE_BASEMENT
+from support_xlsx_reader import XlsxStreamSheet, SheetDecoder, UnsupportedXlsxError
+from support_table_readers import CsvSheet, ParquetSheet, SourceFormatError
+from support_profiler import stage
 
 
 # необходимые колонки исходного файла
@@ -59,8 +67,33 @@ class _StatusKeys(Enum):
     sent_for_processing = "Отправлена в обработку"
 
 
-class _DailyData:
+class _Interner:
+    """Словарь строк одной операции сбора: каждая строка хранится один раз, в данных дней - целочисленные номера"""
+    __slots__ = ("ids", "names")
+
     def __init__(self):
+        self.ids: Dict[str, int] = dict()
+        self.names: List[str] = []
+
+    def intern(self, name: str) -> int:
+        name_id = self.ids.get(name)
+        if name_id is None:
+            name_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+
+class _DailyData:
+    """
+    Данные одного дня. Пользователи - номера строк в общем для операции сбора _Interner:
+    одни и те же авторы встречаются во многие дни, но имя каждого хранится один раз
+    Во время сбора номера пользователей хранятся в множестве, после finalize - в отсортированном array('I')
+    ID пакетов почти не повторяются между днями - они хранятся строками, общий словарь только увеличил бы память
+    """
+    __slots__ = ("loaded", "doubles", "for_creation", "for_expand", "handle_over", "returned", "sent_for_handle",
+                 "packages", "users", "_user_names")
+
+    def __init__(self, user_names: _Interner):
         self.loaded: int = 0
         self.doubles: int = 0
         self.for_creation: int = 0
@@ -70,7 +103,8 @@ class _DailyData:
         self.sent_for_handle: int = 0
 
         self.packages = set()
-        self.users = set()
+        self.users: Union[set, array] = set()
+        self._user_names = user_names
 
     def add_data(self, state: str, status: str, author: str, package_id: str):
         self.loaded += 1
@@ -88,81 +122,514 @@ class _DailyData:
             self.sent_for_handle += 1
 
         self.packages.add(package_id)
-        self.users.add(author)
+        self.users.add(self._user_names.intern(author))
+
+    def finalize(self):
+        """Переводит множество номеров пользователей в отсортированный массив, вызывается по окончании сбора"""
+        self.users = array('I', sorted(self.users))
+
+    def user_names(self) -> Iterator[str]:
+        names = self._user_names.names
+        return (names[user] for user in self.users)
 
     def output(self):
         requests_qnt = (self.loaded, self.doubles, self.for_creation, self.for_expand,
                         self.handle_over, self.returned, self.sent_for_handle, len(self.packages))
-        users = tuple(self.users)
+        users = tuple(self.user_names())
         return requests_qnt, users
 
+    def merge(self, other: "_DailyData"):
+        """Добавляет данные того же дня, собранные из другой части файла (возможно, с другим _Interner)"""
+        self.loaded += other.loaded
+        self.doubles += other.doubles
+        self.for_creation += other.for_creation
+        self.for_expand += other.for_expand
+        self.handle_over += other.handle_over
+        self.returned += other.returned
+        self.sent_for_handle += other.sent_for_handle
 
-def _collect(worksheet, start_row: int,
-             col_mapping: _ColNameIndexMapping) -> Union[Tuple[Dict[date, _DailyData], None], Tuple[None, str]]:
-    result = defaultdict(_DailyData)
-    for row_ind, row in enumerate(worksheet.iter_rows(min_row=start_row, values_only=True), start=start_row):
-        state, status, author = row[col_mapping.state], row[col_mapping.status], row[col_mapping.author]
-        creation, package_id = row[col_mapping.creation_dt], row[col_mapping.package_id]
+        self.packages |= other.packages
+        users = set(self.users)
+        if other._user_names is self._user_names:
+            users.update(other.users)
+        else:
+            users.update(self._user_names.intern(name) for name in other.user_names())
+        self.users = users
+        self.finalize()
+
+
+_CollectedData: TypeAlias = Dict[date, _DailyData]
+
+
+def _project(rows: Iterable[tuple], col_mapping: _ColNameIndexMapping) -> Iterator[tuple]:
+    """Оставляет в строках только необходимые колонки в порядке полей _ColNameIndexMapping"""
+    state, status, author, creation_dt, package_id = col_mapping
+    for row in rows:
+        yield row[state], row[status], row[author], row[creation_dt], row[package_id]
+
+
+_CREATION_FORMAT = "%d.%m.%Y %H:%M:%S"
+# длина строки-даты, в которой все поля двузначные - только при ней позиции полей фиксированы
+_CREATION_LEN = 19
+
+
+def _parse_creation(creation: str, dates: Dict[str, date], times: set) -> date:
+    """
+    Дата из строки формата _CREATION_FORMAT
+    Строка делится по фиксированной позиции на день и время, обе части сверяются с уже разобранными строками:
+    совпадение обеих частей значит, что strptime разобрал бы строку так же. Иначе - разбор strptime,
+    удачный результат запоминается
+    :param creation: строка-дата
+    :param dates: разобранные части с датой (первые 10 символов) - общие для одной операции сбора
+    :param times: разобранные части со временем (после 11-го символа)
+    :return: дата
+    :raise ValueError: строка не соответствует формату, как у strptime
+    """
+    if len(creation) == _CREATION_LEN and creation[10] == " ":
+        day = dates.get(creation[:10])
+        if day is not None and creation[11:] in times:
+            return day
+        day = datetime.strptime(creation, _CREATION_FORMAT).date()
+        dates[creation[:10]] = day
+        times.add(creation[11:])
+        return day
+    return datetime.strptime(creation, _CREATION_FORMAT).date()
+
+
+def _collect_values(values: Iterable[tuple], start_row: int,
+                    col_mapping: _ColNameIndexMapping) -> Union[Tuple[_CollectedData, None], Tuple[None, str]]:
+    """
+    Собирает данные по дням из строк, уже приведенных через _project
+    :param values: строки (состояние, статус, автор, дата создания, ID пакета)
+    :param start_row: номер первой строки в исходном файле - для сообщения об ошибке
+    :param col_mapping: индексы колонок исходного файла - для сообщения об ошибке
+    :return: кортеж (результат, ошибка)
+    """
+    user_names = _Interner()
+    result = defaultdict(lambda: _DailyData(user_names=user_names))
+    dates, times = dict(), set()
+    for row_ind, (state, status, author, creation, package_id) in enumerate(values, start=start_row):
         if isinstance(creation, datetime):
             creation_dt = creation.date()
+        elif isinstance(creation, date):
+            creation_dt = creation
         else:
             try:
-                creation_dt = datetime.strptime(creation, "%d.%m.%Y %H:%M:%S").date()
+                creation_dt = _parse_creation(creation, dates=dates, times=times)
             except ValueError:
                 return None, f"Строка {row_ind}, Столбец {col_mapping.creation_dt + 1} - неверный формат строки-даты"
 
         daily_data = result[creation_dt]
         daily_data.add_data(state=state, status=status, author=author, package_id=package_id)
-    return result, None
+    for daily_data in result.values():
+        daily_data.finalize()
+    return dict(result), None
+
+
+def _collect(worksheet, start_row: int,
+             col_mapping: _ColNameIndexMapping) -> Union[Tuple[_CollectedData, None], Tuple[None, str]]:
+    rows = worksheet.iter_rows(min_row=start_row, values_only=True)
+    return _collect_values(values=_project(rows, col_mapping), start_row=start_row, col_mapping=col_mapping)
+
+
+# количество строк в одной части файла, передаваемой процессу-обработчику при чтении через openpyxl
+_CHUNK_ROWS = 20000
+# размер блока xml листа, передаваемого процессу-обработчику при быстром чтении
+_BLOCK_BYTES = 1 << 21
+
+# разбор блоков листа в процессе-обработчике, устанавливается при запуске процесса, см. _init_block_worker
+_worker_decoder: Optional[SheetDecoder] = None
+
+
+def _init_block_worker(decoder: SheetDecoder):
+    global _worker_decoder
+    _worker_decoder = decoder
 
 
-_TransformedData: TypeAlias = Tuple[int, int, List[Tuple], List[Tuple]]
+def _collect_block(block: bytes, first_row: int, min_row: int,
+                   col_mapping: _ColNameIndexMapping) -> Union[Tuple[_CollectedData, None], Tuple[None, str]]:
+    rows = _worker_decoder.iter_rows(chunks=(block,), min_row=min_row, first_row=first_row)
+    return _collect_values(values=_project(rows, col_mapping), start_row=min_row, col_mapping=col_mapping)
 
 
-def _transform(data: Dict[date, _DailyData]) -> _TransformedData:
-    min_date_int, max_date_int = 0, 0
-    requests_qnt, users = list(), list()
-    for dt, daily_data in data.items():
-        date_to_int = (dt - DATE_BASEMENT).days
-        if min_date_int == 0 or date_to_int < min_date_int:
-            min_date_int = date_to_int
-        if max_date_int == 0 or date_to_int > max_date_int:
-            max_date_int = date_to_int
+def _block_tasks(worksheet: XlsxStreamSheet, start_row: int, col_mapping: _ColNameIndexMapping):
+    """Задачи для процессов при быстром чтении: блоки xml листа, разбор xml тоже идет в процессах"""
+    expected_row = 1
+    for first_row, last_row, block in worksheet.iter_row_blocks(block_size=_BLOCK_BYTES):
+        min_row, expected_row = max(expected_row, start_row), last_row + 1
+        if last_row >= min_row:
+            yield _collect_block, dict(block=block, first_row=first_row, min_row=min_row, col_mapping=col_mapping)
 
-        daily_qnt, daily_users = daily_data.output()
-        users.extend(((date_to_int, user) for user in daily_users))
-        requests_qnt.append((date_to_int, *daily_qnt))
 
-    return min_date_int, max_date_int, users, requests_qnt
+def _chunk_tasks(worksheet, start_row: int, col_mapping: _ColNameIndexMapping):
+    """Задачи для процессов при чтении через openpyxl: лист читается здесь, в процессы идут только нужные колонки"""
+    rows = _project(worksheet.iter_rows(min_row=start_row, values_only=True), col_mapping)
+    chunk_start = start_row
+    while chunk := list(islice(rows, _CHUNK_ROWS)):
+        yield _collect_values, dict(values=chunk, start_row=chunk_start, col_mapping=col_mapping)
+        chunk_start += len(chunk)
 
 
+def _merge_collected(result: _CollectedData, part: _CollectedData):
+    for dt, daily_data in part.items():
+        if dt in result:
+            result[dt].merge(daily_data)
+        else:
+            result[dt] = daily_data
+
+
+def _collect_parallel(worksheet, start_row: int, col_mapping: _ColNameIndexMapping,
+                      workers: int) -> Union[Tuple[_CollectedData, None], Tuple[None, str]]:
+    """
+    Аналог _collect, строки делятся на части, которые собираются в пуле из workers процессов
+    Части объединяются в порядке следования в файле, поэтому ошибка - всегда первая по номеру строки
+    В обработке одновременно находится не более 2 * workers частей, чтобы не держать в памяти весь файл
+    """
+    if isinstance(worksheet, XlsxStreamSheet):
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_block_worker,
+                                       initargs=(worksheet.decoder,))
+        tasks = _block_tasks(worksheet=worksheet, start_row=start_row, col_mapping=col_mapping)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        tasks = _chunk_tasks(worksheet=worksheet, start_row=start_row, col_mapping=col_mapping)
+
+    result, pending = dict(), deque()
+    with executor:
+        while True:
+            task = next(tasks, None)
+            if task is not None:
+                function, kwargs = task
+                pending.append(executor.submit(function, **kwargs))
+            while pending and (task is None or len(pending) >= 2 * workers):
+                part, error = pending.popleft().result()
+                if error is not None:
+                    for future in pending:
+                        future.cancel()
+                    return None, error
+                _merge_collected(result, part)
+            if task is None:
+                return result, None
+
+
+class _Table(Enum):
+    users = "users"
+    requests = "requests"
+    packages = "packages"
+
+
+class _TableRows:
+    """
+    Строки таблицы users, requests или packages, формируемые из собранных данных при каждом проходе
+    Полные списки строк в памяти не строятся - строки передаются в executemany потоком
+    Допускает многократную итерацию: отпечатки дней, запись в БД
+    """
+
+    def __init__(self, data: Dict[int, _DailyData], table: _Table):
+        self._data = data
+        self._table = table
+
+    def __iter__(self) -> Iterator[Tuple]:
+        if self._table is _Table.users:
+            for dt, daily_data in self._data.items():
+                for user in daily_data.user_names():
+                    yield dt, user
+        elif self._table is _Table.packages:
+            for dt, daily_data in self._data.items():
+                for package_id in daily_data.packages:
+                    yield dt, package_id
+        else:
+            for dt, daily_data in self._data.items():
+                daily_qnt, _ = daily_data.output()
+                yield dt, *daily_qnt
+
+
+# день начала, день конца, строки users, строки requests, строки packages
+_TransformedData: TypeAlias = Tuple[int, int, Iterable[Tuple], Iterable[Tuple], Iterable[Tuple]]
+
+
+def _transform_by_day(by_day: Dict[int, _DailyData]) -> _TransformedData:
+    min_date_int, max_date_int = (min(by_day), max(by_day)) if by_day else (0, 0)
+    return (min_date_int, max_date_int, _TableRows(by_day, _Table.users), _TableRows(by_day, _Table.requests),
+            _TableRows(by_day, _Table.packages))
+
+
+def _transform(data: _CollectedData) -> _TransformedData:
+    return _transform_by_day({(dt - DATE_BASEMENT).days: daily_data for dt, daily_data in data.items()})
+
+
+class SourceFormat(Enum):
+    xlsx = "xlsx"
+    csv = "csv"
+    parquet = "parquet"
+
+
+# исходный файл, каталог (все файлы с расширениями SourceFormat) или шаблон glob
 _SOURCE_FILE = os.path.join(os.path.dirname(__file__), "testing_data.xlsx")
+# формат исходных файлов, None - по расширению файла
+_SOURCE_FORMAT: Optional[SourceFormat] = None
 _SHEET_WITH_DATA = "Data"
 
 
-def read_data_from_file() -> Union[Tuple[_TransformedData, None], Tuple[None, str]]:
+def use_source(path: str, source_format: Optional[SourceFormat] = None):
     """
-    Единственная импортируемая функция модуля. Открывает и читает данные их xlsx файла
-    Ищет необходимые колонки по их наименованию, порядок следования не важен
-    :return: кортеж (результат, ошибка)
+    Задает источник данных вместо testing_data.xlsx
+    :param path: путь к файлу, к каталогу или шаблон glob (например, exports/*.xlsx)
+    :param source_format: формат файлов, None - по расширению, неизвестное расширение - xlsx
+    :return:
     """
+    global _SOURCE_FILE, _SOURCE_FORMAT
+    _SOURCE_FILE, _SOURCE_FORMAT = path, source_format
+
+
+def _source_format(path: str) -> SourceFormat:
+    if _SOURCE_FORMAT is not None:
+        return _SOURCE_FORMAT
+    extension = os.path.splitext(path)[1].lstrip(".").lower()
+    try:
+        return SourceFormat(extension)
+    except ValueError:
+        return SourceFormat.xlsx
+
+
+def _collect_worksheet(worksheet, path: str, workers: int) -> Union[Tuple[_CollectedData, None], Tuple[None, str]]:
+    with stage("check_columns"):
+        check = _check_columns(worksheet=worksheet)
+    if check is None:
+        return None, f"!ОШИБКА ФАЙЛА - {path} - названия колонок в файле не соответствуют требуемым"
+    start_row, col_mapping = check
+    if isinstance(worksheet, (XlsxStreamSheet, ParquetSheet)):
+        # быстрое чтение xlsx разбирает, чтение parquet читает только найденные колонки
+        worksheet.use_columns(col_mapping)
+    with stage("collect") as current:
+        if workers > 1:
+            collect, error = _collect_parallel(worksheet=worksheet, start_row=start_row, col_mapping=col_mapping,
+                                               workers=workers)
+        else:
+            collect, error = _collect(worksheet=worksheet, start_row=start_row, col_mapping=col_mapping)
+        if error is None:
+            current.rows = sum(daily_data.loaded for daily_data in collect.values())
+    if error is not None:
+        return None, f"!ОШИБКА ФАЙЛА - {path} - {error}"
+    return collect, None
+
+
+def _collect_with_openpyxl(path: str, workers: int) -> Union[Tuple[_CollectedData, None], Tuple[None, str]]:
+    # openpyxl нужен только файлам, которые не читаются потоково, - импорт откладывается до первого такого файла
+    import openpyxl
+
     wb = None
     try:
-        wb = openpyxl.load_workbook(filename=_SOURCE_FILE, read_only=True, data_only=True)
-        ws = wb[_SHEET_WITH_DATA] if _SHEET_WITH_DATA in wb.sheetnames else wb.active
-        check = _check_columns(worksheet=ws)
-        if check is None:
-            return None, f"!ОШИБКА ФАЙЛА - {_SOURCE_FILE} - названия колонок в файле не соответствуют требуемым"
-        start_row, col_mapping = check
-        collect, error = _collect(worksheet=ws, start_row=start_row, col_mapping=col_mapping)
-        if error is not None:
-            return None, f"!ОШИБКА ФАЙЛА - {error}"
-        transform = _transform(data=collect)
-        return transform, None
-    except zipfile.BadZipfile:
-        return None, f"!ОШИБКА ФАЙЛА - {_SOURCE_FILE} - не является файлом формата xlsx"
-    except FileNotFoundError:
-        return None, f"!ОШИБКА ФАЙЛА - {_SOURCE_FILE} - не существует"
+        with stage("open"):
+            wb = openpyxl.load_workbook(filename=path, read_only=True, data_only=True)
+            ws = wb[_SHEET_WITH_DATA] if _SHEET_WITH_DATA in wb.sheetnames else wb.active
+        return _collect_worksheet(worksheet=ws, path=path, workers=workers)
     finally:
         if wb is not None:
             wb.close()
+
+
+def _collect_with_stream(path: str, workers: int) -> Union[Tuple[_CollectedData, None], Tuple[None, str]]:
+    with stage("open"):
+        ws = XlsxStreamSheet(filename=path, sheet_name=_SHEET_WITH_DATA)
+    with ws:
+        return _collect_worksheet(worksheet=ws, path=path, workers=workers)
+
+
+def _collect_with_csv(path: str, workers: int) -> Union[Tuple[_CollectedData, None], Tuple[None, str]]:
+    with stage("open"):
+        ws = CsvSheet(filename=path, header_names=(col.value for col in _Columns))
+    with ws:
+        return _collect_worksheet(worksheet=ws, path=path, workers=workers)
+
+
+def _collect_with_parquet(path: str, workers: int) -> Union[Tuple[_CollectedData, None], Tuple[None, str]]:
+    with stage("open"):
+        ws = ParquetSheet(filename=path)
+    with ws:
+        return _collect_worksheet(worksheet=ws, path=path, workers=workers)
+
+
+def _collect_file(path: str, fast: bool = True, workers: int = 1,
+                  source_format: Optional[SourceFormat] = None) -> Union[Tuple[_CollectedData, None], Tuple[None, str]]:
+    """
+    Сбор данных по дням из одного файла
+    :param path: путь к файлу
+    :param fast: для xlsx: true - потоковое чтение без openpyxl (см. support_xlsx_reader),
+                 при неподдерживаемых возможностях формата файл читается через openpyxl
+    :param workers: количество процессов для сбора данных по дням, 1 - сбор в текущем процессе
+    :param source_format: формат файла, None - см. _source_format
+    :return: кортеж (результат, ошибка)
+    """
+    try:
+        if source_format is None:
+            source_format = _source_format(path)
+        if source_format is SourceFormat.csv:
+            return _collect_with_csv(path=path, workers=workers)
+        if source_format is SourceFormat.parquet:
+            return _collect_with_parquet(path=path, workers=workers)
+        if fast:
+            try:
+                return _collect_with_stream(path=path, workers=workers)
+            except UnsupportedXlsxError as err:
+                print(f"Быстрое чтение файла {path} невозможно ({err}), файл будет прочитан через openpyxl")
+        return _collect_with_openpyxl(path=path, workers=workers)
+    except zipfile.BadZipfile:
+        return None, f"!ОШИБКА ФАЙЛА - {path} - не является файлом формата xlsx"
+    except SourceFormatError as err:
+        return None, f"!ОШИБКА ФАЙЛА - {path} - {err}"
+    except FileNotFoundError:
+        return None, f"!ОШИБКА ФАЙЛА - {path} - не существует"
+
+
+def read_data_from_file(fast: bool = True, workers: int = 1) -> Union[Tuple[_TransformedData, None], Tuple[None, str]]:
+    """
+    Основная импортируемая функция модуля. Открывает и читает данные из исходного файла (см. use_source)
+    Ищет необходимые колонки по их наименованию, порядок следования не важен
+    :param fast: для xlsx: true - потоковое чтение без openpyxl (см. support_xlsx_reader),
+                 при неподдерживаемых возможностях формата файл читается через openpyxl
+    :param workers: количество процессов для сбора данных по дням, 1 - сбор в текущем процессе
+    :return: кортеж (результат, ошибка)
+    """
+    collect, error = _collect_file(path=_SOURCE_FILE, fast=fast, workers=workers)
+    if error is not None:
+        return None, error
+    with stage("transform"):
+        return _transform(data=collect), None
+
+
+def is_multi_source() -> bool:
+    """:return: true - источник данных - каталог или шаблон glob, см. read_files_data"""
+    return os.path.isdir(_SOURCE_FILE) or glob.has_magic(_SOURCE_FILE)
+
+
+def source_spec() -> str:
+    """:return: путь к источнику данных, как он задан в use_source"""
+    return _SOURCE_FILE
+
+
+def _collect_file_by_day(path: str, source_format: SourceFormat,
+                         workers: int = 1) -> Union[Tuple[Dict[int, _DailyData], None], Tuple[None, str]]:
+    collect, error = _collect_file(path=path, workers=workers, source_format=source_format)
+    if error is not None:
+        return None, error
+    return {(dt - DATE_BASEMENT).days: daily_data for dt, daily_data in collect.items()}, None
+
+
+def read_files_data(paths: List[str],
+                    workers: int = 1) -> Union[Tuple[List[Dict[int, _DailyData]], None], Tuple[None, str]]:
+    """
+    Сбор данных по дням из нескольких файлов, файлы разбираются одновременно в пуле из workers процессов
+    Один файл при workers > 1 собирается по частям, как в read_data_from_file
+    Формат файлов определяется здесь и передается процессам явно: процесс, запущенный методом spawn,
+    не наследует настройку use_source
+    :param paths: пути к файлам
+    :param workers: количество процессов
+    :return: кортеж (данные каждого файла в порядке paths - словари день -> данные дня, ошибка первого по порядку файла)
+    """
+    formats = [_source_format(path) for path in paths]
+    if workers <= 1 or len(paths) <= 1:
+        results = []
+        for path, source_format in zip(paths, formats):
+            by_day, error = _collect_file_by_day(path=path, source_format=source_format, workers=workers)
+            if error is not None:
+                return None, error
+            results.append(by_day)
+        return results, None
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as executor:
+        futures = [executor.submit(_collect_file_by_day, path, source_format)
+                   for path, source_format in zip(paths, formats)]
+        results = []
+        for future in futures:
+            by_day, error = future.result()
+            if error is not None:
+                for pending in futures:
+                    pending.cancel()
+                return None, error
+            results.append(by_day)
+    return results, None
+
+
+def merge_files_data(parts: Iterable[Dict[int, _DailyData]], days: Optional[set] = None) -> _TransformedData:
+    """
+    Объединяет данные нескольких файлов: счетчики одного дня складываются, пакеты и пользователи
+    объединяются как множества (одни и те же ID пакетов и авторы могут встречаться в разных файлах)
+    :param parts: данные файлов - словари день -> данные дня, объекты данных дней изменяются при объединении
+    :param days: только указанные дни, None - все дни
+    :return: данные в формате read_data_from_file
+    """
+    result: Dict[int, _DailyData] = dict()
+    for part in parts:
+        _merge_collected(result, {dt: daily_data for dt, daily_data in part.items() if days is None or dt in days})
+    return _transform_by_day(result)
+
+
+# состояние исходного файла для манифеста загрузки, см. support_initializer.initialize_data
+SourceState = namedtuple("SourceState", ("path", "size", "mtime_ns"))
+
+_HASH_CHUNK_SIZE = 1 << 20
+
+
+def _file_state(path: str) -> SourceState:
+    stat = os.stat(path)
+    return SourceState(path=path, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+
+def read_source_state() -> Union[Tuple[SourceState, None], Tuple[None, str]]:
+    """
+    Размер и время изменения исходного файла без его чтения
+    :return: кортеж (результат, ошибка)
+    """
+    try:
+        return _file_state(_SOURCE_FILE), None
+    except FileNotFoundError:
+        return None, f"!ОШИБКА ФАЙЛА - {_SOURCE_FILE} - не существует"
+
+
+def read_sources_state() -> Union[Tuple[List[SourceState], None], Tuple[None, str]]:
+    """
+    Файлы источника-каталога (файлы с расширениями SourceFormat, кроме скрытых и временных файлов Excel)
+    или источника-шаблона glob, упорядоченные по пути
+    :return: кортеж (состояния файлов, ошибка)
+    """
+    if glob.has_magic(_SOURCE_FILE):
+        paths = glob.glob(_SOURCE_FILE)
+    else:
+        try:
+            names = os.listdir(_SOURCE_FILE)
+        except FileNotFoundError:
+            return None, f"!ОШИБКА ФАЙЛА - {_SOURCE_FILE} - не существует"
+        extensions = {f".{source_format.value}" for source_format in SourceFormat}
+        paths = [os.path.join(_SOURCE_FILE, name) for name in names
+                 if os.path.splitext(name)[1].lower() in extensions and not name.startswith(("~$", "."))]
+    try:
+        states = [_file_state(path) for path in sorted(paths) if os.path.isfile(path)]
+    except FileNotFoundError as err:
+        return None, f"!ОШИБКА ФАЙЛА - {err.filename} - не существует"
+    if not states:
+        return None, f"!ОШИБКА ФАЙЛА - {_SOURCE_FILE} - нет исходных файлов"
+    return states, None
+
+
+def read_file_hash(path: str) -> Union[Tuple[str, None], Tuple[None, str]]:
+    """
+    Хэш содержимого файла (sha256), читается блоками без загрузки файла в память
+    :param path: путь к файлу
+    :return: кортеж (результат, ошибка)
+    """
+    content_hash = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(_HASH_CHUNK_SIZE):
+                content_hash.update(chunk)
+    except FileNotFoundError:
+        return None, f"!ОШИБКА ФАЙЛА - {path} - не существует"
+    return content_hash.hexdigest(), None
+
+
+def read_source_hash() -> Union[Tuple[str, None], Tuple[None, str]]:
+    """
+    Хэш содержимого исходного файла, см. read_file_hash
+    :return: кортеж (результат, ошибка)
+    """
+    return read_file_hash(_SOURCE_FILE)
@@ -4,24 +4,335 @@
 import os.path
 import socketserver
 import json
-from functools import lru_cache
+import hashlib
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+from enum import Enum
 from datetime import datetime, timedelta
-from typing import List, Tuple, Union
-from app.constants import DATE_BASEMENT, DB_SERVER_HOST, DB_SERVER_PORT, DB_META_COMMAND
-from support_db_requests import DbRequests, db_communicate
-from support_file_reader import read_data_from_file
+from typing import Iterable, List, Tuple, Union, Optional, Dict
+from app.constants import DATE_BASEMENT, DB_SERVER_HOST, DB_SERVER_PORT, DB_META_COMMAND, DB_BATCH_COMMAND, \
+    DB_SERIES_COMMAND, DB_STATS_COMMAND, SHARED_CACHE_PATH, SeriesBucket
+from app import shared_cache
+from app.protocol import recv_frame, send_frame, is_period_request, decode_period_request, encode_period_answer, \
+    HELLO_COMMAND, PROTOCOL_VERSION
+from support_db_requests import DbRequests, RequestsCols, db_communicate, db_read, db_bulk_load, db_path, \
+    db_redirect, db_copy
+from support_file_reader import read_data_from_file, read_source_state, read_source_hash, SourceState, \
+    is_multi_source, source_spec, read_sources_state, read_file_hash, read_files_data, merge_files_data, \
+    use_source, SourceFormat
+from support_period_index import PeriodIndex, build_period_index, bucket_bounds, bucket_start, \
+    PACKAGES_COUNTER, PACKAGES_EXACT_LIMIT
+from support_async_server import run_async_server
+from support_server_stats import ServerStats, Stage, RequestKind
+from support_profiler import stage
 
 
-def _first_insertion(cursor, schema: str, min_date: int, max_date: int, users: List[Tuple], requests_qnt: List[Tuple]):
-    cursor.executescript(schema)
+# версия схемы БД (PRAGMA user_version), которую создает db_schema.sql
+# БД предыдущих версий обновляются скриптами db_migration_<версия>.sql, см. _migrate_schema
+_SCHEMA_VERSION = 3
+
+
+def _create_indexes(cursor):
+    with stage("create_indexes"):
+        cursor.execute(DbRequests.users_date_index_create.value)
+        cursor.execute(DbRequests.packages_date_index_create.value)
+
+
+def _insert_users(cursor, users: Iterable[Tuple]):
+    """
+    Добавляет новые имена в справочник users_dim, затем строки users с идентификаторами
+    Строки проходятся дважды: однократный итератор (например, генератор) сначала сохраняется в список,
+    повторно проходимые строки (support_file_reader._TableRows) не копируются
+    """
+    if iter(users) is users:
+        users = list(users)
+    with stage("insert_users_dim") as current:
+        cursor.executemany(DbRequests.users_dim_insert.value,
+                           ((user,) for user in {user for _, user in users} if user is not None))
+        current.rows = cursor.rowcount
+    with stage("insert_users") as current:
+        cursor.executemany(DbRequests.users_insert.value, users)
+        current.rows = cursor.rowcount
+
+
+def _insert_packages(cursor, packages: Iterable[Tuple]):
+    """Добавляет новые ID пакетов в справочник packages_dim, затем строки packages, как _insert_users"""
+    if iter(packages) is packages:
+        packages = list(packages)
+    with stage("insert_packages_dim") as current:
+        cursor.executemany(DbRequests.packages_dim_insert.value,
+                           ((package,) for package in {package for _, package in packages} if package is not None))
+        current.rows = cursor.rowcount
+    with stage("insert_packages") as current:
+        cursor.executemany(DbRequests.packages_insert.value, packages)
+        current.rows = cursor.rowcount
+
+
+def _first_insertion(cursor, schema: str, min_date: int, max_date: int,
+                     users: Iterable[Tuple], requests_qnt: Iterable[Tuple], packages: Iterable[Tuple]):
+    with stage("schema"):
+        cursor.executescript(schema)
+    cursor.execute(DbRequests.date_range_insert.value, (min_date, max_date))
+    # схема создает таблицы без индексов: индексы строятся один раз по загруженным данным, а не обновляются
+    # на каждую строку
+    _insert_users(cursor, users)
+    _insert_packages(cursor, packages)
+    with stage("insert_requests") as current:
+        cursor.executemany(DbRequests.requests_insert.value, requests_qnt)
+        current.rows = cursor.rowcount
+    _create_indexes(cursor)
+
+
+def _schema_version(cursor) -> int:
+    return cursor.execute(DbRequests.schema_version_select.value).fetchone()[0]
+
+
+def _migrate_schema(cursor, scripts: List[str]):
+    """
+    Последовательно выполняет скрипты миграции, каждый скрипт - отдельная транзакция,
+    завершающаяся установкой новой версии схемы
+    """
+    for script in scripts:
+        cursor.executescript(script)
+
+
+def _day_fingerprints(users: Iterable[Tuple], requests_qnt: Iterable[Tuple],
+                      packages: Iterable[Tuple]) -> Dict[int, str]:
+    """
+    Отпечатки данных каждого дня - по ним при повторной загрузке определяются изменившиеся дни
+    :return: словарь день -> отпечаток
+    """
+    users_by_day, packages_by_day = defaultdict(list), defaultdict(list)
+    for dt, user in users:
+        users_by_day[dt].append(user)
+    for dt, package in packages:
+        packages_by_day[dt].append(package)
+    fingerprints = dict()
+    for dt, *quantities in requests_qnt:
+        day_data = repr((quantities, sorted(users_by_day[dt]), sorted(packages_by_day[dt]))).encode(encoding="utf-8")
+        fingerprints[dt] = hashlib.sha1(day_data).hexdigest()
+    return fingerprints
+
+
+def _read_manifest(cursor) -> Tuple[Optional[Tuple], Dict[int, str]]:
+    manifest = cursor.execute(DbRequests.manifest_select.value).fetchone()
+    fingerprints = dict(cursor.execute(DbRequests.ingest_days_select.value).fetchall())
+    return manifest, fingerprints
+
+
+def _write_manifest(cursor, state: SourceState, content_hash: str, fingerprints: Optional[Dict[int, str]]):
+    """Записывает манифест загрузки, fingerprints = None - отпечатки дней не изменились"""
+    cursor.execute(DbRequests.manifest_delete.value)
+    cursor.execute(DbRequests.manifest_insert.value, (state.path, state.size, state.mtime_ns, content_hash))
+    if fingerprints is not None:
+        cursor.execute(DbRequests.ingest_days_delete.value)
+        cursor.executemany(DbRequests.ingest_days_insert.value, fingerprints.items())
+
+
+def _full_load(cursor, schema: str, min_date: int, max_date: int, users: Iterable[Tuple], requests_qnt: Iterable[Tuple],
+               packages: Iterable[Tuple], state: SourceState, content_hash: str, fingerprints: Dict[int, str]):
+    _first_insertion(cursor, schema=schema, min_date=min_date, max_date=max_date,
+                     users=users, requests_qnt=requests_qnt, packages=packages)
+    _write_manifest(cursor, state=state, content_hash=content_hash, fingerprints=fingerprints)
+
+
+def _incremental_load(cursor, min_date: int, max_date: int, users: Iterable[Tuple], requests_qnt: Iterable[Tuple],
+                      packages: Iterable[Tuple], changed_days: set, removed_days: set,
+                      state: SourceState, content_hash: str, fingerprints: Dict[int, str]):
+    """Заменяет в БД данные только изменившихся и удаленных дней, обновляет диапазон дат и манифест"""
+    # БД, созданная до появления индексов по дате
+    _create_indexes(cursor)
+    stale_days = [(dt,) for dt in changed_days | removed_days]
+    cursor.executemany(DbRequests.users_delete_day.value, stale_days)
+    cursor.executemany(DbRequests.packages_delete_day.value, stale_days)
+    cursor.executemany(DbRequests.requests_delete_day.value, stale_days)
+    _insert_users(cursor, [row for row in users if row[0] in changed_days])
+    _insert_packages(cursor, [row for row in packages if row[0] in changed_days])
+    cursor.executemany(DbRequests.requests_insert.value, (row for row in requests_qnt if row[0] in changed_days))
+    cursor.execute(DbRequests.date_range_delete.value)
     cursor.execute(DbRequests.date_range_insert.value, (min_date, max_date))
-    cursor.executemany(DbRequests.users_insert.value, users)
+    _write_manifest(cursor, state=state, content_hash=content_hash, fingerprints=fingerprints)
+
+
+# запись журнала файлов источника-каталога: размер, время изменения, хэш содержимого, дни с данными файла
+_LedgerEntry = namedtuple("_LedgerEntry", ("size", "mtime_ns", "content_hash", "days"))
+
+
+def _read_ledger(cursor) -> Dict[str, _LedgerEntry]:
+    days = defaultdict(set)
+    for source, dt in cursor.execute(DbRequests.ingest_file_days_select.value):
+        days[source].add(dt)
+    return {source: _LedgerEntry(size=size, mtime_ns=mtime_ns, content_hash=content_hash, days=days[source])
+            for source, size, mtime_ns, content_hash in cursor.execute(DbRequests.ingest_files_select.value)}
+
+
+def _write_ledger(cursor, stale: Iterable[str], files: Iterable[Tuple[SourceState, str, Optional[set]]]):
+    """
+    Удаляет из журнала файлы stale и записывает files
+    :param files: кортежи (состояние файла, хэш содержимого, дни файла - None, если дни не изменились)
+    """
+    for source in stale:
+        cursor.execute(DbRequests.ingest_files_delete.value, (source,))
+        cursor.execute(DbRequests.ingest_file_days_delete.value, (source,))
+    for state, content_hash, days in files:
+        cursor.execute(DbRequests.ingest_files_insert.value, (state.path, state.size, state.mtime_ns, content_hash))
+        if days is not None:
+            cursor.execute(DbRequests.ingest_file_days_delete.value, (state.path,))
+            cursor.executemany(DbRequests.ingest_file_days_insert.value, ((state.path, dt) for dt in days))
+
+
+def _full_load_files(cursor, schema: str, min_date: int, max_date: int,
+                     users: Iterable[Tuple], requests_qnt: Iterable[Tuple], packages: Iterable[Tuple],
+                     spec: str, files: List[Tuple[SourceState, str, set]]):
+    _first_insertion(cursor, schema=schema, min_date=min_date, max_date=max_date,
+                     users=users, requests_qnt=requests_qnt, packages=packages)
+    # манифест хранит только путь источника-каталога, состояние файлов - в журнале
+    _write_manifest(cursor, state=SourceState(path=spec, size=None, mtime_ns=None), content_hash=None,
+                    fingerprints=dict())
+    _write_ledger(cursor, stale=(), files=files)
+
+
+def _replace_days(cursor, days: set, users: Iterable[Tuple], requests_qnt: Iterable[Tuple], packages: Iterable[Tuple],
+                  stale: List[str], files: List[Tuple[SourceState, str, Optional[set]]]):
+    """Заменяет в БД данные указанных дней, пересчитывает диапазон дат по таблице requests, обновляет журнал"""
+    _create_indexes(cursor)
+    stale_days = [(dt,) for dt in days]
+    cursor.executemany(DbRequests.users_delete_day.value, stale_days)
+    cursor.executemany(DbRequests.packages_delete_day.value, stale_days)
+    cursor.executemany(DbRequests.requests_delete_day.value, stale_days)
+    _insert_users(cursor, users)
+    _insert_packages(cursor, packages)
     cursor.executemany(DbRequests.requests_insert.value, requests_qnt)
+    cursor.execute(DbRequests.date_range_delete.value)
+    cursor.execute(DbRequests.date_range_refresh.value)
+    _write_ledger(cursor, stale=stale, files=files)
 
 
-def initialize_data() -> Union[Tuple[None, None], Tuple[None, str]]:
+def _upgrade_schema() -> Union[Tuple[None, None], Tuple[None, str]]:
+    """
+    Обновляет схему существующей БД до _SCHEMA_VERSION скриптами db_migration_<версия>.sql
+    :return: кортеж (результат = None, ошибка)
+    """
+    version, db_error = db_communicate(_schema_version, commit=False)
+    if db_error is not None:
+        return None, db_error
+    if version >= _SCHEMA_VERSION:
+        return None, None
+
+    scripts = []
+    for next_version in range(version + 1, _SCHEMA_VERSION + 1):
+        script_path = os.path.join(os.path.dirname(__file__), f"db_migration_{next_version}.sql")
+        try:
+            with open(script_path, encoding='utf-8') as f:
+                scripts.append(f.read())
+        except (FileNotFoundError, UnicodeDecodeError):
+            return None, f"!_ОШИБКА МИГРАЦИИ БД - не удалось прочитать {script_path}"
+    _, db_error = db_bulk_load(_migrate_schema, scripts=scripts)
+    if db_error is not None:
+        return None, db_error
+    print(f"Схема базы данных обновлена с версии {version} до версии {_SCHEMA_VERSION}")
+    return None, None
+
+
+def _initialize_from_files(schema: str, workers: int, rebuild: bool) -> Union[Tuple[None, None], Tuple[None, str]]:
+    """
+    Загрузка из источника-каталога (шаблона glob), аналог initialize_data для нескольких файлов
+    Журнал в БД хранит размер, время изменения, хэш и дни каждого загруженного файла. Неизмененные файлы
+    не читаются, новые и измененные файлы разбираются одновременно (см. read_files_data). Заменяются дни
+    новых, измененных и удаленных файлов; неизмененные файлы с данными этих дней читаются повторно, т.к.
+    количество пакетов и пользователей дня - объединение множеств по всем файлам, а не сумма
+    """
+    spec = source_spec()
+    states, file_error = read_sources_state()
+    if file_error is not None:
+        return None, file_error
+    ledger = None
+    if not rebuild:
+        # ошибка чтения манифеста или манифест другого источника - полная загрузка
+        stored, manifest_error = db_communicate(_read_manifest, commit=False)
+        if manifest_error is None and stored[0] is not None and stored[0][0] == spec:
+            _, db_error = _upgrade_schema()
+            if db_error is None:
+                # миграция очищает манифест и журнал, если новые таблицы заполняются только из исходных файлов
+                stored, db_error = db_communicate(_read_manifest, commit=False)
+            if db_error is None and stored[0] is not None:
+                ledger, db_error = db_communicate(_read_ledger, commit=False)
+            if db_error is not None:
+                print(db_error)
+                ledger = None
+
+    changed, touched = [], []
+    for state in states:
+        entry = None if ledger is None else ledger.get(state.path)
+        if entry is not None and (entry.size, entry.mtime_ns) == (state.size, state.mtime_ns):
+            continue
+        content_hash, file_error = read_file_hash(state.path)
+        if file_error is not None:
+            return None, file_error
+        if entry is not None and entry.content_hash == content_hash:
+            touched.append((state, content_hash, None))
+        else:
+            changed.append((state, content_hash))
+    current = {state.path for state in states}
+    removed = [] if ledger is None else [source for source in ledger if source not in current]
+
+    if ledger is not None and not changed and not removed:
+        _, db_error = db_communicate(_write_ledger, commit=True, stale=(), files=touched)
+        if db_error is None:
+            _, db_error = db_communicate(_create_indexes, commit=True)
+        if db_error is not None:
+            return None, db_error
+        print(f"Исходные файлы не изменились ({len(states)}), загрузка данных пропущена")
+        return None, None
+
+    parts, file_error = read_files_data(paths=[state.path for state, _ in changed], workers=workers)
+    if file_error is not None:
+        return None, file_error
+    # дни файлов - до объединения, объединение изменяет данные дней
+    files = [(state, content_hash, set(part)) for (state, content_hash), part in zip(changed, parts)]
+    print(f"Данные из исходных файлов прочитаны: {len(changed)}")
+
+    if ledger is None:
+        min_date, max_date, users, requests_qnt, packages = merge_files_data(parts)
+        print("Запись данных в базу...")
+        _, db_error = db_bulk_load(_full_load_files, schema=schema,
+                                   min_date=min_date, max_date=max_date, users=users, requests_qnt=requests_qnt,
+                                   packages=packages, spec=spec, files=files)
+    else:
+        affected = set().union(*(days for _, _, days in files),
+                               *(ledger[source].days for source in removed),
+                               *(ledger[state.path].days for state, _ in changed if state.path in ledger))
+        changed_paths = {state.path for state, _ in changed}
+        overlapping = [source for source, entry in ledger.items()
+                       if source in current and source not in changed_paths and entry.days & affected]
+        if overlapping:
+            extra_parts, file_error = read_files_data(paths=overlapping, workers=workers)
+            if file_error is not None:
+                return None, file_error
+            parts += extra_parts
+        print(f"Новых и измененных файлов: {len(changed)}, удаленных: {len(removed)}, "
+              f"прочитано повторно: {len(overlapping)}, дней к замене: {len(affected)}")
+        _, _, users, requests_qnt, packages = merge_files_data(parts, days=affected)
+        print("Запись данных в базу...")
+        _, db_error = db_bulk_load(_replace_days, days=affected, users=users, requests_qnt=requests_qnt,
+                                   packages=packages, stale=removed, files=files + touched)
+    if db_error is not None:
+        return None, db_error
+    print("Данные записаны в базу")
+    return None, None
+
+
+def initialize_data(workers: int = 1, rebuild: bool = False) -> Union[Tuple[None, None], Tuple[None, str]]:
     """
     Чтение данных из файла, создание базы данных, запись данных
+    Загрузка инкрементальная: манифест в БД хранит размер, время изменения и хэш исходного файла,
+    а также отпечатки данных каждого дня. Неизмененный файл не читается, для измененного
+    перезаписываются только дни с другими данными. Если манифеста нет - БД создается заново по схеме
+    Источник-каталог или шаблон glob загружается по журналу файлов, см. _initialize_from_files
+    :param workers: количество процессов для сбора данных из файла, см. read_data_from_file
+    :param rebuild: true - пересоздать БД, не сверяясь с манифестом
     :return: кортеж (результат = None, ошибка)
     """
     schema_path = os.path.join(os.path.dirname(__file__), "db_schema.sql")
@@ -34,16 +345,70 @@ def initialize_data() -> Union[Tuple[None, None], Tuple[None, str]]:
     except UnicodeDecodeError:
         return None, f"!_ОШИБКА СХЕМЫ БД - {schema_path} неверный формат файла"
     print("Схема базы данных прочитана")
+    if is_multi_source():
+        return _initialize_from_files(schema=schema, workers=workers, rebuild=rebuild)
+
+    state, file_error = read_source_state()
+    if file_error is not None:
+        return None, file_error
+    manifest, stored_fingerprints = None, dict()
+    if not rebuild:
+        # ошибка чтения манифеста (например, БД еще не создана) - полная загрузка
+        stored, manifest_error = db_communicate(_read_manifest, commit=False)
+        if manifest_error is None and stored[0] is not None and stored[0][0] == state.path:
+            manifest, stored_fingerprints = stored
+    if manifest is not None:
+        _, db_error = _upgrade_schema()
+        if db_error is None:
+            # миграция очищает манифест, если новые таблицы заполняются только из исходного файла
+            stored, db_error = db_communicate(_read_manifest, commit=False)
+        if db_error is not None:
+            # БД, которую не удалось обновить, создается заново
+            print(db_error)
+            manifest, stored_fingerprints = None, dict()
+        else:
+            manifest, stored_fingerprints = stored
+    if manifest is not None and tuple(manifest[1:3]) == (state.size, state.mtime_ns):
+        _, db_error = db_communicate(_create_indexes, commit=True)
+        if db_error is not None:
+            return None, db_error
+        print("Исходный файл не изменился, загрузка данных пропущена")
+        return None, None
 
-    data_from_file, file_error = read_data_from_file()
+    content_hash, file_error = read_source_hash()
     if file_error is not None:
         return None, file_error
-    min_date, max_date, users, requests_qnt = data_from_file
+    if manifest is not None and manifest[3] == content_hash:
+        _, db_error = db_communicate(_write_manifest, commit=True, state=state, content_hash=content_hash,
+                                     fingerprints=None)
+        if db_error is None:
+            _, db_error = db_communicate(_create_indexes, commit=True)
+        if db_error is not None:
+            return None, db_error
+        print("Содержимое исходного файла не изменилось, загрузка данных пропущена")
+        return None, None
+
+    data_from_file, file_error = read_data_from_file(workers=workers)
+    if file_error is not None:
+        return None, file_error
+    min_date, max_date, users, requests_qnt, packages = data_from_file
+    with stage("fingerprints"):
+        fingerprints = _day_fingerprints(users=users, requests_qnt=requests_qnt, packages=packages)
     print("Данные из исходного файла прочитаны")
 
     print("Запись данных в базу...")
-    _, db_error = db_communicate(_first_insertion, commit=True, schema=schema,
-                                 min_date=min_date, max_date=max_date, users=users, requests_qnt=requests_qnt)
+    if manifest is None:
+        _, db_error = db_bulk_load(_full_load, schema=schema,
+                                   min_date=min_date, max_date=max_date, users=users, requests_qnt=requests_qnt,
+                                   packages=packages, state=state, content_hash=content_hash, fingerprints=fingerprints)
+    else:
+        changed_days = {dt for dt, fingerprint in fingerprints.items() if stored_fingerprints.get(dt) != fingerprint}
+        removed_days = stored_fingerprints.keys() - fingerprints.keys()
+        print(f"Изменилось дней: {len(changed_days)}, удалено дней: {len(removed_days)}")
+        _, db_error = db_bulk_load(_incremental_load,
+                                   min_date=min_date, max_date=max_date, users=users, requests_qnt=requests_qnt,
+                                   packages=packages, changed_days=changed_days, removed_days=removed_days,
+                                   state=state, content_hash=content_hash, fingerprints=fingerprints)
     if db_error is not None:
         return None, db_error
     print("Данные записаны в базу")
@@ -61,82 +426,618 @@ def _get_meta(cursor) -> List:
     min_date_int, max_date_int = dates
     min_date, max_date = DATE_BASEMENT + timedelta(days=min_date_int), DATE_BASEMENT + timedelta(days=max_date_int)
     min_date, max_date = min_date.strftime("%Y-%m-%d"), max_date.strftime("%Y-%m-%d")
+    return [min_date, max_date, _request_period_data(cursor, min_int=min_date_int, max_int=max_date_int)]
 
-    quantities = list(cursor.execute(DbRequests.requests_select.value, (min_date_int, max_date_int)).fetchone())
-    users = cursor.execute(DbRequests.user_select.value, (min_date_int, max_date_int)).fetchone()
-    quantities.extend(users)
-    return [min_date, max_date, quantities]
+
+def _date_to_int(date_str: str) -> int:
+    return (datetime.strptime(date_str, "%Y-%m-%d").date() - DATE_BASEMENT).days
 
 
-def _request_period_data(cursor, min_date: str, max_date: str):
-    min_dt = datetime.strptime(min_date, "%Y-%m-%d").date()
-    max_dt = datetime.strptime(max_date, "%Y-%m-%d").date()
-    min_int, max_int = (min_dt - DATE_BASEMENT).days, (max_dt - DATE_BASEMENT).days,
+def _request_period_data(cursor, min_int: int, max_int: int):
     quantities = list(cursor.execute(DbRequests.requests_select.value, (min_int, max_int)).fetchone())
+    if quantities[PACKAGES_COUNTER] is not None:
+        quantities[PACKAGES_COUNTER], = cursor.execute(DbRequests.package_select.value, (min_int, max_int)).fetchone()
     users = cursor.execute(DbRequests.user_select.value, (min_int, max_int)).fetchone()
     quantities.extend(users)
     return quantities
 
 
-# lru_cache - потокобезопасный декоратор
-@lru_cache(maxsize=100)
-def _get_period_data(min_date: str, max_date: str):
+# максимальное количество периодов в одном sql запросе (ограничение sqlite на количество параметров)
+_BATCH_SQL_RANGES = 300
+
+
+def _request_batch_data(cursor, ranges: List[Tuple[int, int]]) -> List[List]:
+    """
+    Данные за несколько периодов: по одному запросу к requests, packages и users на каждые _BATCH_SQL_RANGES периодов
+    :param cursor:
+    :param ranges: список пар (день начала, день конца)
+    :return: список данных за период в порядке ranges
+    """
+    result = []
+    for start in range(0, len(ranges), _BATCH_SQL_RANGES):
+        chunk = ranges[start:start + _BATCH_SQL_RANGES]
+        values = ", ".join(["(?, ?, ?)"] * len(chunk))
+        params = [param for idx, (min_int, max_int) in enumerate(chunk) for param in (idx, min_int, max_int)]
+        quantities = cursor.execute(DbRequests.requests_batch_select.value.format(values=values), params).fetchall()
+        packages = cursor.execute(DbRequests.package_batch_select.value.format(values=values), params).fetchall()
+        users = cursor.execute(DbRequests.user_batch_select.value.format(values=values), params).fetchall()
+        for qnt_row, packages_row, users_row in zip(quantities, packages, users):
+            period_data = [*qnt_row[1:], users_row[1]]
+            if period_data[PACKAGES_COUNTER] is not None:
+                period_data[PACKAGES_COUNTER] = packages_row[1]
+            result.append(period_data)
+    return result
+
+
+def _sql_bucket_start(day: int, bucket: str) -> int:
+    return bucket_start(day, SeriesBucket(bucket))
+
+
+def _request_series_data(cursor, min_int: int, max_int: int,
+                         bucket: SeriesBucket) -> Tuple[List[Tuple[int, int]], List[List]]:
+    """
+    Данные по интервалам внутри периода одним сгруппированным запросом к requests, packages и users
+    Результат совпадает с PeriodIndex.series
+    :param cursor:
+    :param min_int: день начала периода
+    :param max_int: день конца периода
+    :param bucket: интервал разбиения
+    :return: кортеж (границы интервалов, данные за период по каждому интервалу)
+    """
+    cursor.connection.create_function("bucket_start", 2, _sql_bucket_start, deterministic=True)
+    data_min, data_max = cursor.execute(DbRequests.date_range_select.value).fetchone()
+    bounds = bucket_bounds(max(min_int, data_min), min(max_int, data_max), bucket)
+    params = (bucket.value, min_int, max_int)
+    quantities = {row[0]: list(row[1:]) for row in cursor.execute(DbRequests.requests_series_select.value, params)}
+    packages = dict(cursor.execute(DbRequests.package_series_select.value, params).fetchall())
+    for start, quantity in quantities.items():
+        quantity[PACKAGES_COUNTER] = packages.get(start, 0)
+    users = dict(cursor.execute(DbRequests.user_series_select.value, params).fetchall())
+    empty = [None] * (len(RequestsCols) - 1)
+    starts = [bucket_start(low, bucket) for low, _ in bounds]
+    return bounds, [[*quantities.get(start, empty), users.get(start, 0)] for start in starts]
+
+
+# источник данных для запросов за период
+class PeriodSource(Enum):
+    sql = "sql"          # суммирование sql запросом к БД
+    index = "index"      # индекс в памяти, см. support_period_index
+    compare = "compare"  # оба способа со сверкой результатов, в ответ идет результат sql
+
+
+# бюджет памяти кэша ответов по умолчанию, байт
+_RESPONSE_CACHE_BYTES = 4 * 1024 * 1024
+# оценка памяти на запись кэша сверх размера ответа: ключ, узел OrderedDict, объект bytes
+_CACHE_ENTRY_OVERHEAD = 200
+
+
+class _ResponseCache:
+    """
+    Потокобезопасный LRU кэш готовых (сериализованных) ответов сервера БД
+    Объем ограничен бюджетом в байтах: при превышении вытесняются давно не использованные ответы
+    Сброс (clear) увеличивает поколение кэша - ответы, вычисленные по данным до сброса, не сохраняются
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.generation = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key: Tuple) -> Optional[bytes]:
+        with self._lock:
+            answer = self._entries.get(key)
+            if answer is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return answer
+
+    def put(self, key: Tuple, answer: bytes, generation: int):
+        """
+        :param key:
+        :param answer:
+        :param generation: поколение кэша на момент начала вычисления ответа
+        """
+        cost = len(answer) + _CACHE_ENTRY_OVERHEAD
+        with self._lock:
+            if generation != self.generation or cost > self.max_bytes or key in self._entries:
+                return
+            self._entries[key] = answer
+            self._size += cost
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted) + _CACHE_ENTRY_OVERHEAD
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.generation += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(entries=len(self._entries), size=self._size, max_bytes=self.max_bytes,
+                        hits=self.hits, misses=self.misses, evictions=self.evictions, generation=self.generation)
+
+
+# индекс, источник данных и кэш ответов устанавливаются при запуске сервера, см. run_socketserver
+_period_index: Optional[PeriodIndex] = None
+_period_source: PeriodSource = PeriodSource.index
+_response_cache = _ResponseCache(max_bytes=_RESPONSE_CACHE_BYTES)
+# готовый ответ на DB_META_COMMAND, заменяется вместе с индексом, см. _install_snapshot
+_meta_answer: bytes = b""
+# счетчики производительности, None - сервер запущен без сбора статистики
+_stats: Optional[ServerStats] = None
+
+
+def _load_snapshot() -> Union[Tuple[Tuple[List, Optional[PeriodIndex]], None], Tuple[None, str]]:
+    """
+    Читает из БД (см. support_db_requests.db_path) данные, которые сервер держит в памяти
+    :return: кортеж ((meta, индекс - None при PeriodSource.sql), ошибка)
+    """
+    meta_data, db_error = db_communicate(_get_meta, commit=False)
+    if db_error is not None:
+        return None, db_error
+    period_index = None
+    if _period_source is not PeriodSource.sql:
+        # при сверке с sql (PeriodSource.compare) количество уникальных пакетов в индексе - только точное
+        exact_limit = None if _period_source is PeriodSource.compare else PACKAGES_EXACT_LIMIT
+        period_index, db_error = db_communicate(build_period_index, commit=False, packages_exact_limit=exact_limit)
+        if db_error is not None:
+            return None, db_error
+    return (meta_data, period_index), None
+
+
+def _install_snapshot(meta_data: List, period_index: Optional[PeriodIndex], shared: bool):
+    """
+    Переключает сервер на данные, прочитанные _load_snapshot: заменяет meta и индекс, сбрасывает и прогревает
+    кэш ответов, обновляет общий кэш. Запросы, начатые до переключения, завершаются по прежним данным,
+    их ответы не сохраняются в кэш (см. _ResponseCache.put)
+    :param meta_data: данные ответа на DB_META_COMMAND
+    :param period_index: индекс, None - при PeriodSource.sql
+    :param shared: true - публиковать meta и прогретые ответы в общий для процессов django кэш
+    :return:
+    """
+    global _meta_answer, _period_index
+    json_meta = json.dumps(meta_data).encode(encoding="utf-8")
+    _period_index, _meta_answer = period_index, json_meta
+    _response_cache.clear()
+    warmed = _warm_up_cache(_date_to_int(meta_data[0]), _date_to_int(meta_data[1]))
+    print(f"Кэш ответов прогрет: периодов {len(warmed)}, байт {_response_cache.stats()['size']}")
+    if not shared:
+        # ответы в общем кэше от предыдущего запуска могут быть устаревшими
+        invalidate_shared_cache()
+    else:
+        try:
+            print(f"Общий кэш ответов опубликован: периодов {_publish_shared_cache(json_meta, warmed)}")
+        except OSError as err:
+            print(f"!_ОШИБКА ОБЩЕГО КЭША - {err}")
+
+
+def _get_period_data(min_int: int, max_int: int) -> Union[Tuple[List, None], Tuple[None, str]]:
     """
     Возвращает суммированные за период данные
-    Кэширует результаты с помощью lru_cache
-    :param min_date: строка-дата начала периода
-    :param max_date: строка-дата конца периода
+    Источник данных определяется _period_source
+    :param min_int: день начала периода (дни от DATE_BASEMENT)
+    :param max_int: день конца периода
+    :return: кортеж (результат, ошибка)
+    """
+    if _period_source is PeriodSource.index:
+        return _period_index.period_data(min_int, max_int), None
+    period_data, db_error = db_read(_request_period_data, min_int=min_int, max_int=max_int)
+    if db_error is None and _period_source is PeriodSource.compare:
+        index_data = _period_index.period_data(min_int, max_int)
+        if index_data != period_data:
+            print(f"!_РАСХОЖДЕНИЕ ИНДЕКСА - период {min_int} - {max_int}: sql {period_data}, индекс {index_data}")
+    return period_data, db_error
+
+
+def _period_answer(min_int: int, max_int: int, binary: bool) -> bytes:
+    """
+    Готовый ответ на запрос за период, ответы без ошибок кэшируются в _response_cache
+    :param min_int: день начала периода
+    :param max_int: день конца периода
+    :param binary: true - двоичный ответ (см. app.protocol.encode_period_answer), false - json
     :return:
     """
-    period_data, db_error = db_communicate(_request_period_data, commit=False, min_date=min_date, max_date=max_date)
-    if db_error is not None:
-        return json.dumps([None, db_error]).encode(encoding="utf-8")
+    key = (binary, min_int, max_int)
+    answer = _response_cache.get(key)
+    if answer is not None:
+        return answer
+    generation = _response_cache.generation
+    stats = _stats
+    started = time.perf_counter_ns() if stats is not None else 0
+    period_data, db_error = _get_period_data(min_int, max_int)
+    if stats is not None:
+        computed = time.perf_counter_ns()
+        stats.record_stage(Stage.data, computed - started)
+    if binary:
+        answer = encode_period_answer(period_data, db_error)
+    else:
+        answer = json.dumps([period_data, db_error]).encode(encoding="utf-8")
+    if stats is not None:
+        stats.record_stage(Stage.encode, time.perf_counter_ns() - computed)
+    if db_error is None:
+        _response_cache.put(key, answer, generation=generation)
+    return answer
+
+
+def _warm_up_cache(min_int: int, max_int: int) -> List[Tuple[int, int]]:
+    """
+    Заполняет кэш ответами на частые запросы: весь диапазон дат, каждый месяц, последние 7 и 30 дней
+    :param min_int: первый день данных
+    :param max_int: последний день данных
+    :return: подготовленные периоды
+    """
+    ranges = [(min_int, max_int), (max(max_int - 6, min_int), max_int), (max(max_int - 29, min_int), max_int)]
+    ranges.extend(bucket_bounds(min_int, max_int, SeriesBucket.month))
+    for min_day, max_day in ranges:
+        for binary in (True, False):
+            _period_answer(min_day, max_day, binary=binary)
+    return ranges
+
+
+def _publish_shared_cache(meta: bytes, ranges: List[Tuple[int, int]]) -> int:
+    """
+    Публикует meta и ответы за периоды в общий для процессов кэш, см. app.shared_cache
+    :param meta: готовый ответ на DB_META_COMMAND
+    :param ranges: периоды, ответы за которые публикуются (в порядке приоритета)
+    :return: количество опубликованных ответов
+    """
+    answers = {(min_int, max_int): _period_answer(min_int, max_int, binary=False) for min_int, max_int in ranges}
+    return shared_cache.publish(SHARED_CACHE_PATH, meta=meta, answers=answers)
+
+
+def _get_batch_data(ranges: List[Tuple[int, int]]) -> Union[Tuple[List, None], Tuple[None, str]]:
+    """
+    Возвращает данные за несколько периодов за одно обращение к индексу или к БД
+    Источник данных определяется _period_source, кэш ответов не используется
+    :param ranges: список пар (день начала, день конца)
+    :return: кортеж (список данных за период в порядке ranges, ошибка)
+    """
+    # все периоды пакета - по одному индексу, даже если во время ответа данные перезагружены
+    period_index = _period_index
+    if _period_source is PeriodSource.index:
+        return [period_index.period_data(min_int, max_int) for min_int, max_int in ranges], None
+    batch_data, db_error = db_read(_request_batch_data, ranges=ranges)
+    if db_error is None and _period_source is PeriodSource.compare:
+        for (min_int, max_int), period_data in zip(ranges, batch_data):
+            index_data = period_index.period_data(min_int, max_int)
+            if index_data != period_data:
+                print(f"!_РАСХОЖДЕНИЕ ИНДЕКСА - период {min_int} - {max_int}: sql {period_data}, индекс {index_data}")
+    return batch_data, db_error
+
+
+def _get_series_data(min_int: int, max_int: int, bucket: SeriesBucket) -> Union[Tuple[Dict, None], Tuple[None, str]]:
+    """
+    Возвращает ряд данных по интервалам внутри периода в виде колонок:
+    bucket - даты начала интервалов, далее по колонке на каждый счетчик RequestsCols и users,
+    значения интервалов без данных - 0
+    Источник данных определяется _period_source
+    :param min_int: день начала периода
+    :param max_int: день конца периода
+    :param bucket: интервал разбиения
+    :return: кортеж (колонки, ошибка)
+    """
+    if _period_source is PeriodSource.index:
+        (bounds, rows), db_error = _period_index.series(min_int, max_int, bucket), None
     else:
-        return json.dumps([period_data, None]).encode(encoding="utf-8")
+        series, db_error = db_read(_request_series_data, min_int=min_int, max_int=max_int, bucket=bucket)
+        if db_error is not None:
+            return None, db_error
+        bounds, rows = series
+        if _period_source is PeriodSource.compare and _period_index.series(min_int, max_int, bucket) != series:
+            print(f"!_РАСХОЖДЕНИЕ ИНДЕКСА - ряд {bucket.value} {min_int} - {max_int}")
 
+    names = [col.name for col in RequestsCols if col is not RequestsCols.dt] + ["users"]
+    columns = {"bucket": [(DATE_BASEMENT + timedelta(days=low)).strftime("%Y-%m-%d") for low, _ in bounds]}
+    for name, values in zip(names, zip(*rows) if rows else [()] * len(names)):
+        columns[name] = [value or 0 for value in values]
+    return columns, None
 
-def _socketserver_factory(meta_data: bytes):
+
+def _stats_answer() -> bytes:
+    """:return: ответ на DB_STATS_COMMAND - статистика кэша ответов и, при сборе статистики, счетчики сервера"""
+    cache = _response_cache.stats()
+    lookups = cache["hits"] + cache["misses"]
+    cache["hit_ratio"] = round(cache["hits"] / lookups, 4) if lookups else None
+    summary = dict(enabled=_stats is not None, cache=cache)
+    if _stats is not None:
+        summary.update(_stats.summary())
+    return json.dumps([summary, None]).encode(encoding="utf-8")
+
+
+def _answer(request: bytes) -> Tuple[RequestKind, bytes]:
+    """
+    :param request: запрос в формате json либо двоичный запрос за период (см. app.protocol)
+    :return: кортеж (вид запроса, ответ в формате запроса)
+    """
+    stats = _stats
+    started = time.perf_counter_ns() if stats is not None else 0
+    if is_period_request(request):
+        min_int, max_int = decode_period_request(request)
+        if stats is not None:
+            stats.record_stage(Stage.decode, time.perf_counter_ns() - started)
+        return RequestKind.period_binary, _period_answer(min_int, max_int, binary=True)
+    data = json.loads(request)
+    if stats is not None:
+        stats.record_stage(Stage.decode, time.perf_counter_ns() - started)
+    if data == DB_META_COMMAND:
+        return RequestKind.meta, _meta_answer
+    if data == DB_STATS_COMMAND:
+        return RequestKind.stats, _stats_answer()
+    if data[0] == HELLO_COMMAND:
+        return RequestKind.hello, json.dumps([min(data[1], PROTOCOL_VERSION), None]).encode(encoding="utf-8")
+    if data[0] == DB_BATCH_COMMAND:
+        try:
+            ranges = [(_date_to_int(min_date), _date_to_int(max_date)) for min_date, max_date in data[1]]
+        except (ValueError, TypeError) as err:
+            return RequestKind.batch, json.dumps([None, f"!_НЕКОРРЕКТНЫЙ ЗАПРОС - {err}"]).encode(encoding="utf-8")
+        return RequestKind.batch, json.dumps(_get_batch_data(ranges)).encode(encoding="utf-8")
+    if data[0] == DB_SERIES_COMMAND:
+        try:
+            _, min_date, max_date, bucket = data
+            min_int, max_int, bucket = _date_to_int(min_date), _date_to_int(max_date), SeriesBucket(bucket)
+        except (ValueError, TypeError) as err:
+            return RequestKind.series, json.dumps([None, f"!_НЕКОРРЕКТНЫЙ ЗАПРОС - {err}"]).encode(encoding="utf-8")
+        return RequestKind.series, json.dumps(_get_series_data(min_int, max_int, bucket)).encode(encoding="utf-8")
+    min_date, max_date = data
+    return RequestKind.period, _period_answer(_date_to_int(min_date), _date_to_int(max_date), binary=False)
+
+
+def _dispatch(request: bytes) -> bytes:
+    """
+    Ответ сервера БД на один запрос, общий для всех реализаций сервера
+    При сборе статистики учитывается время формирования ответа по виду запроса
+    :param request: запрос в формате json либо двоичный запрос за период (см. app.protocol)
+    :return: ответ в формате запроса
+    """
+    stats = _stats
+    if stats is None:
+        return _answer(request)[1]
+    started = time.perf_counter_ns()
+    kind, answer = _answer(request)
+    stats.record_request(kind, time.perf_counter_ns() - started)
+    return answer
+
+
+def _socketserver_factory():
     """
-    фабрика для создания сокет-сервера, имеющего готовые данные в атрибуте класса
-    :param meta_data:
+    фабрика для создания обработчика соединений сокет-сервера
+    готовые данные (meta, индекс) хранятся в модуле и заменяются при перезагрузке, см. _install_snapshot
     :return:
     """
     class DataBaseHandler(socketserver.BaseRequestHandler):
-        meta = meta_data
-
         def handle(self):
-            length = self.request.recv(4)
-            length, read, chunks = int.from_bytes(length, byteorder="little"), 0, []
-            while read < length:
-                chunk = self.request.recv(1024).strip()
-                chunks.append(chunk)
-                read += len(chunk)
-            data = json.loads(b"".join(chunks))
-            if data == DB_META_COMMAND:
-                answer = DataBaseHandler.meta
-            else:
-                min_date, max_date = data
-                answer = _get_period_data(min_date=min_date, max_date=max_date)
-            self.request.send(len(answer).to_bytes(4, byteorder="little"))
-            self.request.sendall(answer)
+            stats = _stats
+            if stats is None:
+                self._serve()
+                return
+            stats.connection_opened()
+            try:
+                self._serve(stats)
+            finally:
+                stats.connection_closed()
+
+        def _serve(self, stats: Optional[ServerStats] = None):
+            # соединение постоянное - запросы обслуживаются, пока клиент не закроет соединение
+            while True:
+                try:
+                    request = recv_frame(self.request)
+                except ConnectionError:
+                    return
+                if request is None:
+                    return
+                answer = _dispatch(request)
+                started = time.perf_counter_ns() if stats is not None else 0
+                send_frame(self.request, answer)
+                if stats is not None:
+                    stats.record_stage(Stage.send, time.perf_counter_ns() - started)
 
     return DataBaseHandler
 
 
-def run_socketserver(queue):
+# реализация сервера БД
+class ServerMode(Enum):
+    threading = "threading"  # поток на каждое соединение, socketserver.ThreadingTCPServer
+    asyncio = "asyncio"      # цикл событий asyncio, см. support_async_server
+
+
+# ограничения асинхронного сервера: одновременно обрабатываемые запросы и потоки для обращений к БД
+_ASYNC_MAX_CONCURRENCY = 256
+_ASYNC_DB_THREADS = 4
+# наибольшее точное объединение ID пакетов, которое асинхронный сервер выполняет прямо в цикле событий:
+# 5 000 ID - около 0.4 мс, 200 000 ID (PACKAGES_EXACT_LIMIT) - около 10 мс (benchmarks/distinct_packages.py)
+_ASYNC_INLINE_PACKAGES = 5_000
+_JSON_META_REQUEST = json.dumps(DB_META_COMMAND).encode(encoding="utf-8")
+
+
+def _is_inline_request(request: bytes) -> bool:
+    """
+    Отвечать ли асинхронному серверу с индексом на запрос прямо в цикле событий, а не в пуле потоков
+    В цикле событий - meta и двоичные запросы за период с точным объединением не больше _ASYNC_INLINE_PACKAGES ID
+    пакетов или с оценкой: их ответ формируется за доли миллисекунды и не задерживает другие соединения
+    :param request: запрос в формате json либо двоичный запрос за период (см. app.protocol)
+    :return: true - ответ в цикле событий, false - в пуле потоков
+    """
+    if request == _JSON_META_REQUEST:
+        return True
+    if not is_period_request(request):
+        return False
+    min_int, max_int = decode_period_request(request)
+    return _period_index.packages.exact_size(min_int, max_int) <= _ASYNC_INLINE_PACKAGES
+
+
+class _DataBaseServer(socketserver.ThreadingTCPServer):
+    # соединения клиентов постоянные - потоки обработчиков не должны задерживать остановку сервера
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def invalidate_shared_cache():
+    """Помечает общий кэш ответов недействительным - процессы django перестают отвечать из него"""
+    if os.path.exists(SHARED_CACHE_PATH):
+        try:
+            shared_cache.invalidate(SHARED_CACHE_PATH)
+        except OSError as err:
+            print(f"!_ОШИБКА ОБЩЕГО КЭША - {err}")
+
+
+def _remove_db_files(path: str):
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def _hot_reload(workers: int, shared: bool) -> Union[Tuple[None, None], Tuple[None, str]]:
+    """
+    Перезагрузка данных без остановки сервера
+    Данные загружаются в теневую копию БД (initialize_data), по ней читаются meta и индекс, затем копия
+    переносится в основную БД одной транзакцией (db_copy) и сервер переключается на новые данные.
+    До переключения запросы обслуживаются по прежним данным и кэши ответов не сбрасываются - их сбрасывает
+    и заполняет заново _install_snapshot, при ошибке прежние данные остаются
+    :param workers: количество процессов для сбора данных из файлов, см. initialize_data
+    :param shared: см. _install_snapshot
+    :return: кортеж (результат = None, ошибка)
+    """
+    # процесс сервера БД из launch.py - демон, а процесс-демон не может создавать пул процессов
+    if multiprocessing.current_process().daemon:
+        workers = 1
+    main = db_path()
+    shadow = f"{main}.shadow"
+    snapshot = None
+    _remove_db_files(shadow)
+    try:
+        # копия содержит манифест загрузки - загрузка в нее инкрементальная
+        _, error = db_copy(main, shadow)
+        if error is None:
+            with db_redirect(shadow):
+                _, error = initialize_data(workers=workers)
+                if error is None:
+                    snapshot, error = _load_snapshot()
+        if error is None:
+            _, error = db_copy(shadow, main)
+    finally:
+        _remove_db_files(shadow)
+    if error is not None:
+        return None, error
+    _install_snapshot(*snapshot, shared=shared)
+    return None, None
+
+
+def _source_signature() -> Optional[Tuple[SourceState, ...]]:
+    """:return: размер и время изменения исходных файлов, None - источник сейчас недоступен"""
+    if is_multi_source():
+        states, file_error = read_sources_state()
+    else:
+        state, file_error = read_source_state()
+        states = [state]
+    return None if file_error is not None else tuple(states)
+
+
+class _SourceWatcher(threading.Thread):
+    """
+    Поток сервера БД, опрашивающий состояние исходных файлов и перезагружающий данные при их изменении
+    Перезагрузка начинается, когда новое состояние не изменилось за интервал опроса - файл дописан
+    """
+
+    def __init__(self, interval: float, workers: int, shared: bool):
+        super().__init__(name="source-watcher", daemon=True)
+        self._interval = interval
+        self._workers = workers
+        self._shared = shared
+        self._signature = _source_signature()
+        self._pending = None
+
+    def changed(self) -> bool:
+        """:return: true - состояние источника изменилось и не менялось с прошлого опроса"""
+        signature = _source_signature()
+        if signature is None or signature == self._signature:
+            self._pending = None
+            return False
+        if signature != self._pending:
+            self._pending = signature
+            return False
+        # после неудачной перезагрузки повторная попытка - при следующем изменении файлов
+        self._signature, self._pending = signature, None
+        return True
+
+    def run(self):
+        while True:
+            time.sleep(self._interval)
+            if not self.changed():
+                continue
+            print("Исходные данные изменились, перезагрузка...")
+            try:
+                _, error = _hot_reload(workers=self._workers, shared=self._shared)
+            except Exception as err:
+                # необработанная ошибка одной перезагрузки не останавливает опрос источника
+                error = f"!_ОШИБКА ПЕРЕЗАГРУЗКИ ДАННЫХ - {err}"
+            if error is not None:
+                print(f"{error}\nДанные не перезагружены, сервер продолжает работу с прежними данными")
+            else:
+                print("Данные перезагружены")
+
+
+def run_socketserver(queue, period_source: PeriodSource = PeriodSource.index,
+                     mode: ServerMode = ServerMode.threading, cache_bytes: int = _RESPONSE_CACHE_BYTES,
+                     shared: bool = False, reload_interval: float = 0, workers: int = 1,
+                     source: Optional[str] = None, source_format: Optional[SourceFormat] = None,
+                     stats: bool = False):
     """
     Запуск сервера для централизованного взаимодействия с базой данных
-    Также осуществляет кэширование данных, см. _get_period_data
+    Также осуществляет кэширование ответов, см. _period_answer, кэш прогревается до начала приема соединений
     :param queue: межпоточная или межпроцессная очередь для сигнализации о возникших ошибках при запуске
+    :param period_source: источник данных для запросов за период, см. PeriodSource
+    :param mode: реализация сервера, см. ServerMode
+    :param cache_bytes: бюджет памяти кэша ответов, байт
+    :param shared: true - публиковать meta и прогретые ответы в общий для процессов django кэш
+    :param reload_interval: интервал опроса исходных файлов, секунд, 0 - без перезагрузки данных (см. _SourceWatcher)
+    :param workers: количество процессов для сбора данных при перезагрузке
+    :param source: источник данных, см. support_file_reader.use_source - процесс сервера, запущенный
+                   методом spawn, не наследует настройку родительского процесса
+    :param source_format: формат исходных файлов
+    :param stats: true - собирать счетчики производительности (время этапов, задержки, соединения),
+                  статистика кэша ответов доступна по DB_STATS_COMMAND и без них
     :return:
     """
-    meta_data, db_error = db_communicate(_get_meta, commit=False)
+    global _period_source, _response_cache, _stats
+    _period_source = period_source
+    _response_cache = _ResponseCache(max_bytes=cache_bytes)
+    if source is not None:
+        use_source(path=source, source_format=source_format)
+    snapshot, db_error = _load_snapshot()
     if db_error is not None:
         queue.put(db_error)
     else:
-        json_meta = json.dumps(meta_data).encode(encoding="utf-8")
-        handler_class = _socketserver_factory(meta_data=json_meta)
+        _install_snapshot(*snapshot, shared=shared)
+        # прогрев кэша в статистику не входит
+        _stats = ServerStats() if stats else None
+        if reload_interval > 0:
+            _SourceWatcher(interval=reload_interval, workers=workers, shared=shared).start()
+            print(f"Исходные данные проверяются каждые {reload_interval} с")
+        if mode is ServerMode.asyncio:
+            # с индексом ответы формируются из памяти, в пул потоков уходят только долгие точные
+            # объединения пакетов, пакеты и ряды периодов (см. _is_inline_request)
+            inline = _is_inline_request if _period_source is PeriodSource.index else None
+            run_async_server(address=(DB_SERVER_HOST, DB_SERVER_PORT), queue=queue, dispatch=_dispatch, offload=True,
+                             max_concurrency=_ASYNC_MAX_CONCURRENCY, db_threads=_ASYNC_DB_THREADS, stats=_stats,
+                             inline=inline)
+            return
+        handler_class = _socketserver_factory()
+        try:
+            server = _DataBaseServer((DB_SERVER_HOST, DB_SERVER_PORT), handler_class)
+        except OSError as err:
+            queue.put(f"!_ОШИБКА СЕРВЕРА БД - {err}")
+            return
         queue.put(None)
         print("Сервер для взаимодействия с базой данных запущен")
-        with socketserver.ThreadingTCPServer((DB_SERVER_HOST, DB_SERVER_PORT), handler_class) as server:
+        with server:
             server.serve_forever()
@@ -0,0 +1,347 @@
+"""
+Модуль содержит индекс для получения данных за период без обращения к базе данных
+Индекс строится в памяти сервера БД по таблицам requests и users и позволяет получить за любой период
+суммы счетчиков - за две выборки из массивов префиксных сумм,
+точное количество уникальных пользователей - за две выборки из разреженной таблицы битовых масок,
+количество уникальных пакетов - объединением ID пакетов дней периода, для длинных периодов - оценкой HyperLogLog
+"""
+
+
+from array import array
+from datetime import timedelta
+from itertools import chain
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+from app.constants import DATE_BASEMENT, SeriesBucket
+from support_db_requests import DbRequests, RequestsCols
+
+
+# количество суммируемых счетчиков таблицы requests - все колонки, кроме даты
+_COUNTERS_QNT = len(RequestsCols) - 1
+# позиция количества пакетов в данных за период: в БД хранится количество пакетов каждого дня,
+# в данных за период - количество уникальных пакетов, см. DistinctPackagesIndex
+PACKAGES_COUNTER = list(RequestsCols).index(RequestsCols.packages) - 1
+
+# период, в днях которого в сумме не больше ID пакетов, объединяется точно, см. DistinctPackagesIndex
+PACKAGES_EXACT_LIMIT = 200_000
+# оценка HyperLogLog: 2 ** _HLL_PRECISION однобайтовых регистров, стандартная ошибка 1.04 / sqrt(регистров) ~ 1.6%
+_HLL_PRECISION = 12
+_HLL_REGISTERS = 1 << _HLL_PRECISION
+_HLL_ALPHA = 0.7213 / (1 + 1.079 / _HLL_REGISTERS)
+# биты хэша после номера регистра, ранг - номер первой единицы в них (1..65 - _HLL_PRECISION)
+_HLL_RANK_BITS = 64 - _HLL_PRECISION
+_HLL_INVERSE_POWERS = [2.0 ** -rank for rank in range(_HLL_RANK_BITS + 2)]
+# регистры оценки упакованы в одно целое по байту на регистр, старшие биты байтов - для поэлементного максимума
+_HLL_HIGH_BITS = int.from_bytes(b"\x80" * _HLL_REGISTERS, byteorder="little")
+_MASK_64 = (1 << 64) - 1
+
+
+def bucket_start(day: int, bucket: SeriesBucket) -> int:
+    """
+    :param day: день (дни от DATE_BASEMENT)
+    :param bucket: интервал разбиения
+    :return: первый день интервала, которому принадлежит day
+    """
+    if bucket is SeriesBucket.day:
+        return day
+    dt = DATE_BASEMENT + timedelta(days=day)
+    if bucket is SeriesBucket.week:
+        return day - dt.weekday()
+    return day - dt.day + 1
+
+
+def _next_bucket_start(day: int, bucket: SeriesBucket) -> int:
+    start = bucket_start(day, bucket)
+    if bucket is SeriesBucket.day:
+        return start + 1
+    if bucket is SeriesBucket.week:
+        return start + 7
+    # от первого числа месяца через 31 день - всегда следующий месяц
+    return bucket_start(start + 31, bucket)
+
+
+def bucket_bounds(min_int: int, max_int: int, bucket: SeriesBucket) -> List[Tuple[int, int]]:
+    """
+    Разбиение периода на интервалы, крайние интервалы обрезаются границами периода
+    :param min_int: день начала периода включительно
+    :param max_int: день конца периода включительно
+    :param bucket: интервал разбиения
+    :return: список пар (день начала, день конца) интервалов по возрастанию
+    """
+    bounds, start = [], min_int
+    while start <= max_int:
+        end = min(_next_bucket_start(start, bucket) - 1, max_int)
+        bounds.append((start, end))
+        start = end + 1
+    return bounds
+
+
+class DistinctUsersIndex:
+    """
+    Разреженная таблица (sparse table) битовых масок пользователей по оси дней в диапазоне [min_date, max_date]
+    Каждому пользователю присваивается номер бита, маска дня - пользователи, активные в этот день
+    Уровень k таблицы - маски, объединенные (OR) по окнам длиной 2 ** k, начиная с каждого дня
+    Любой период покрывается двумя окнами одного уровня, объединение идемпотентно - пересечение окон не важно
+    Память: дни * log2(дни) * пользователи / 8 байт
+    """
+
+    def __init__(self, min_date: int, max_date: int, rows: List[Tuple]):
+        self.min_date = min_date
+        self.max_date = max_date
+        days = max(max_date - min_date + 1, 0)
+
+        user_bits, daily_bits = dict(), [[] for _ in range(days)]
+        for dt, user in rows:
+            if dt < min_date or dt > max_date:
+                continue
+            daily_bits[dt - min_date].append(user_bits.setdefault(user, len(user_bits)))
+        self.users_qnt = len(user_bits)
+
+        mask_size = (self.users_qnt + 7) // 8
+        masks = []
+        for bits in daily_bits:
+            mask = bytearray(mask_size)
+            for bit in bits:
+                mask[bit >> 3] |= 1 << (bit & 7)
+            masks.append(int.from_bytes(mask, byteorder="little"))
+
+        self._levels = [masks]
+        width = 1
+        while width * 2 <= days:
+            previous = self._levels[-1]
+            self._levels.append([previous[i] | previous[i + width] for i in range(len(previous) - width)])
+            width *= 2
+
+    def count(self, min_int: int, max_int: int) -> int:
+        """
+        Количество уникальных пользователей за период, результат совпадает с DbRequests.user_select
+        :param min_int: день начала периода включительно
+        :param max_int: день конца периода включительно
+        :return: количество пользователей
+        """
+        low, high = max(min_int, self.min_date), min(max_int, self.max_date)
+        if low > high:
+            return 0
+        start, end = low - self.min_date, high - self.min_date
+        level = (end - start + 1).bit_length() - 1
+        masks = self._levels[level]
+        return (masks[start] | masks[end - (1 << level) + 1]).bit_count()
+
+
+def _hash_64(value: int) -> int:
+    """Перемешивание splitmix64: ID пакетов идут подряд, а номеру регистра и рангу нужны равномерные биты"""
+    value = (value + 0x9E3779B97F4A7C15) & _MASK_64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK_64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK_64
+    return value ^ (value >> 31)
+
+
+def _sketch(package_ids: Iterable[int], positions: Dict[int, int]) -> int:
+    """
+    :param package_ids: ID пакетов
+    :param positions: общий для оценок всех дней словарь ID -> номер регистра * 256 + ранг, пополняется здесь -
+    пакет нескольких дней хэшируется один раз
+    :return: оценка HyperLogLog множества ID - регистры, упакованные в целое (регистр i - байт i)
+    """
+    registers = bytearray(_HLL_REGISTERS)
+    for package_id in package_ids:
+        position = positions.get(package_id)
+        if position is None:
+            hashed = _hash_64(package_id)
+            rank = _HLL_RANK_BITS - (hashed & ((1 << _HLL_RANK_BITS) - 1)).bit_length() + 1
+            position = positions[package_id] = (hashed >> _HLL_RANK_BITS) << 8 | rank
+        register, rank = position >> 8, position & 0xFF
+        if rank > registers[register]:
+            registers[register] = rank
+    return int.from_bytes(registers, byteorder="little")
+
+
+def _merge_sketches(first: int, second: int) -> int:
+    """
+    Объединение оценок - поэлементный максимум регистров без цикла по регистрам: в байте (first | 0x80) - second
+    старший бит остается, только если регистр first не меньше регистра second (регистры меньше 0x80, займов
+    между байтами нет), маска из этих битов выбирает регистры first
+    """
+    greater = ((((first | _HLL_HIGH_BITS) - second) & _HLL_HIGH_BITS) >> 7) * 0xFF
+    return second ^ ((first ^ second) & greater)
+
+
+def _estimate(sketch: int) -> float:
+    """:return: оценка количества уникальных ID, для малых количеств - по числу пустых регистров"""
+    registers = sketch.to_bytes(_HLL_REGISTERS, byteorder="little")
+    estimate = _HLL_ALPHA * _HLL_REGISTERS ** 2 / sum(map(_HLL_INVERSE_POWERS.__getitem__, registers))
+    empty = registers.count(0)
+    if estimate <= 2.5 * _HLL_REGISTERS and empty:
+        return _HLL_REGISTERS * math.log(_HLL_REGISTERS / empty)
+    return estimate
+
+
+class DistinctPackagesIndex:
+    """
+    Количество уникальных пакетов за период по ID пакетов каждого дня в диапазоне [min_date, max_date]
+    Пакетов на порядки больше, чем пользователей: битовые маски, как в DistinctUsersIndex, заняли бы
+    дни * log2(дни) * пакеты / 8 байт. Поэтому количество считается в одном из двух режимов:
+    - точно: если ID в сумме по дням периода не больше exact_limit, ID дней периода объединяются во множество,
+      время пропорционально этой сумме
+    - оценкой: для периодов длиннее - по разреженной таблице оценок HyperLogLog дней. Объединение оценок
+      (максимум регистров) идемпотентно, и период, как в DistinctUsersIndex, покрывается двумя окнами
+    Оценки строятся, только если ID в сумме по всем дням больше exact_limit
+    Память оценок: дни * log2(дни) * 2 ** _HLL_PRECISION байт
+    """
+
+    def __init__(self, min_date: int, max_date: int, rows: List[Tuple], exact_limit: Optional[int]):
+        """
+        :param rows: пары (день, ID пакета), ID пакета в пределах дня не повторяются
+        :param exact_limit: наибольшее количество ID в сумме по дням для точного объединения, None - всегда точно
+        """
+        self.min_date = min_date
+        self.max_date = max_date
+        self.exact_limit = exact_limit
+        days = max(max_date - min_date + 1, 0)
+
+        self._daily = [array('q') for _ in range(days)]
+        for dt, package_id in rows:
+            if min_date <= dt <= max_date:
+                self._daily[dt - min_date].append(package_id)
+        self._prefix = array('q', bytes(8 * (days + 1)))
+        for i, package_ids in enumerate(self._daily, start=1):
+            self._prefix[i] = self._prefix[i - 1] + len(package_ids)
+
+        self._levels: Optional[List[List[int]]] = None
+        if exact_limit is not None and self._prefix[-1] > exact_limit:
+            positions = dict()
+            self._levels = [[_sketch(package_ids, positions) for package_ids in self._daily]]
+            width = 1
+            while width * 2 <= days:
+                previous = self._levels[-1]
+                self._levels.append([_merge_sketches(previous[i], previous[i + width])
+                                     for i in range(len(previous) - width)])
+                width *= 2
+
+    def exact_size(self, min_int: int, max_int: int) -> int:
+        """
+        Объем работы count за период: время точного объединения пропорционально количеству ID
+        :param min_int: день начала периода включительно
+        :param max_int: день конца периода включительно
+        :return: количество ID пакетов в сумме по дням периода, 0 - период пуст или количество оценивается
+        """
+        low, high = max(min_int, self.min_date), min(max_int, self.max_date)
+        if low > high:
+            return 0
+        total = self._prefix[high - self.min_date + 1] - self._prefix[low - self.min_date]
+        return total if self._levels is None or total <= self.exact_limit else 0
+
+    def count(self, min_int: int, max_int: int) -> int:
+        """
+        Количество уникальных пакетов за период, в точном режиме совпадает с DbRequests.package_select
+        :param min_int: день начала периода включительно
+        :param max_int: день конца периода включительно
+        :return: количество пакетов
+        """
+        low, high = max(min_int, self.min_date), min(max_int, self.max_date)
+        if low > high:
+            return 0
+        start, end = low - self.min_date, high - self.min_date
+        total = self._prefix[end + 1] - self._prefix[start]
+        if self._levels is None or total <= self.exact_limit:
+            return len(set(chain.from_iterable(self._daily[start:end + 1])))
+        level = (end - start + 1).bit_length() - 1
+        sketches = self._levels[level]
+        estimate = _estimate(_merge_sketches(sketches[start], sketches[end - (1 << level) + 1]))
+        # уникальных пакетов не больше, чем в сумме по дням
+        return min(round(estimate), total)
+
+
+class PeriodIndex:
+    """
+    Префиксные суммы по оси дней (дни от DATE_BASEMENT) в диапазоне [min_date, max_date]
+    Элемент i массива - сумма счетчика по всем дням строго до min_date + i
+    Отдельно хранится префиксное количество строк, чтобы отличать пустой период (sql SUM вернет NULL) от нулей
+    """
+
+    def __init__(self, min_date: int, max_date: int, rows: List[Tuple], users_rows: List[Tuple],
+                 packages_rows: List[Tuple], packages_exact_limit: Optional[int] = PACKAGES_EXACT_LIMIT):
+        self.min_date = min_date
+        self.max_date = max_date
+        self.users = DistinctUsersIndex(min_date=min_date, max_date=max_date, rows=users_rows)
+        self.packages = DistinctPackagesIndex(min_date=min_date, max_date=max_date, rows=packages_rows,
+                                              exact_limit=packages_exact_limit)
+        days = max(max_date - min_date + 1, 0)
+
+        daily = [array('q', bytes(8 * days)) for _ in range(_COUNTERS_QNT)]
+        daily_rows = array('q', bytes(8 * days))
+        for dt, *quantities in rows:
+            if dt < min_date or dt > max_date:
+                continue
+            day = dt - min_date
+            daily_rows[day] += 1
+            for counter, qnt in zip(daily, quantities):
+                counter[day] += qnt or 0
+
+        self._prefixes = [self._accumulate(counter) for counter in daily]
+        self._rows = self._accumulate(daily_rows)
+
+    @staticmethod
+    def _accumulate(values: array) -> array:
+        prefix = array('q', bytes(8 * (len(values) + 1)))
+        total = 0
+        for i, value in enumerate(values, start=1):
+            total += value
+            prefix[i] = total
+        return prefix
+
+    def sums(self, min_int: int, max_int: int) -> List[Optional[int]]:
+        """
+        Суммы счетчиков за период, результат совпадает с DbRequests.requests_select
+        Сумма пакетов - по количествам пакетов дней, пакет нескольких дней учитывается в ней несколько раз
+        :param min_int: день начала периода включительно
+        :param max_int: день конца периода включительно
+        :return: список из _COUNTERS_QNT сумм, либо список None, если за период нет данных
+        """
+        low, high = max(min_int, self.min_date), min(max_int, self.max_date)
+        if low > high:
+            return [None] * _COUNTERS_QNT
+        start, end = low - self.min_date, high - self.min_date + 1
+        if self._rows[end] == self._rows[start]:
+            return [None] * _COUNTERS_QNT
+        return [prefix[end] - prefix[start] for prefix in self._prefixes]
+
+    def period_data(self, min_int: int, max_int: int) -> List[Optional[int]]:
+        """
+        Данные за период в формате ответа сервера БД: суммы счетчиков (вместо суммы пакетов - количество
+        уникальных пакетов) и количество пользователей
+        :param min_int: день начала периода включительно
+        :param max_int: день конца периода включительно
+        :return:
+        """
+        quantities = self.sums(min_int, max_int)
+        if quantities[PACKAGES_COUNTER] is not None:
+            quantities[PACKAGES_COUNTER] = self.packages.count(min_int, max_int)
+        quantities.append(self.users.count(min_int, max_int))
+        return quantities
+
+    def series(self, min_int: int, max_int: int, bucket: SeriesBucket) -> Tuple[List[Tuple[int, int]], List[List]]:
+        """
+        Данные по интервалам внутри периода, период обрезается диапазоном дат индекса
+        :param min_int: день начала периода включительно
+        :param max_int: день конца периода включительно
+        :param bucket: интервал разбиения
+        :return: кортеж (границы интервалов, данные за период по каждому интервалу)
+        """
+        bounds = bucket_bounds(max(min_int, self.min_date), min(max_int, self.max_date), bucket)
+        return bounds, [self.period_data(low, high) for low, high in bounds]
+
+
+def build_period_index(cursor, packages_exact_limit: Optional[int] = PACKAGES_EXACT_LIMIT) -> PeriodIndex:
+    """
+    Строит индекс по текущим данным БД, передается в db_communicate
+    :param cursor:
+    :param packages_exact_limit: см. DistinctPackagesIndex, None - количество пакетов всегда точное
+    :return: PeriodIndex
+    """
+    min_date, max_date = cursor.execute(DbRequests.date_range_select.value).fetchone()
+    rows = cursor.execute(DbRequests.requests_daily_select.value).fetchall()
+    users_rows = cursor.execute(DbRequests.users_daily_select.value).fetchall()
+    packages_rows = cursor.execute(DbRequests.packages_daily_select.value).fetchall()
+    return PeriodIndex(min_date=min_date, max_date=max_date, rows=rows, users_rows=users_rows,
+                       packages_rows=packages_rows, packages_exact_limit=packages_exact_limit)
@@ -0,0 +1,202 @@
+"""
+Модуль содержит профилирование этапов загрузки данных (launch.py --profile)
+Этапы размечаются в коде загрузки вызовом stage(имя) - пока профилирование не запущено (start_profile),
+stage возвращает пустой контекст без измерений
+По каждому этапу измеряются: время, процессорное время текущего процесса и завершившихся дочерних процессов
+(сбор данных при --workers > 1), количество строк и строк в секунду, пиковая память процесса (RSS) по окончании
+этапа и ее прирост за этап. Повторы этапа (например, по одному на каждый исходный файл) суммируются
+Пиковая память берется из resource.getrusage - в windows модуля resource нет, и память не измеряется
+"""
+
+
+import cProfile
+import io
+import json
+import os
+import platform
+import pstats
+import sys
+import time
+from typing import Dict, List, Optional
+
+
+# количество функций с наибольшим накопленным временем в отчете cProfile
+_CPROFILE_TOP = 30
+
+
+def _rusage_cpu_and_peak():
+    """:return: кортеж (процессорное время дочерних процессов, с; пиковая память процесса, МБ) - None без resource"""
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss в linux - КБ, в macOS - байты
+    scale = 1 if sys.platform == "darwin" else 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+    return children.ru_utime + children.ru_stime, peak
+
+
+class _StageTotals:
+    """Сумма измерений повторов одного этапа"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.wall = self.cpu = 0.0
+        self.rows: Optional[int] = None
+        self.peak_rss_mb: Optional[float] = None
+        self.rss_growth_mb: Optional[float] = None
+        self.profiles: List[cProfile.Profile] = []
+
+    def report(self) -> Dict:
+        result = dict(stage=self.name, calls=self.calls, wall_s=round(self.wall, 4), cpu_s=round(self.cpu, 4))
+        if self.rows is not None:
+            result.update(rows=self.rows, rows_per_s=round(self.rows / self.wall) if self.wall > 0 else None)
+        result.update(peak_rss_mb=None if self.peak_rss_mb is None else round(self.peak_rss_mb, 1),
+                      rss_growth_mb=None if self.rss_growth_mb is None else round(self.rss_growth_mb, 1))
+        return result
+
+
+class _Stage:
+    """Одно выполнение этапа, rows задается внутри контекста, если у этапа есть количество строк"""
+
+    def __init__(self, profiler: "_Profiler", name: str):
+        self._profiler = profiler
+        self._name = name
+        self.rows: Optional[int] = None
+
+    def __enter__(self):
+        self._profiler.enter(self, name=self._name)
+        self._wall, self._cpu = time.perf_counter(), time.process_time()
+        self._children_cpu, self._peak = _rusage_cpu_and_peak()
+        return self
+
+    def __exit__(self, *_):
+        wall, cpu = time.perf_counter() - self._wall, time.process_time() - self._cpu
+        children_cpu, peak = _rusage_cpu_and_peak()
+        if children_cpu is not None:
+            cpu += children_cpu - self._children_cpu
+        self._profiler.exit(self, name=self._name, wall=wall, cpu=cpu, rows=self.rows,
+                            peak=peak, growth=None if peak is None else peak - self._peak)
+
+
+class _NullStage:
+    """Этап без измерений - профилирование не запущено"""
+    rows: Optional[int] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+
+class _Profiler:
+    def __init__(self, cprofile: bool):
+        self._cprofile = cprofile
+        self._stages: Dict[str, _StageTotals] = dict()
+        self._running: List[_Stage] = []
+        self._profile: Optional[cProfile.Profile] = None
+        self.started = time.perf_counter()
+
+    def enter(self, current: _Stage, name: str):
+        # этапы в отчете - в порядке первого начала
+        self._stages.setdefault(name, _StageTotals(name))
+        self._running.append(current)
+        if self._cprofile and len(self._running) == 1:
+            # cProfile одновременно только у одного этапа - вложенные этапы входят в профиль внешнего
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def exit(self, current: _Stage, name: str, wall: float, cpu: float, rows: Optional[int],
+             peak: Optional[float], growth: Optional[float]):
+        self._running.remove(current)
+        totals = self._stages[name]
+        if self._profile is not None and not self._running:
+            self._profile.disable()
+            totals.profiles.append(self._profile)
+            self._profile = None
+        totals.calls += 1
+        totals.wall += wall
+        totals.cpu += cpu
+        if rows is not None:
+            totals.rows = (totals.rows or 0) + rows
+        if peak is not None:
+            totals.peak_rss_mb = peak
+            totals.rss_growth_mb = (totals.rss_growth_mb or 0) + growth
+
+    def slowest(self) -> Optional[_StageTotals]:
+        profiled = [totals for totals in self._stages.values() if totals.profiles]
+        return max(profiled, key=lambda totals: totals.wall) if profiled else None
+
+    def stages(self) -> List[Dict]:
+        return [totals.report() for totals in self._stages.values()]
+
+
+_NULL_STAGE = _NullStage()
+# профилирование текущего процесса, None - не запущено
+_active: Optional[_Profiler] = None
+
+
+def stage(name: str):
+    """
+    Контекст измерения этапа загрузки: with stage("collect") as current: ...; current.rows = количество строк
+    :param name: имя этапа, повторы этапа с тем же именем суммируются
+    :return:
+    """
+    if _active is None:
+        return _NULL_STAGE
+    return _Stage(_active, name)
+
+
+def start_profile(cprofile: bool = False):
+    """
+    Запускает профилирование этапов в текущем процессе
+    :param cprofile: true - дополнительно профилировать этапы через cProfile (замедляет загрузку)
+    :return:
+    """
+    global _active
+    _active = _Profiler(cprofile=cprofile)
+
+
+def finish_profile(report_path: str, error: Optional[str] = None) -> Dict:
+    """
+    Завершает профилирование и записывает отчет в формате json
+    При профилировании через cProfile статистика самого долгого этапа сохраняется в <report_path>.prof
+    (просмотр: python -m pstats), а функции с наибольшим накопленным временем включаются в отчет
+    :param report_path: путь к файлу отчета
+    :param error: ошибка загрузки - записывается в отчет
+    :return: отчет
+    """
+    global _active
+    profiler, _active = _active, None
+    _, peak = _rusage_cpu_and_peak()
+    report = dict(environment=dict(python=platform.python_version(), platform=platform.platform(),
+                                   cpu_count=os.cpu_count()),
+                  total_wall_s=round(time.perf_counter() - profiler.started, 4),
+                  peak_rss_mb=None if peak is None else round(peak, 1), error=error, stages=profiler.stages())
+    slowest = profiler.slowest()
+    if slowest is not None:
+        profile_path = f"{report_path}.prof"
+        text = io.StringIO()
+        stats = pstats.Stats(*slowest.profiles, stream=text)
+        stats.dump_stats(profile_path)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(_CPROFILE_TOP)
+        report["cprofile"] = dict(stage=slowest.name, file=profile_path, top=text.getvalue().splitlines())
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+def format_report(report: Dict) -> str:
+    """:return: таблица этапов отчета для вывода в консоль"""
+    lines = [f"{'этап':<20}{'вызовов':>8}{'время, с':>11}{'ЦП, с':>9}{'строк':>10}{'строк/с':>10}"
+             f"{'пик RSS, МБ':>13}{'прирост, МБ':>13}"]
+    for item in report["stages"]:
+        lines.append(f"{item['stage']:<20}{item['calls']:>8}{item['wall_s']:>11.3f}{item['cpu_s']:>9.3f}"
+                     f"{item.get('rows', ''):>10}{item.get('rows_per_s') or '':>10}"
+                     f"{item['peak_rss_mb'] if item['peak_rss_mb'] is not None else '':>13}"
+                     f"{item['rss_growth_mb'] if item['rss_growth_mb'] is not None else '':>13}")
+    lines.append(f"Всего: {report['total_wall_s']:.3f} с, пиковая память {report['peak_rss_mb']} МБ")
+    return "\n".join(lines)
@@ -0,0 +1,113 @@
+"""
+Модуль содержит счетчики производительности сервера БД: время этапов обработки запроса, задержки по видам
+запросов и количество соединений
+Время измеряется time.perf_counter_ns и накапливается в гистограммах с интервалами-степенями двойки микросекунд -
+запись одного значения не зависит от количества измерений и не выделяет память
+Счетчики ведутся, только если сервер запущен со сбором статистики (см. support_initializer.run_socketserver),
+иначе обработка запроса проверяет лишь отсутствие объекта статистики
+"""
+
+
+import threading
+import time
+from enum import Enum
+from typing import Dict, List
+
+
+# количество интервалов гистограммы: [0, 1) мкс, [1, 2) мкс, ... [2^(N-2), бесконечность) мкс
+_HISTOGRAM_BUCKETS = 26
+
+
+class Stage(Enum):
+    decode = "decode"  # разбор запроса (json или двоичного)
+    data = "data"      # данные за период при промахе кэша ответов: индекс в памяти или sql запрос
+    encode = "encode"  # сериализация ответа при промахе кэша ответов
+    send = "send"      # отправка ответа клиенту
+
+
+class RequestKind(Enum):
+    hello = "hello"
+    meta = "meta"
+    stats = "stats"
+    period = "period"
+    period_binary = "period_binary"
+    batch = "batch"
+    series = "series"
+
+
+class _Histogram:
+    """Гистограмма длительностей, интервал i - [2^(i-1), 2^i) микросекунд, интервал 0 - меньше микросекунды"""
+
+    def __init__(self):
+        self.counts: List[int] = [0] * _HISTOGRAM_BUCKETS
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def add(self, ns: int):
+        self.counts[min((ns // 1000).bit_length(), _HISTOGRAM_BUCKETS - 1)] += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def _percentile_us(self, count: int, share: float) -> int:
+        """:return: верхняя граница интервала, в который попадает перцентиль, микросекунд"""
+        rank, seen = share * count, 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return 1 << i
+        return 1 << (_HISTOGRAM_BUCKETS - 1)
+
+    def summary(self) -> Dict:
+        count = sum(self.counts)
+        if not count:
+            return dict(count=0)
+        return dict(count=count, mean_us=round(self.total_ns / count / 1000, 1), max_us=round(self.max_ns / 1000, 1),
+                    p50_us=self._percentile_us(count, 0.5), p95_us=self._percentile_us(count, 0.95),
+                    p99_us=self._percentile_us(count, 0.99),
+                    histogram=[[1 << i, bucket_count] for i, bucket_count in enumerate(self.counts) if bucket_count])
+
+
+class ServerStats:
+    """
+    Потокобезопасные счетчики сервера БД
+    Перцентили в summary - верхние границы интервалов гистограммы, т.е. с точностью до двух раз
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._stages: Dict[Stage, _Histogram] = {stage: _Histogram() for stage in Stage}
+        self._requests: Dict[RequestKind, _Histogram] = {kind: _Histogram() for kind in RequestKind}
+        self.active_connections = 0
+        self.total_connections = 0
+
+    def connection_opened(self):
+        with self._lock:
+            self.active_connections += 1
+            self.total_connections += 1
+
+    def connection_closed(self):
+        with self._lock:
+            self.active_connections -= 1
+
+    def record_stage(self, stage: Stage, ns: int):
+        with self._lock:
+            self._stages[stage].add(ns)
+
+    def record_request(self, kind: RequestKind, ns: int):
+        """
+        :param kind: вид запроса
+        :param ns: время формирования ответа (без отправки), наносекунд
+        :return:
+        """
+        with self._lock:
+            self._requests[kind].add(ns)
+
+    def summary(self) -> Dict:
+        with self._lock:
+            return dict(uptime_s=round(time.monotonic() - self._started, 1),
+                        connections=dict(active=self.active_connections, total=self.total_connections),
+                        requests={kind.value: histogram.summary() for kind, histogram in self._requests.items()
+                                  if any(histogram.counts)},
+                        stages={stage.value: histogram.summary() for stage, histogram in self._stages.items()})
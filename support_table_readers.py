@@ -0,0 +1,154 @@
+"""
+Модуль для потокового чтения исходных данных из csv и parquet файлов
+Файлы представлены как лист с интерфейсом чтения, совместимым с openpyxl ReadOnlyWorksheet.iter_rows(values_only=True):
+первая строка - заголовок, пустые значения - None, поэтому поиск колонок и сбор данных (support_file_reader)
+работают с ними так же, как с листом xlsx
+parquet читается через pyarrow - необязательную зависимость, без нее чтение parquet недоступно
+"""
+
+
+import csv
+from itertools import islice, repeat
+from typing import Iterable, Iterator, Optional, Tuple
+
+
+# разделители, среди которых определяется разделитель csv файла
+_CSV_DELIMITERS = (",", ";", "\t")
+# объем начала csv файла для определения разделителя, символов
+_CSV_SAMPLE_SIZE = 1 << 16
+# количество записей начала файла, среди которых ищется строка заголовка
+_HEADER_SEARCH_ROWS = 50
+# количество строк в одной порции чтения parquet файла
+_PARQUET_BATCH_ROWS = 1 << 16
+
+
+class SourceFormatError(Exception):
+    """Файл не может быть прочитан в заявленном формате"""
+
+
+class CsvSheet:
+    """
+    csv файл в кодировке utf-8 (в т.ч. с BOM, как сохраняет Excel)
+    Разделитель - тот из _CSV_DELIMITERS, при котором в начале файла находится строка со всеми header_names
+    Номер строки - номер записи csv, запись со значением в несколько строк текста считается одной строкой
+    Каждый обход iter_rows открывает файл заново, обходы независимы
+    """
+
+    def __init__(self, filename: str, header_names: Iterable[str]):
+        self._filename = filename
+        self._delimiter = self._detect_delimiter(header_names=set(header_names))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        pass
+
+    def _detect_delimiter(self, header_names: set) -> str:
+        try:
+            with open(self._filename, newline="", encoding="utf-8-sig") as f:
+                sample = f.read(_CSV_SAMPLE_SIZE)
+        except UnicodeDecodeError as err:
+            raise SourceFormatError(f"не является csv файлом в кодировке utf-8 - {err}") from err
+        lines = sample.splitlines(keepends=True)
+        if len(sample) == _CSV_SAMPLE_SIZE and len(lines) > 1:
+            # последняя строка образца может быть оборвана
+            lines.pop()
+        for delimiter in _CSV_DELIMITERS:
+            try:
+                for row in islice(csv.reader(lines, delimiter=delimiter), _HEADER_SEARCH_ROWS):
+                    if header_names.issubset(row):
+                        return delimiter
+            except csv.Error:
+                continue
+        return _CSV_DELIMITERS[0]
+
+    def iter_rows(self, min_row: int = 1, max_row: Optional[int] = None, values_only: bool = True):
+        """
+        Построчный обход файла, аналог openpyxl ReadOnlyWorksheet.iter_rows
+        Строки дополняются значениями None до ширины самой длинной из уже прочитанных строк
+        :param min_row: номер первой строки, с 1
+        :param max_row: номер последней строки включительно
+        :param values_only: поддерживается только True
+        :return: генератор кортежей значений
+        """
+        if not values_only:
+            raise SourceFormatError("поддерживается только чтение значений")
+        return self._rows(min_row=min_row, max_row=max_row)
+
+    def _rows(self, min_row: int, max_row: Optional[int]) -> Iterator[tuple]:
+        width = 0
+        try:
+            with open(self._filename, newline="", encoding="utf-8-sig") as f:
+                reader = csv.reader(f, delimiter=self._delimiter)
+                for row in islice(reader, min_row - 1, max_row):
+                    if len(row) < width:
+                        row += [""] * (width - len(row))
+                    else:
+                        width = len(row)
+                    yield tuple([value or None for value in row])
+        except (UnicodeDecodeError, csv.Error) as err:
+            raise SourceFormatError(f"не является csv файлом в кодировке utf-8 - {err}") from err
+
+
+class ParquetSheet:
+    """
+    parquet файл, первая строка - имена колонок схемы
+    Колонки хранятся раздельно, поэтому после use_columns читаются только нужные колонки
+    """
+
+    def __init__(self, filename: str):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as err:
+            raise SourceFormatError("для чтения parquet требуется пакет pyarrow") from err
+        try:
+            self._file = pyarrow.parquet.ParquetFile(filename)
+        except pyarrow.ArrowException as err:
+            raise SourceFormatError(f"не является файлом формата parquet - {err}") from err
+        self._names: Tuple[str, ...] = tuple(self._file.schema_arrow.names)
+        self._columns: Optional[Tuple[int, ...]] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def use_columns(self, columns: Iterable[int]):
+        """
+        Ограничивает чтение указанными колонками - значения остальных колонок не читаются и равны None
+        :param columns: индексы колонок с нуля
+        :return:
+        """
+        self._columns = tuple(sorted(set(columns)))
+
+    def iter_rows(self, min_row: int = 1, max_row: Optional[int] = None, values_only: bool = True):
+        """
+        Построчный обход файла, аналог openpyxl ReadOnlyWorksheet.iter_rows
+        :param min_row: номер первой строки, с 1
+        :param max_row: номер последней строки включительно
+        :param values_only: поддерживается только True
+        :return: генератор кортежей значений
+        """
+        if not values_only:
+            raise SourceFormatError("поддерживается только чтение значений")
+        return islice(self._rows(), min_row - 1, max_row)
+
+    def _rows(self) -> Iterator[tuple]:
+        yield self._names
+        columns = self._columns if self._columns else tuple(range(len(self._names)))
+        width = columns[-1] + 1 if columns else 0
+        for batch in self._file.iter_batches(batch_size=_PARQUET_BATCH_ROWS,
+                                             columns=[self._names[col] for col in columns]):
+            values = [repeat(None)] * width
+            for col, column in zip(columns, batch.columns):
+                values[col] = column.to_pylist()
+            yield from zip(*values)
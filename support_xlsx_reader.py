@@ -0,0 +1,454 @@
+"""
+Модуль для быстрого потокового чтения листа xlsx файла без openpyxl
+Читает xml прямо из zip архива потоково: лист - парсером expat с обработчиками событий (ParserCreate),
+описание книги, связи и общие строки - инкрементальным парсером iterparse
+Повторяет значения ячеек, которые выдает openpyxl в режиме read_only=True, data_only=True
+При встрече неподдерживаемых возможностей формата выбрасывает UnsupportedXlsxError - в этом случае
+файл нужно прочитать через openpyxl
+"""
+
+
+import re
+import zipfile
+import posixpath
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Optional, Tuple, Iterable
+from xml.etree.ElementTree import iterparse, ParseError
+from xml.parsers.expat import ParserCreate, ExpatError
+
+
+_MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_PACKAGE_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+_WORKBOOK_PATH = "xl/workbook.xml"
+_WORKBOOK_RELS_PATH = "xl/_rels/workbook.xml.rels"
+_SHARED_STRINGS_TYPE = f"{_REL_NS}/sharedStrings"
+_STYLES_TYPE = f"{_REL_NS}/styles"
+
+_WINDOWS_EPOCH = datetime(1899, 12, 30)
+_MAC_EPOCH = datetime(1904, 1, 1)
+
+# встроенные форматы дат, см. openpyxl.styles.numbers.BUILTIN_FORMATS
+_BUILTIN_DATE_FORMATS = {14: 'mm-dd-yy', 15: 'd-mmm-yy', 16: 'd-mmm', 17: 'mmm-yy', 18: 'h:mm AM/PM',
+                         19: 'h:mm:ss AM/PM', 20: 'h:mm', 21: 'h:mm:ss', 22: 'm/d/yy h:mm',
+                         45: 'mm:ss', 46: '[h]:mm:ss', 47: 'mmss.0'}
+_STRIP_FORMAT_RE = re.compile(r'".*?"|\[(?!hh?\]|mm?\]|ss?\])[^\]]*\]')
+_DATE_FORMAT_RE = re.compile(r"[^\\][dmhysDMHYS]")
+_TIMEDELTA_FORMAT_RE = re.compile(r'\[hh?\](:mm(:ss(\.0*)?)?)?|\[mm?\](:ss(\.0*)?)?|\[ss?\](\.0*)?', re.I)
+_DIMENSION_RE = re.compile(r"^[A-Z]+\d+:([A-Z]+)\d+$")
+
+
+class UnsupportedXlsxError(Exception):
+    """Файл использует возможности формата, которые не поддерживаются быстрым чтением"""
+
+
+def _tag(name: str) -> str:
+    return f"{{{_MAIN_NS}}}{name}"
+
+
+def _expat_tag(name: str) -> str:
+    return f"{_MAIN_NS}}}{name}"
+
+
+_SHARED_STRING_TAG, _RICH_TEXT_TAG, _RUN_TAG = _tag("si"), _tag("t"), _tag("r")
+_SHEET_DATA_TAG, _DIMENSION_TAG = _tag("sheetData"), _tag("dimension")
+
+# имена элементов листа в формате expat с разделителем пространства имен "}"
+_ROW_TAG, _CELL_TAG, _VALUE_TAG = _expat_tag("row"), _expat_tag("c"), _expat_tag("v")
+_INLINE_TAG, _TEXT_TAG, _PHONETIC_TAG = _expat_tag("is"), _expat_tag("t"), _expat_tag("rPh")
+
+_READ_CHUNK_SIZE = 1 << 16
+_ROOT_TAG_RE = re.compile(rb"<worksheet\b[^>]*>")
+_ROW_NUMBER_RE = re.compile(rb"<row\b[^>]*?\sr=\"(\d+)\"")  # для re.match с позиции начала тега
+
+
+def _column_index(letters: str) -> int:
+    """Индекс колонки с нуля по буквенному обозначению: A -> 0, AA -> 26"""
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+
+def _is_date_format(fmt: str) -> bool:
+    fmt = _STRIP_FORMAT_RE.sub("", fmt.split(";")[0])
+    return _DATE_FORMAT_RE.search(fmt) is not None
+
+
+def _rich_text(element) -> str:
+    """Текст элемента si или is без форматирования: t и t внутри r, фонетические подсказки пропускаются"""
+    snippets = []
+    for child in element:
+        if child.tag == _RICH_TEXT_TAG:
+            snippets.append(child.text or "")
+        elif child.tag == _RUN_TAG:
+            text = child.find(_RICH_TEXT_TAG)
+            if text is not None:
+                snippets.append(text.text or "")
+    return "".join(snippets)
+
+
+def _cast_number(value: str):
+    if "." in value or "E" in value or "e" in value:
+        return float(value)
+    return int(value)
+
+
+def _from_excel(value, epoch: datetime):
+    day, fraction = divmod(value, 1)
+    diff = timedelta(milliseconds=round(fraction * 86400 * 1000))
+    if 0 <= value < 1 and diff.days == 0:
+        return (datetime.min + diff).time()
+    if 0 < value < 60 and epoch == _WINDOWS_EPOCH:
+        day += 1
+    return epoch + timedelta(days=day) + diff
+
+
+class _RowsParserState:
+    """Состояние разбора листа между вызовами обработчиков expat"""
+    __slots__ = ("row_counter", "col_counter", "values", "in_cell", "in_inline", "in_phonetic",
+                 "cell_attrs", "text", "chunks")
+
+    def __init__(self):
+        self.row_counter, self.col_counter, self.values = 0, -1, dict()
+        self.in_cell = self.in_inline = self.in_phonetic = False
+        self.cell_attrs, self.text, self.chunks = None, None, None
+
+
+class SheetDecoder:
+    """
+    Преобразование xml строк листа в значения ячеек - все, что для этого нужно знать о книге
+    Объект сериализуем (pickle) и может быть передан в другие процессы для разбора блоков листа
+    """
+
+    def __init__(self, shared_strings: list, date_styles: frozenset, timedelta_styles: frozenset,
+                 epoch: datetime, width: Optional[int]):
+        self._shared_strings = shared_strings
+        self._date_styles = date_styles
+        self._timedelta_styles = timedelta_styles
+        self._epoch = epoch
+        self._width = width
+        self._columns: Optional[Tuple[int, ...]] = None
+
+    def use_columns(self, columns: Iterable[int]):
+        self._columns = tuple(sorted(set(columns)))
+        if self._width is not None and self._columns and self._columns[-1] >= self._width:
+            raise UnsupportedXlsxError("колонки за пределами размерности листа")
+
+    def _cell_value(self, data_type: str, style_id: str, raw: Optional[str], coordinate: Optional[str]):
+        if data_type == "inlineStr":
+            return raw
+        value = raw or None
+        if value is None:
+            return None
+        if data_type == "n":
+            value = _cast_number(value)
+            style_id = int(style_id)
+            if style_id in self._date_styles:
+                if style_id in self._timedelta_styles:
+                    raise UnsupportedXlsxError(f"ячейка {coordinate} - формат длительности")
+                value = _from_excel(value, self._epoch)
+            return value
+        if data_type == "s":
+            return self._shared_strings[int(value)]
+        if data_type == "b":
+            return bool(int(value))
+        if data_type == "d":
+            return datetime.fromisoformat(value.rstrip("Z"))
+        if data_type in ("str", "e"):
+            return value
+        raise UnsupportedXlsxError(f"ячейка {coordinate} - неизвестный тип {data_type}")
+
+    def _parse_rows(self, chunks: Iterable[bytes], first_row: int) -> Iterator[Tuple[int, Dict[int, object]]]:
+        """
+        Разбор xml листа парсером expat с обработчиками событий - в отличие от iterparse не строит элементы,
+        а текст собирается только для ячеек нужных колонок
+        """
+        columns = None if self._columns is None else frozenset(self._columns)
+        letters_to_index = dict()
+        rows, state = [], _RowsParserState()
+        state.row_counter = first_row - 1
+
+        def start_element(name, attrs):
+            if name == _CELL_TAG:
+                coordinate = attrs.get("r")
+                if coordinate:
+                    letters = coordinate.rstrip("0123456789")
+                    col_ind = letters_to_index.get(letters)
+                    if col_ind is None:
+                        col_ind = letters_to_index[letters] = _column_index(letters)
+                    state.col_counter = col_ind
+                else:
+                    state.col_counter += 1
+                state.in_cell = columns is None or state.col_counter in columns
+                if state.in_cell:
+                    state.cell_attrs, state.text = attrs, None
+            elif not state.in_cell:
+                if name == _ROW_TAG:
+                    state.row_counter = int(attrs.get("r", state.row_counter + 1))
+                    state.col_counter, state.values = -1, dict()
+            elif name == _VALUE_TAG or name == _TEXT_TAG and state.in_inline and not state.in_phonetic:
+                state.chunks = []
+                if state.text is None:
+                    state.text = ""
+            elif name == _INLINE_TAG:
+                state.in_inline, state.text = True, ""
+            elif name == _PHONETIC_TAG:
+                state.in_phonetic = True
+
+        def end_element(name):
+            if name == _ROW_TAG:
+                rows.append((state.row_counter, state.values))
+            elif not state.in_cell:
+                return
+            elif name == _CELL_TAG:
+                attrs = state.cell_attrs
+                state.values[state.col_counter] = self._cell_value(data_type=attrs.get("t", "n"),
+                                                                   style_id=attrs.get("s", "0"),
+                                                                   raw=state.text, coordinate=attrs.get("r"))
+                state.in_cell = state.in_inline = False
+            elif state.chunks is not None and (name == _VALUE_TAG or name == _TEXT_TAG):
+                state.text += "".join(state.chunks)
+                state.chunks = None
+            elif name == _PHONETIC_TAG:
+                state.in_phonetic = False
+
+        def character_data(data):
+            if state.chunks is not None:
+                state.chunks.append(data)
+
+        parser = ParserCreate(namespace_separator="}")
+        parser.buffer_text = True
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        parser.CharacterDataHandler = character_data
+        for chunk in chunks:
+            parser.Parse(chunk, False)
+            yield from rows
+            rows.clear()
+        parser.Parse(b"", True)
+        yield from rows
+
+    def _values_row(self, values: Dict[int, object]) -> tuple:
+        width = self._width
+        if width is None:
+            width = max(values) + 1 if values else 0
+        if self._columns is not None and self._columns:
+            width = max(width, self._columns[-1] + 1)
+        row = [None] * width
+        for col_ind, value in values.items():
+            if col_ind < width:
+                row[col_ind] = value
+        return tuple(row)
+
+    def iter_rows(self, chunks: Iterable[bytes], min_row: int = 1, max_row: Optional[int] = None,
+                  first_row: int = 1):
+        """
+        Построчный обход xml листа, поданного частями, пропущенные строки выдаются как строки из None
+        :param chunks: xml листа или блока листа (см. XlsxStreamSheet.iter_row_blocks) по частям
+        :param min_row: номер первой строки, с 1
+        :param max_row: номер последней строки включительно
+        :param first_row: номер первой строки xml - для строк без атрибута r
+        :return: генератор кортежей значений
+        """
+        empty_row = self._values_row(dict())
+        counter = min_row
+        try:
+            for row_ind, values in self._parse_rows(chunks, first_row=first_row):
+                if max_row is not None and row_ind > max_row:
+                    break
+                while counter < row_ind:
+                    counter += 1
+                    yield empty_row
+                if counter <= row_ind:
+                    counter += 1
+                    yield self._values_row(values)
+        except (ExpatError, ValueError, IndexError) as err:
+            raise UnsupportedXlsxError(f"данные листа - {err}") from err
+
+
+class XlsxStreamSheet:
+    """
+    Лист xlsx файла с интерфейсом чтения, совместимым с openpyxl ReadOnlyWorksheet.iter_rows(values_only=True)
+    Используется как контекстный менеджер, архив закрывается при выходе
+    """
+
+    def __init__(self, filename: str, sheet_name: str):
+        self._archive = zipfile.ZipFile(filename)
+        try:
+            self._open_workbook(sheet_name=sheet_name)
+        except (ParseError, KeyError, ValueError) as err:
+            self._archive.close()
+            raise UnsupportedXlsxError(f"структура книги - {err}") from err
+        except BaseException:
+            self._archive.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        self._archive.close()
+
+    def _read_xml(self, path: str):
+        with self._archive.open(path) as f:
+            for _, element in iterparse(f):
+                yield element
+
+    def _open_workbook(self, sheet_name: str):
+        names = set(self._archive.namelist())
+        if _WORKBOOK_PATH not in names:
+            raise UnsupportedXlsxError("отсутствует xl/workbook.xml")
+
+        relations = dict()
+        for element in self._read_xml(_WORKBOOK_RELS_PATH):
+            if element.tag == f"{{{_PACKAGE_REL_NS}}}Relationship":
+                target = element.get("Target")
+                target = target.lstrip("/") if target.startswith("/") else posixpath.join("xl", target)
+                relations[element.get("Id")] = (element.get("Type"), posixpath.normpath(target))
+
+        epoch, sheets, active = _WINDOWS_EPOCH, [], 0
+        for element in self._read_xml(_WORKBOOK_PATH):
+            if element.tag == _tag("workbookPr") and element.get("date1904") in ("1", "true"):
+                epoch = _MAC_EPOCH
+            elif element.tag == _tag("workbookView"):
+                active = int(element.get("activeTab", 0))
+            elif element.tag == _tag("sheet"):
+                sheets.append((element.get("name"), element.get(f"{{{_REL_NS}}}id")))
+        if not sheets:
+            raise UnsupportedXlsxError("в книге нет листов")
+        names_to_ids = dict(sheets)
+        relation_id = names_to_ids[sheet_name] if sheet_name in names_to_ids else sheets[active][1]
+        self._sheet_path = relations[relation_id][1]
+
+        paths_by_type = {rel_type: path for rel_type, path in relations.values()}
+        date_styles, timedelta_styles = self._read_date_styles(paths_by_type.get(_STYLES_TYPE))
+        self.decoder = SheetDecoder(shared_strings=self._read_shared_strings(paths_by_type.get(_SHARED_STRINGS_TYPE)),
+                                    date_styles=date_styles, timedelta_styles=timedelta_styles,
+                                    epoch=epoch, width=self._read_dimension())
+
+    def _read_shared_strings(self, path: Optional[str]) -> list:
+        if path is None:
+            return []
+        strings = []
+        for element in self._read_xml(path):
+            if element.tag == _SHARED_STRING_TAG:
+                strings.append(_rich_text(element).replace('x005F_', ''))
+                element.clear()
+        return strings
+
+    def _read_date_styles(self, path: Optional[str]) -> Tuple[frozenset, frozenset]:
+        if path is None:
+            return frozenset(), frozenset()
+        custom_formats, style_formats, in_cell_xfs = dict(), [], False
+        with self._archive.open(path) as f:
+            for event, element in iterparse(f, events=("start", "end")):
+                if element.tag == _tag("cellXfs"):
+                    in_cell_xfs = event == "start"
+                elif event == "end" and element.tag == _tag("numFmt"):
+                    custom_formats[int(element.get("numFmtId"))] = element.get("formatCode")
+                elif event == "end" and element.tag == _tag("xf") and in_cell_xfs:
+                    style_formats.append(int(element.get("numFmtId", 0)))
+
+        date_styles, timedelta_styles = set(), set()
+        for style_id, format_id in enumerate(style_formats):
+            fmt = custom_formats.get(format_id, _BUILTIN_DATE_FORMATS.get(format_id))
+            if fmt is not None and _is_date_format(fmt):
+                date_styles.add(style_id)
+                if _TIMEDELTA_FORMAT_RE.search(fmt.split(";")[0]) is not None:
+                    timedelta_styles.add(style_id)
+        return frozenset(date_styles), frozenset(timedelta_styles)
+
+    def _read_dimension(self) -> Optional[int]:
+        with self._archive.open(self._sheet_path) as f:
+            for _, element in iterparse(f, events=("start",)):
+                if element.tag == _DIMENSION_TAG:
+                    match = _DIMENSION_RE.match(element.get("ref", ""))
+                    return _column_index(match.group(1)) + 1 if match else None
+                if element.tag == _SHEET_DATA_TAG:
+                    return None
+        return None
+
+    def use_columns(self, columns: Iterable[int]):
+        """
+        Ограничивает чтение указанными колонками - значения остальных ячеек не разбираются и равны None
+        :param columns: индексы колонок с нуля
+        :return:
+        """
+        self.decoder.use_columns(columns)
+
+    def _sheet_chunks(self) -> Iterator[bytes]:
+        with self._archive.open(self._sheet_path) as f:
+            while chunk := f.read(_READ_CHUNK_SIZE):
+                yield chunk
+
+    def iter_rows(self, min_row: int = 1, max_row: Optional[int] = None, values_only: bool = True):
+        """
+        Построчный обход листа, аналог openpyxl ReadOnlyWorksheet.iter_rows
+        Пропущенные в файле строки выдаются как строки из None
+        :param min_row: номер первой строки, с 1
+        :param max_row: номер последней строки включительно
+        :param values_only: поддерживается только True
+        :return: генератор кортежей значений
+        """
+        if not values_only:
+            raise UnsupportedXlsxError("поддерживается только чтение значений")
+        return self.decoder.iter_rows(chunks=self._sheet_chunks(), min_row=min_row, max_row=max_row)
+
+    def iter_row_blocks(self, block_size: int) -> Iterator[Tuple[int, int, bytes]]:
+        """
+        Делит xml листа на самостоятельные xml документы примерно по block_size байт, граница - конец строки
+        Блоки разбираются независимо через SheetDecoder.iter_rows, в т.ч. в других процессах
+        Первая и последняя строки блока должны иметь номер (атрибут r), иначе номера строк блока
+        зависят от всех предыдущих блоков
+        :param block_size: размер блока в байтах
+        :return: генератор кортежей (номер первой строки, номер последней строки, xml блока)
+        """
+        chunks, buffer = self._sheet_chunks(), b""
+        while (data_start := buffer.find(b"<sheetData")) < 0 or buffer.find(b">", data_start) < 0:
+            chunk = next(chunks, b"")
+            if not chunk:
+                return
+            buffer += chunk
+        data_open_end = buffer.find(b">", data_start) + 1
+        if buffer[data_open_end - 2:data_open_end] == b"/>":
+            return
+        root_match = _ROOT_TAG_RE.search(buffer, 0, data_start)
+        if root_match is None:
+            raise UnsupportedXlsxError("корневой элемент листа не распознан")
+        block_head = root_match.group(0) + b"<sheetData>"
+
+        pending, finished = [buffer[data_open_end:]], False
+        pending_size = len(pending[0])
+        while not finished:
+            chunk = next(chunks, b"")
+            pending.append(chunk)
+            pending_size += len(chunk)
+            finished = not chunk
+            if pending_size < block_size and not finished:
+                continue
+
+            buffer = b"".join(pending)
+            data_end = buffer.find(b"</sheetData>")
+            if data_end >= 0:
+                buffer, finished = buffer[:data_end], True
+            split = len(buffer) if finished else buffer.rfind(b"</row>")
+            if split < 0:
+                pending, pending_size = [buffer], len(buffer)
+                continue
+            if not finished:
+                split += len(b"</row>")
+            block, buffer = buffer[:split], buffer[split:]
+            pending, pending_size = [buffer], len(buffer)
+            if not block.strip():
+                continue
+
+            first = _ROW_NUMBER_RE.match(block, block.find(b"<row"))
+            last = _ROW_NUMBER_RE.match(block, block.rfind(b"<row"))
+            if first is None or last is None:
+                raise UnsupportedXlsxError("строки листа без номеров")
+            yield int(first.group(1)), int(last.group(1)), block_head + block + b"</sheetData></worksheet>"